@@ -0,0 +1,48 @@
+###BENCHMARK FOR THE COURSE PAGE PARSER BACKENDS IN HTMLPARSERS.PY. RUN "python bench_parsers.py [pages...]"; DEFAULTS TO THE SAVED PAGES IN fixtures/pages###
+import argparse
+import glob
+import os
+import statistics
+import time
+import tracemalloc
+from htmlparsers import available_backends, parse_content_blocks
+
+FIXTURE_PAGES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "pages", "*.html")
+
+# Function to time one backend on one page; returns (median seconds, peak traced bytes, block count)
+def measure(html, backend, repeats):
+    # Warm up once so imports and caches are not counted
+    blocks = parse_content_blocks(html, backend)
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        parse_content_blocks(html, backend)
+        timings.append(time.perf_counter() - start)
+    # Memory is traced separately because tracemalloc slows parsing down
+    tracemalloc.start()
+    parse_content_blocks(html, backend)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return statistics.median(timings), peak, len(blocks)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare per-page parse time and peak memory of each parser backend.")
+    parser.add_argument("pages", nargs="*", help="HTML files to parse (default: fixtures/pages/*.html)")
+    parser.add_argument("--repeats", type=int, default=20, help="timed runs per page and backend")
+    args = parser.parse_args()
+
+    pages = args.pages or sorted(glob.glob(FIXTURE_PAGES))
+    print(f"{'page':<24}{'backend':<14}{'blocks':>8}{'median ms':>12}{'peak KiB':>12}{'speedup':>10}")
+    for page in pages:
+        with open(page, "rb") as f:
+            html = f.read()
+        results = {backend: measure(html, backend, args.repeats) for backend in available_backends()}
+        baseline = results["html.parser"][0]
+        for backend, (seconds, peak, blocks) in results.items():
+            print(f"{os.path.basename(page):<24}{backend:<14}{blocks:>8}{seconds * 1000:>12.2f}"
+                  f"{peak / 1024:>12.0f}{baseline / seconds:>9.1f}x")
+    # tracemalloc only sees Python allocations; memory used inside lxml/lexbor's C code is not included
+    print("peak KiB is the Python heap peak reported by tracemalloc (C parser buffers are not counted).")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+###OFFLINE BENCHMARK FOR THE REST SYNC, THE PAGE SCRAPER AND THE CALENDAR ROUTES. RUN "python bench_sync.py --courses 20 --items 200 --events 500"; RESULTS ARE SAVED TO bench_results/ AND COMPARED WITH THE PREVIOUS RUN###
+import argparse
+import glob
+import json
+import math
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+import httplib2
+import pymongo
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from benchstubs import Scale, serve_stubs
+
+# The in-memory MongoDB used when no --mongo-uri is given; optional like the fast parser backends
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_results")
+BENCH_DB = "edusync_bench"
+# Throughput drops or p99 increases larger than this (percent) are flagged as regressions
+REGRESSION_THRESHOLD = 10.0
+
+# Function to return the value below which `fraction` of the sorted samples fall (nearest rank)
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[max(0, min(len(ordered) - 1, math.ceil(fraction * len(ordered)) - 1))]
+
+# Function to run `operation` `runs` times; returns throughput, latency percentiles and peak memory
+def measure(operation, runs, units_per_run):
+    latencies = []
+    units = 0
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = operation()
+        latencies.append(time.perf_counter() - start)
+        units += units_per_run(result)
+    # One extra traced run for memory, since tracemalloc slows everything down
+    tracemalloc.start()
+    operation()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "runs": runs,
+        "units": units,
+        "throughput": units / max(sum(latencies), 1e-9),
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "first_ms": latencies[0] * 1000,
+        "peak_kib": peak / 1024,
+    }
+
+# Function to start both stub servers in their own process; returns (process, blackboard URL, google URL)
+def start_stubs(scale):
+    ports = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve_stubs, args=(scale, ports), daemon=True)
+    process.start()
+    blackboard_port, google_port = ports.get(timeout=30)
+    return process, f"http://127.0.0.1:{blackboard_port}", f"http://127.0.0.1:{google_port}"
+
+# Function to point the parsers at the benchmark database instead of the real one
+def import_parsers(mongo_client):
+    import contentstore
+    import parsecontent1
+    import parsecontent2
+    contentstore.init(client=mongo_client, db_name=BENCH_DB)
+    return parsecontent1, parsecontent2
+
+def bench_rest(parsecontent1, blackboard_url, scale, runs, workdir):
+    parsecontent1.BB_API_URL = f"{blackboard_url}/learn/api/public/v1"
+    parsecontent1.GRADEBOOK_API_URL = f"{blackboard_url}/learn/api/public/v2"
+    parsecontent1.COURSES_FILE = os.path.join(workdir, "courses.json")
+    with open(parsecontent1.COURSES_FILE, "w") as f:
+        json.dump(scale.course_ids(), f)
+    return measure(parsecontent1.check_for_changes, runs, lambda stats: stats["items"])
+
+def bench_scrape(parsecontent2, blackboard_url, runs):
+    from httpclient import ValidatorCache
+    from scrapesession import BlackboardSession
+    parsecontent2.BB_URL = blackboard_url
+    parsecontent2.LOGIN_URL = f"{blackboard_url}/webapps/login/"
+    parsecontent2.validator_cache = ValidatorCache()
+    # Cookies stay in memory so the benchmark never touches the real cookie jars
+    parsecontent2.blackboard = BlackboardSession(parsecontent2.LOGIN_URL, "bench", {}, cookie_dir=None)
+    parsecontent2.login_to_blackboard()
+    full = measure(lambda: parsecontent2.scrape_course_content(conditional=False), runs, len)
+    # Prime the validators, then measure the 304 path that idle courses take
+    parsecontent2.scrape_course_content()
+    parsecontent2.validator_cache.commit(parsecontent2.course_url(parsecontent2.COURSE_ID))
+    unchanged = measure(lambda: parsecontent2.scrape_course_content(), runs, lambda items: 1)
+    return full, unchanged
+
+def calendar_service(google_url):
+    # The recorded discovery document, pointed at the stub so batch requests go there too
+    document = json.loads(get_static_doc("calendar", "v3"))
+    document["rootUrl"] = f"{google_url}/"
+    return build_from_document(document, http=httplib2.Http())
+
+def bench_calendar(google_url, requests_per_route, bulk_size, workdir):
+    import calender
+    from calendarsync import EventMirror
+    service = calendar_service(google_url)
+    client = calender.app.test_client()
+    day = (datetime.now(timezone.utc).date() + timedelta(days=3)).isoformat()
+    events = [{"name": f"Bench event {number}", "date": day} for number in range(bulk_size)]
+    with patch.object(calender, "authenticate_google_calendar", return_value=service), \
+            patch.object(calender, "get_event_mirror", return_value=EventMirror(os.path.join(workdir, "events.sqlite3"))):
+        results = {}
+        results["calendar_index"] = measure(lambda: client.get("/"), requests_per_route, lambda response: 1)
+        results["calendar_create"] = measure(
+            lambda: client.post("/create_event", data={"event_name": "Bench", "event_date": day},
+                                follow_redirects=True),
+            requests_per_route, lambda response: 1)
+        results["calendar_bulk"] = measure(lambda: client.post("/events/bulk", json={"create": events}),
+                                           max(1, requests_per_route // 10),
+                                           lambda response: len(response.get_json()["created"]))
+    return results
+
+# Function to describe the code being measured so stored results can be told apart
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+# Function to find the newest stored run made with the same scale
+def previous_run(results_dir, params):
+    for path in sorted(glob.glob(os.path.join(results_dir, "*.json")), reverse=True):
+        with open(path) as f:
+            run = json.load(f)
+        if run.get("params") == params:
+            return path, run
+    return None, None
+
+# Function to compare two runs; returns lines describing every change and whether any is a regression
+def compare(current, baseline, threshold=REGRESSION_THRESHOLD):
+    lines = []
+    regressed = False
+    for name, result in current.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        throughput = (result["throughput"] / before["throughput"] - 1) * 100 if before["throughput"] else 0.0
+        p99 = (result["p99_ms"] / before["p99_ms"] - 1) * 100 if before["p99_ms"] else 0.0
+        flag = ""
+        if throughput < -threshold or p99 > threshold:
+            flag = "  REGRESSION"
+            regressed = True
+        lines.append(f"{name:<18}throughput {throughput:+7.1f}%   p99 {p99:+7.1f}%{flag}")
+    return lines, regressed
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure sync and calendar throughput against local stub servers.")
+    parser.add_argument("--courses", type=int, default=10, help="Blackboard courses to sync")
+    parser.add_argument("--items", type=int, default=200, help="content items per course and blocks on the scraped page")
+    parser.add_argument("--events", type=int, default=500, help="events in the stub Google calendar")
+    parser.add_argument("--runs", type=int, default=5, help="timed runs of each sync job")
+    parser.add_argument("--requests", type=int, default=100, help="timed requests per calendar route")
+    parser.add_argument("--bulk-size", type=int, default=50, help="events per /events/bulk request")
+    parser.add_argument("--only", choices=["rest", "scrape", "calendar"], action="append",
+                        help="run only these scenarios (repeatable)")
+    parser.add_argument("--mongo-uri", help="MongoDB to write to (its edusync_bench database is dropped); "
+                                            "default is an in-memory mongomock database")
+    parser.add_argument("--results-dir", default=RESULTS_DIR, help="where runs are stored")
+    parser.add_argument("--baseline", help="stored run to compare with (default: newest run with the same scale)")
+    parser.add_argument("--no-save", action="store_true", help="do not store this run")
+    args = parser.parse_args()
+
+    if args.mongo_uri:
+        mongo_client = pymongo.MongoClient(args.mongo_uri)
+        mongo_client.drop_database(BENCH_DB)
+    elif mongomock is not None:
+        mongo_client = mongomock.MongoClient()
+    else:
+        sys.exit("Install mongomock or pass --mongo-uri of a scratch MongoDB server.")
+
+    scale = Scale(args.courses, args.items, args.events)
+    scenarios = args.only or ["rest", "scrape", "calendar"]
+    workdir = os.path.join(args.results_dir, "work")
+    os.makedirs(workdir, exist_ok=True)
+    for leftover in glob.glob(os.path.join(workdir, "*")):
+        os.remove(leftover)
+    process, blackboard_url, google_url = start_stubs(scale)
+    results = {}
+    try:
+        if "rest" in scenarios or "scrape" in scenarios:
+            parsecontent1, parsecontent2 = import_parsers(mongo_client)
+            if "rest" in scenarios:
+                results["rest_sync"] = bench_rest(parsecontent1, blackboard_url, scale, args.runs, workdir)
+            if "scrape" in scenarios:
+                results["scrape_full"], results["scrape_304"] = bench_scrape(parsecontent2, blackboard_url, args.runs)
+        if "calendar" in scenarios:
+            results.update(bench_calendar(google_url, args.requests, args.bulk_size, workdir))
+    finally:
+        process.terminate()
+
+    # Units are content items for rest_sync/scrape_full, events for calendar_bulk and requests otherwise
+    print(f"\n{'scenario':<18}{'runs':>6}{'units/s':>12}{'p50 ms':>10}{'p99 ms':>10}{'first ms':>10}{'peak KiB':>10}")
+    for name, result in results.items():
+        print(f"{name:<18}{result['runs']:>6}{result['throughput']:>12.1f}{result['p50_ms']:>10.2f}"
+              f"{result['p99_ms']:>10.2f}{result['first_ms']:>10.2f}{result['peak_kib']:>10.0f}")
+    print("peak KiB is the Python heap peak of one traced run (stub servers run in their own process).")
+
+    params = {"courses": args.courses, "items": args.items, "events": args.events, "bulk_size": args.bulk_size,
+              "mongo": "mongodb" if args.mongo_uri else "mongomock"}
+    if args.baseline:
+        baseline_path = args.baseline
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+    else:
+        baseline_path, baseline = previous_run(args.results_dir, params)
+    regressed = False
+    if baseline:
+        lines, regressed = compare(results, baseline["scenarios"])
+        print(f"\nCompared with {os.path.basename(baseline_path)} ({baseline.get('git') or 'unknown revision'}):")
+        print("\n".join(lines))
+
+    if not args.no_save:
+        created = datetime.now(timezone.utc)
+        path = os.path.join(args.results_dir, created.strftime("%Y%m%dT%H%M%SZ") + ".json")
+        with open(path, "w") as f:
+            json.dump({"created": created.isoformat(), "git": git_revision(), "python": sys.version.split()[0],
+                       "params": params, "scenarios": results}, f, indent=2)
+        print(f"\nSaved to {path}")
+    sys.exit(1 if regressed else 0)
+
+if __name__ == "__main__":
+    main()
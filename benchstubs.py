@@ -0,0 +1,319 @@
+###LOCAL STUB SERVERS FOR BLACKBOARD AND GOOGLE CALENDAR USED BY bench_sync.py. THEY REPLAY THE RECORDED RESPONSES IN fixtures/ SCALED UP TO ANY NUMBER OF COURSES, ITEMS AND EVENTS###
+import copy
+import email.parser
+import hashlib
+import json
+import os
+import re
+import threading
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+# Items per page of /contents, the Blackboard default
+BLACKBOARD_PAGE_SIZE = 100
+# Every FOLDER_EVERY-th generated item is a folder whose children are the recorded children page
+FOLDER_EVERY = 25
+API_PREFIX = "/learn/api/public/v1"
+GRADEBOOK_PREFIX = "/learn/api/public/v2"
+# Cookie the stub hands out on login and expects on course pages, like Blackboard's session cookie
+SESSION_COOKIE = "s_session_id=bench-session"
+LOGIN_FORM = b'<html><body><form id="loginForm" method="post"><input name="user_id"></form></body></html>'
+BLOCK_PATTERN = re.compile(r'\n\s*<div class="content-block" id="[^"]*">.*?\n        </div>', re.S)
+
+# Function to read one recorded response from fixtures/
+def load_fixture(*parts):
+    path = os.path.join(FIXTURES_DIR, *parts)
+    with open(path, "rb" if path.endswith(".html") else "r") as f:
+        return f.read() if path.endswith(".html") else json.load(f)
+
+class Scale:
+    """
+    How much data the stubs pretend Blackboard and Google hold.
+    """
+
+    def __init__(self, courses=10, items=200, events=500):
+        """
+        Args:
+            courses (int): Number of Blackboard courses.
+            items (int): Top-level content items per course (and content blocks on the scraped page).
+            events (int): Events in the Google calendar.
+        """
+        self.courses = courses
+        self.items = items
+        self.events = events
+
+    def course_ids(self):
+        return [f"_{number}_1" for number in range(1, self.courses + 1)]
+
+class BlackboardData:
+    """
+    Builds Blackboard responses from the recorded ones, cached per course so serving them is cheap.
+    """
+
+    def __init__(self, scale):
+        self.scale = scale
+        self.token = load_fixture("blackboard", "token.json")
+        self.templates = load_fixture("blackboard", "contents_page.json")["results"]
+        self.children = load_fixture("blackboard", "children_page.json")["results"]
+        self.columns = load_fixture("blackboard", "gradebook_columns.json")["results"]
+        self._pages = {}
+        self._lock = threading.Lock()
+        html = load_fixture("pages", "course_small.html").decode("utf-8")
+        blocks = BLOCK_PATTERN.findall(html)
+        start, end = html.index(blocks[0]), html.index(blocks[-1]) + len(blocks[-1])
+        self._html_parts = (html[:start], blocks, html[end:])
+
+    def item(self, course_id, number):
+        item = copy.deepcopy(self.templates[number % len(self.templates)])
+        item["id"] = f"{course_id}_{number}"
+        item["title"] = f"{item['title']} ({number})"
+        item["hasChildren"] = number % FOLDER_EVERY == 0
+        return item
+
+    def contents_page(self, course_id, offset):
+        key = (course_id, offset)
+        with self._lock:
+            if key not in self._pages:
+                end = min(offset + BLACKBOARD_PAGE_SIZE, self.scale.items)
+                page = {"results": [self.item(course_id, number) for number in range(offset, end)]}
+                if end < self.scale.items:
+                    page["paging"] = {"nextPage": f"{API_PREFIX}/courses/{course_id}/contents?offset={end}"
+                                                  f"&fields=id,title,description,created,modified,hasChildren"}
+                self._pages[key] = json.dumps(page).encode("utf-8")
+            return self._pages[key]
+
+    def columns_page(self, course_id):
+        key = (course_id, "columns")
+        with self._lock:
+            if key not in self._pages:
+                # One column per generated item whose recorded template item is graded
+                graded = {column["contentId"]: column for column in self.columns if column.get("contentId")}
+                results = []
+                for number in range(self.scale.items):
+                    template = self.templates[number % len(self.templates)]
+                    if template["id"] in graded:
+                        results.append(dict(graded[template["id"]], id=f"{course_id}_column_{number}",
+                                            contentId=f"{course_id}_{number}"))
+                self._pages[key] = json.dumps({"results": results}).encode("utf-8")
+            return self._pages[key]
+
+    def children_page(self, folder_id):
+        results = []
+        for child in self.children:
+            child = dict(child, id=f"{folder_id}{child['id']}")
+            results.append(child)
+        return json.dumps({"results": results}).encode("utf-8")
+
+    def course_page(self):
+        key = ("page", None)
+        with self._lock:
+            if key not in self._pages:
+                head, blocks, tail = self._html_parts
+                body = []
+                for number in range(self.scale.items):
+                    block = blocks[number % len(blocks)]
+                    block = re.sub(r'id="[^"]*"', f'id="_{number}_1"', block, count=1)
+                    body.append(block.replace("</span></h3>", f" ({number})</span></h3>", 1))
+                self._pages[key] = (head + "".join(body) + tail).encode("utf-8")
+            return self._pages[key]
+
+class BlackboardHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=b"", content_type="application/json", headers=()):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        data = self.server.data
+        if self.path == f"{API_PREFIX}/oauth2/token":
+            self._send(200, json.dumps(data.token).encode("utf-8"))
+        elif self.path.startswith("/webapps/login"):
+            self._send(200, b"<html><body>Welcome to Blackboard</body></html>", "text/html",
+                       [("Set-Cookie", f"{SESSION_COOKIE}; Path=/")])
+        else:
+            self._send(404)
+
+    def do_GET(self):
+        data = self.server.data
+        url = urlsplit(self.path)
+        parts = url.path.split("/")
+        if url.path.startswith(f"{API_PREFIX}/courses/") and parts[-1] == "contents":
+            offset = int(parse_qs(url.query).get("offset", ["0"])[0])
+            self._send(200, data.contents_page(parts[-2], offset))
+        elif url.path.startswith(f"{GRADEBOOK_PREFIX}/courses/") and parts[-2:] == ["gradebook", "columns"]:
+            self._send(200, data.columns_page(parts[-3]))
+        elif url.path.startswith(f"{API_PREFIX}/courses/") and parts[-1] == "children":
+            self._send(200, data.children_page(parts[-2]))
+        elif url.path.startswith("/webapps/login"):
+            self._send(200, LOGIN_FORM, "text/html")
+        elif url.path.startswith("/learn/course_content/") and SESSION_COOKIE not in (self.headers.get("Cookie") or ""):
+            self._send(302, headers=[("Location", f"/webapps/login/?new_loc={url.path}")])
+        elif url.path.startswith("/learn/course_content/"):
+            body = data.course_page()
+            etag = '"' + hashlib.sha256(body).hexdigest()[:16] + '"'
+            if self.headers.get("If-None-Match") == etag:
+                self._send(304, headers=[("ETag", etag)])
+            else:
+                self._send(200, body, "text/html; charset=utf-8", [("ETag", etag)])
+        else:
+            self._send(404)
+
+class GoogleData:
+    """
+    Builds Calendar API responses from the recorded ones.
+    """
+
+    def __init__(self, scale):
+        self.scale = scale
+        self.list_page = load_fixture("google", "events_list.json")
+        self.inserted = load_fixture("google", "event_insert.json")
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._events = None
+
+    def events(self):
+        # Spread over 60 days from today so about half fall inside the index page's window
+        with self._lock:
+            if self._events is None:
+                templates = self.list_page["items"]
+                today = date.today()
+                self._events = []
+                for number in range(self.scale.events):
+                    event = copy.deepcopy(templates[number % len(templates)])
+                    event["id"] = f"evt{number:06d}"
+                    day = (today + timedelta(days=number % 60)).isoformat()
+                    event["start"] = {"date": day}
+                    event["end"] = {"date": day}
+                    self._events.append(event)
+            return self._events
+
+    def list(self, query):
+        if "syncToken" in query:
+            # Steady state: nothing changed since the last sync
+            return {"kind": "calendar#events", "items": [], "nextSyncToken": self.list_page["nextSyncToken"]}
+        offset = int(query.get("pageToken", ["0"])[0])
+        page_size = int(query.get("maxResults", ["250"])[0])
+        events = self.events()
+        page = {key: value for key, value in self.list_page.items() if key not in ("items", "nextSyncToken")}
+        page["items"] = events[offset:offset + page_size]
+        if offset + page_size < len(events):
+            page["nextPageToken"] = str(offset + page_size)
+        else:
+            page["nextSyncToken"] = self.list_page["nextSyncToken"]
+        return page
+
+    def insert(self, body):
+        with self._lock:
+            self._next_id += 1
+            event_id = f"new{self._next_id:08d}"
+        event = dict(self.inserted, id=event_id)
+        event.update({key: body[key] for key in ("summary", "description", "start", "end", "extendedProperties")
+                      if key in body})
+        return event
+
+    def answer(self, method, path, body):
+        """
+        Returns:
+            tuple: (status, response body or None) for one Calendar API call.
+        """
+        url = urlsplit(path)
+        if not url.path.startswith("/calendar/v3/calendars/"):
+            return 404, None
+        if method == "GET":
+            return 200, self.list(parse_qs(url.query))
+        if method == "POST":
+            return 200, self.insert(json.loads(body or b"{}"))
+        if method == "PATCH":
+            return 200, dict(self.inserted, id=url.path.rsplit("/", 1)[-1], **json.loads(body or b"{}"))
+        if method == "DELETE":
+            return 204, None
+        return 405, None
+
+class GoogleHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode("utf-8") if payload is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=UTF-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if self.path.startswith("/batch/"):
+            self._batch(body)
+        else:
+            self._send(*self.server.data.answer(self.command, self.path, body))
+
+    do_GET = do_POST = do_PATCH = do_DELETE = _handle
+
+    def _batch(self, body):
+        # Each part of a Google batch is a whole HTTP request; answer each with a whole HTTP response
+        message = email.parser.BytesParser().parsebytes(
+            f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode("utf-8") + body)
+        boundary = "batch_stub_boundary"
+        chunks = []
+        for part in message.get_payload():
+            raw = part.get_payload(decode=True)
+            head, payload = re.split(rb"\r?\n\r?\n", raw, maxsplit=1)
+            method, path = head.splitlines()[0].decode("utf-8").split(" ")[:2]
+            status, answer = self.server.data.answer(method, path, payload)
+            content = json.dumps(answer) if answer is not None else ""
+            content_id = part["Content-ID"].strip("<>")
+            chunks.append(f"--{boundary}\r\nContent-Type: application/http\r\nContent-ID: <response-{content_id}>\r\n\r\n"
+                          f"HTTP/1.1 {status} OK\r\nContent-Type: application/json\r\n\r\n{content}\r\n")
+        response = ("".join(chunks) + f"--{boundary}--").encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", f'multipart/mixed; boundary="{boundary}"')
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+def start_stub(handler, data, host="127.0.0.1"):
+    """
+    Serve one stub from a background thread.
+
+    Args:
+        handler (type): BlackboardHandler or GoogleHandler.
+        data (BlackboardData or GoogleData): Responses the handler serves.
+        host (str): Interface to bind; a free port is picked.
+
+    Returns:
+        ThreadingHTTPServer: The running server; its base URL is http://host:server.server_address[1].
+    """
+    server = ThreadingHTTPServer((host, 0), handler)
+    server.daemon_threads = True
+    server.data = data
+    threading.Thread(target=server.serve_forever, name=f"stub-{handler.__name__}", daemon=True).start()
+    return server
+
+def serve_stubs(scale, ports):
+    """
+    Run both stubs until the process is killed; meant as a multiprocessing target so the
+    stubs' own CPU and memory are not counted against the code being measured.
+
+    Args:
+        scale (Scale): Size of the data to serve.
+        ports (multiprocessing.Queue): Receives (blackboard_port, google_port) once both are listening.
+    """
+    blackboard = start_stub(BlackboardHandler, BlackboardData(scale))
+    google = start_stub(GoogleHandler, GoogleData(scale))
+    ports.put((blackboard.server_address[1], google.server_address[1]))
+    threading.Event().wait()
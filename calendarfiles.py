@@ -0,0 +1,271 @@
+###BULK IMPORT OF ASSIGNMENTS INTO GOOGLE CALENDAR FROM ICS/CSV FILES OR THE ASSIGNMENTS TABLE, AND THE ICS WRITER BEHIND /export.ics. RUN "python calendarfiles.py FILE" (OR "--sqlite assignmentsDB.sqlite")###
+import argparse
+import csv
+import sqlite3
+from datetime import date, datetime, timezone
+import metrics
+
+# Events read, checked against the mirror and sent to Google per round; a multiple of MAX_BATCH_SIZE
+IMPORT_CHUNK = 500
+# Events written per chunk of the /export.ics response
+EXPORT_CHUNK = 100
+
+# Column names accepted for each field, covering schema.sql, the Sequelize model in p2server.js and the web form
+NAME_COLUMNS = ("title", "name", "summary", "event_name")
+DATE_COLUMNS = ("due_date", "dueDate", "date", "event_date", "due")
+DESCRIPTION_COLUMNS = ("description", "details")
+
+IMPORTED = metrics.counter("edusync_calendar_import_total",
+                           "Events read by the bulk import, by outcome (created/duplicate/invalid/failed).",
+                           ("result",))
+
+def _event(name, day, description=None):
+    """
+    Build an event for calender.create_events, or None when the name or date is unusable.
+    """
+    name = (name or "").strip()
+    try:
+        # Accepts YYYY-MM-DD as well as the datetimes Sequelize stores ("2024-10-21 00:00:00.000 +00:00")
+        day = date.fromisoformat(str(day or "").strip()[:10]).isoformat()
+    except ValueError:
+        return None
+    if not name:
+        return None
+    return {"name": name, "date": day, "description": (description or "").strip() or None}
+
+def _pick(row, columns):
+    for column in columns:
+        if row.get(column):
+            return row[column]
+    return None
+
+def read_csv(path):
+    """
+    Stream events from a CSV file with a header row.
+
+    Args:
+        path (str): CSV file with a title, due date and optional description column (see NAME_COLUMNS etc.).
+
+    Yields:
+        dict: An event for create_events, or None for a row without a usable title or date.
+    """
+    with open(path, newline="", encoding="utf-8-sig") as rows:
+        for row in csv.DictReader(rows):
+            yield _event(_pick(row, NAME_COLUMNS), _pick(row, DATE_COLUMNS), _pick(row, DESCRIPTION_COLUMNS))
+
+def _unfolded(lines):
+    # RFC 5545 folds long lines by starting the continuation with a space or tab
+    current = None
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if line[:1] in (" ", "\t") and current is not None:
+            current += line[1:]
+            continue
+        if current is not None:
+            yield current
+        current = line
+    if current:
+        yield current
+
+def _unescape(text):
+    out, chars = [], iter(text)
+    for char in chars:
+        if char == "\\":
+            char = next(chars, "")
+            char = "\n" if char in ("n", "N") else char
+        out.append(char)
+    return "".join(out)
+
+def read_ics(path):
+    """
+    Stream events from an iCalendar file, one VEVENT at a time.
+
+    Args:
+        path (str): .ics file.
+
+    Yields:
+        dict: An event for create_events, or None for a VEVENT without a summary or start date.
+    """
+    with open(path, encoding="utf-8-sig") as lines:
+        fields = None
+        for line in _unfolded(lines):
+            if line == "BEGIN:VEVENT":
+                fields = {}
+            elif line == "END:VEVENT" and fields is not None:
+                start = fields.get("DTSTART", "")
+                day = f"{start[:4]}-{start[4:6]}-{start[6:8]}" if start[:8].isdigit() else None
+                yield _event(fields.get("SUMMARY"), day, fields.get("DESCRIPTION"))
+                fields = None
+            elif fields is not None and ":" in line:
+                # "DTSTART;VALUE=DATE:20241021" -> DTSTART, 20241021
+                key, value = line.split(":", 1)
+                fields.setdefault(key.split(";", 1)[0].upper(), _unescape(value))
+
+def read_assignments(path, table=None):
+    """
+    Stream the rows of the assignments table from a SQLite database.
+
+    Works with the table from schema.sql (title, due_date, description) and the
+    Assignments table p2server.js keeps in assignmentsDB.sqlite (title, dueDate).
+
+    Args:
+        path (str): SQLite database file.
+        table (str, optional): Table to read. Defaults to the first of assignments/Assignments that exists.
+
+    Yields:
+        dict: An event for create_events, or None for a row without a usable title or date.
+    """
+    conn = sqlite3.connect(path)
+    try:
+        conn.row_factory = sqlite3.Row
+        tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+        table = table or next((name for name in tables if name.lower() == "assignments"), None)
+        if table not in tables:
+            raise LookupError(f"No assignments table in {path}")
+        # Rows come off the cursor as they are read, the table is never loaded at once
+        for row in conn.execute(f'SELECT * FROM "{table}"'):
+            row = dict(row)
+            yield _event(_pick(row, NAME_COLUMNS), _pick(row, DATE_COLUMNS), _pick(row, DESCRIPTION_COLUMNS))
+    finally:
+        conn.close()
+
+def read_events(path):
+    """
+    Pick the reader for a file by its extension (.ics, .csv, or a SQLite database).
+    """
+    lowered = path.lower()
+    if lowered.endswith((".ics", ".ical")):
+        return read_ics(path)
+    if lowered.endswith(".csv"):
+        return read_csv(path)
+    return read_assignments(path)
+
+def import_events(calendar_service, mirror, events, chunk_size=IMPORT_CHUNK):
+    """
+    Create calendar events from a stream, skipping ones the calendar already has.
+
+    The stream is consumed chunk_size events at a time. Each chunk is checked against
+    the local event mirror (an event with the same name on the same day is a duplicate),
+    sent as Google batch requests, and the created events are added to the mirror so
+    later chunks and later imports see them. Memory use does not depend on the input size.
+
+    Args:
+        calendar_service (googleapiclient.discovery.Resource): Authenticated Google Calendar service object.
+        mirror (calendarsync.EventMirror): Mirror of the same calendar, synced before the import.
+        events (iterable): Events for create_events; None entries count as invalid rows.
+        chunk_size (int): Events handled per round.
+
+    Returns:
+        dict: Number of events created, skipped as duplicates, invalid and failed.
+    """
+    # calender imports this module for the export route, so it is only imported once needed
+    from calender import create_events
+    stats = {"created": 0, "duplicate": 0, "invalid": 0, "failed": 0}
+
+    def send(chunk):
+        known = mirror.existing(chunk)
+        fresh = [event for key, event in chunk.items() if key not in known]
+        stats["duplicate"] += len(chunk) - len(fresh)
+        created = []
+        for result in create_events(calendar_service, fresh) if fresh else []:
+            if result["ok"]:
+                created.append(result["result"])
+            else:
+                stats["failed"] += 1
+        mirror.upsert(created)
+        stats["created"] += len(created)
+
+    chunk = {}
+    for event in events:
+        if event is None:
+            stats["invalid"] += 1
+            continue
+        key = (event["name"], event["date"])
+        if key in chunk:
+            stats["duplicate"] += 1
+            continue
+        chunk[key] = event
+        if len(chunk) >= chunk_size:
+            send(chunk)
+            chunk = {}
+    if chunk:
+        send(chunk)
+    for result, amount in stats.items():
+        IMPORTED.inc(amount, result=result)
+    metrics.log_event("calendar_import", **stats)
+    return stats
+
+def _escape(text):
+    return (text.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,")
+            .replace("\r\n", "\\n").replace("\n", "\\n"))
+
+def _fold(line):
+    # Lines may be at most 75 octets; continuations start with a space
+    encoded = line.encode("utf-8")
+    if len(encoded) <= 75:
+        return line + "\r\n"
+    parts, current = [], ""
+    for char in line:
+        if len((current + char).encode("utf-8")) > (75 if not parts else 74):
+            parts.append(current)
+            current = ""
+        current += char
+    parts.append(current)
+    return "\r\n ".join(parts) + "\r\n"
+
+def _dtstart(start_time):
+    if "T" not in start_time:
+        return "DTSTART;VALUE=DATE:" + start_time.replace("-", "")
+    moment = datetime.fromisoformat(start_time)
+    if moment.tzinfo is None:
+        return "DTSTART:" + moment.strftime("%Y%m%dT%H%M%S")
+    return "DTSTART:" + moment.astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+def ics_chunks(events, chunk_size=EXPORT_CHUNK):
+    """
+    Write events as an iCalendar document, piece by piece.
+
+    Args:
+        events (iterable): Events as yielded by calender.iter_events (id, name, start, start_time).
+        chunk_size (int): Events per yielded chunk.
+
+    Yields:
+        str: The header, then chunk_size events at a time, then the footer.
+    """
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    yield "BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//EduSYNC//Calendar export//EN\r\nCALSCALE:GREGORIAN\r\n"
+    lines = []
+    for number, event in enumerate(events, 1):
+        lines += ["BEGIN:VEVENT\r\n", _fold(f"UID:{event['id']}"), f"DTSTAMP:{stamp}\r\n",
+                  _fold(_dtstart(event.get('start_time') or event['start'])),
+                  _fold("SUMMARY:" + _escape(event['name'])), "END:VEVENT\r\n"]
+        if number % chunk_size == 0:
+            yield "".join(lines)
+            lines = []
+    if lines:
+        yield "".join(lines)
+    yield "END:VCALENDAR\r\n"
+
+def main():
+    parser = argparse.ArgumentParser(description="Create Google Calendar events from an ICS/CSV file or the assignments table.")
+    parser.add_argument("path", nargs="?", help=".ics or .csv file, or a SQLite database with an assignments table")
+    parser.add_argument("--sqlite", metavar="DB", help="read the assignments table of this SQLite database")
+    parser.add_argument("--table", help="table to read with --sqlite (default: assignments)")
+    parser.add_argument("--user", help="user whose calendar to fill (default: the calendar app's default user)")
+    parser.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK, help="events sent per round")
+    args = parser.parse_args()
+    if not (args.path or args.sqlite):
+        parser.error("give a file to import or --sqlite DB")
+
+    from calender import DEFAULT_USER, authenticate_google_calendar, get_event_mirror
+    from calendarsync import sync_events
+    user_id = args.user or DEFAULT_USER
+    service = authenticate_google_calendar(user_id)
+    mirror = get_event_mirror(user_id)
+    # Dedup runs against the mirror, so bring it up to date with the calendar first
+    sync_events(service, mirror)
+    events = read_assignments(args.sqlite, args.table) if args.sqlite else read_events(args.path)
+    print(import_events(service, mirror, events, args.chunk_size))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+###KEEPS GOOGLE CALENDAR IN SYNC WITH THE DUE DATES OF THE COURSE CONTENT THE PARSERS STORE IN MONGODB. RUN "python calendarprojection.py" (OR "--once")###
+import argparse
+import hashlib
+import json
+import time
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+from pymongo import UpdateOne, DeleteOne, errors
+from contentstore import get_db, parse_date
+from calender import CALENDAR_TZ, MAX_BATCH_SIZE, authenticate_google_calendar, create_events, update_events, delete_events
+
+# Seconds between polls when change streams are not available
+POLL_INTERVAL = 300
+# Key of the high-water mark document in the sync_state collection
+STATE_ID = 'calendar_projection'
+# Seconds before the high-water mark that are read again on every poll, for writes that
+# were stamped before the mark but committed after it (other hosts, slow batches)
+SYNC_OVERLAP = 60
+# Failed pushes of one item that hold the high-water mark back; after that the item is only
+# retried from the calendar_retry collection, so one bad item cannot stall everything after it
+MAX_ATTEMPTS = 5
+# Pushes of an item from calendar_retry before it is left there for someone to look at
+MAX_RETRIES = 20
+
+def event_for(document):
+    """
+    Map a course content document to the calendar event it should have.
+
+    Args:
+        document (dict): Document from course_content.
+
+    Returns:
+        dict: Event fields for calender.create_events, or None if the item has no valid due date.
+    """
+    due = parse_date(document.get('due'))
+    if not isinstance(due, datetime):
+        # Missing, or a value that is not a date at all; Google would reject it
+        return None
+    if due.time() != datetime.min.time():
+        # Stored dates are naive UTC; put the event on the day the deadline falls on in the
+        # calendar's zone (11:59 PM Eastern is already the next day in UTC). A bare date is stored
+        # as midnight UTC and keeps its day.
+        due = due.replace(tzinfo=timezone.utc).astimezone(ZoneInfo(CALENDAR_TZ))
+    due_date = due.date().isoformat()
+    return {
+        'name': document.get('title') or '(No title)',
+        'date': due_date,
+        'description': document.get('description'),
+        'contentId': document['contentId'],
+    }
+
+def _is_permanent(result):
+    # Google refuses the event itself; sending it again will not help (404/410 are handled as gone, 429 is a rate limit)
+    status = result.get('status')
+    return isinstance(status, int) and 400 <= status < 500 and status not in (404, 410, 429)
+
+def _event_fingerprint(event):
+    return hashlib.sha256(json.dumps(event, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+class CalendarProjection:
+    """
+    Projects course content with due dates onto Google Calendar events.
+
+    The Google event id of every projected item is stored next to its contentId
+    in the `calendar_events` collection together with a fingerprint of the event,
+    so each item is created once and only re-sent when its event would change.
+    Creates, updates and deletes are sent as Google batch requests. Items whose
+    change failed are counted in `calendar_retry`; see MAX_ATTEMPTS and MAX_RETRIES.
+    """
+
+    def __init__(self, db, calendar_service):
+        """
+        Args:
+            db (pymongo.database.Database): Database holding course_content.
+            calendar_service (googleapiclient.discovery.Resource): Authenticated Google Calendar service object.
+        """
+        self.content = db['course_content']
+        self.events = db['calendar_events']
+        self.state = db['sync_state']
+        self.retry = db['calendar_retry']
+        self.service = calendar_service
+        self.events.create_index('contentId', unique=True)
+        self.retry.create_index('contentId', unique=True)
+        self.stats = {'created': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0, 'failed': 0}
+
+    def project(self, documents):
+        """
+        Bring the calendar in line with a batch of content documents.
+
+        Args:
+            documents (list): course_content documents, or ('delete', contentId) tuples for removed items.
+
+        Returns:
+            list: contentIds whose calendar change failed and should hold the high-water mark back.
+            Items Google rejects outright, or that failed MAX_ATTEMPTS times, are only kept in
+            calendar_retry and not returned.
+        """
+        wanted = {}
+        sources = {}
+        for document in documents:
+            if isinstance(document, tuple):
+                wanted[document[1]] = None
+            else:
+                wanted[document['contentId']] = event_for(document)
+                sources[document['contentId']] = document.get('_id')
+        known = {entry['contentId']: entry for entry in self.events.find({'contentId': {'$in': list(wanted)}})}
+        # Events Google refused as they are; they are not sent again until the item changes
+        rejected = {entry['contentId']: entry.get('fingerprint') for entry in self.retry.find(
+            {'contentId': {'$in': list(wanted)}, 'permanent': True})}
+
+        creates, updates, deletes, skipped = [], [], [], set()
+        for content_id, event in wanted.items():
+            entry = known.get(content_id)
+            if event is not None and content_id in rejected and rejected[content_id] == _event_fingerprint(event):
+                skipped.add(content_id)
+                continue
+            if event is None:
+                if entry:
+                    deletes.append(entry)
+            elif entry is None:
+                creates.append(event)
+            elif entry['fingerprint'] != _event_fingerprint(event):
+                updates.append({**event, 'id': entry['eventId']})
+            else:
+                self.stats['unchanged'] += 1
+
+        writes, failures = [], {}
+        for event, result in zip(creates, create_events(self.service, creates) if creates else []):
+            if result['ok']:
+                writes.append(UpdateOne({'contentId': event['contentId']}, {'$set': {
+                    'eventId': result['result']['id'], 'fingerprint': _event_fingerprint(event),
+                    'sourceId': sources.get(event['contentId'])}}, upsert=True))
+                self.stats['created'] += 1
+            else:
+                failures[event['contentId']] = {**result, 'fingerprint': _event_fingerprint(event)}
+        for event, result in zip(updates, update_events(self.service, updates) if updates else []):
+            event = {key: value for key, value in event.items() if key != 'id'}
+            if result['ok']:
+                writes.append(UpdateOne({'contentId': event['contentId']},
+                                        {'$set': {'fingerprint': _event_fingerprint(event)}}))
+                self.stats['updated'] += 1
+            elif result.get('status') in (404, 410):
+                # Deleted by hand in Google Calendar; forget it so the next pass recreates it
+                writes.append(DeleteOne({'contentId': event['contentId']}))
+                failures[event['contentId']] = result
+            else:
+                failures[event['contentId']] = {**result, 'fingerprint': _event_fingerprint(event)}
+        event_ids = [entry['eventId'] for entry in deletes]
+        for entry, result in zip(deletes, delete_events(self.service, event_ids) if deletes else []):
+            if result['ok'] or result.get('status') in (404, 410):
+                writes.append(DeleteOne({'contentId': entry['contentId']}))
+                self.stats['deleted'] += 1
+            else:
+                failures[entry['contentId']] = result
+
+        if writes:
+            self.events.bulk_write(writes, ordered=False)
+        self.stats['failed'] += len(failures)
+        return self._record_failures(failures, [content_id for content_id in wanted
+                                                if content_id not in failures and content_id not in skipped])
+
+    def _record_failures(self, failures, succeeded):
+        if succeeded:
+            self.retry.delete_many({'contentId': {'$in': succeeded}})
+        if not failures:
+            return []
+        now = datetime.utcnow()
+        self.retry.bulk_write([UpdateOne({'contentId': content_id}, {
+            '$set': {'error': result.get('error'), 'status': result.get('status'),
+                     'permanent': _is_permanent(result), 'fingerprint': result.get('fingerprint'),
+                     'lastFailed': now},
+            '$inc': {'attempts': 1}}, upsert=True) for content_id, result in failures.items()], ordered=False)
+        entries = self.retry.find({'contentId': {'$in': list(failures)}})
+        return [entry['contentId'] for entry in entries
+                if not entry['permanent'] and entry['attempts'] < MAX_ATTEMPTS]
+
+    def retry_failed(self):
+        """
+        Push items again that were passed over after failing MAX_ATTEMPTS times.
+
+        Items Google rejected outright are not retried here; they are sent again
+        once an edit changes the event they would get.
+        """
+        entries = list(self.retry.find({'permanent': False, 'attempts': {'$gte': MAX_ATTEMPTS, '$lt': MAX_RETRIES}},
+                                       {'contentId': 1}).limit(MAX_BATCH_SIZE))
+        if not entries:
+            return
+        ids = [entry['contentId'] for entry in entries]
+        documents = {document['contentId']: document for document in self.content.find({'contentId': {'$in': ids}})}
+        # Items removed from course_content since they failed still need their event deleted
+        self.project([documents.get(content_id, ('delete', content_id)) for content_id in ids])
+
+    def poll_once(self):
+        """
+        Project every document stored since the high-water mark.
+
+        The mark is the `syncedAt` time ContentWriter stamps on every write, not
+        Blackboard's `modified`, so items of a newly added course and items whose
+        due date changed without a new `modified` are still picked up. It only
+        advances past documents whose calendar changes succeeded, so failed items
+        are picked up again on the next poll, until they have failed MAX_ATTEMPTS
+        times or Google rejected them outright.
+
+        Returns:
+            dict: Running totals of created, updated, deleted, unchanged and failed events.
+        """
+        self.retry_failed()
+        state = self.state.find_one({'_id': STATE_ID}) or {}
+        # Marks saved by older versions are Blackboard 'modified' dates; they are ignored and
+        # everything is projected once, which only sends the events that are out of date
+        high_water = state.get('syncedAt')
+        query = {}
+        if high_water is not None:
+            query = {'syncedAt': {'$gte': high_water - timedelta(seconds=SYNC_OVERLAP)}}
+        cursor = self.content.find(query).sort('syncedAt', 1).batch_size(MAX_BATCH_SIZE)
+        batch = []
+        for document in cursor:
+            batch.append(document)
+            if len(batch) == MAX_BATCH_SIZE:
+                high_water, ok = self._project_batch(batch, high_water)
+                batch = []
+                if not ok:
+                    break
+        else:
+            if batch:
+                high_water, _ = self._project_batch(batch, high_water)
+        if high_water is not None:
+            self.state.update_one({'_id': STATE_ID}, {'$set': {'syncedAt': high_water}}, upsert=True)
+        return dict(self.stats)
+
+    def _project_batch(self, batch, high_water):
+        failed = set(self.project(batch))
+        for document in batch:
+            if document['contentId'] in failed:
+                # Stop at the first failure; with $gte it and everything after it is retried
+                return high_water, False
+            # Documents stored before syncedAt existed, or re-read from the overlap, leave the mark alone
+            synced_at = document.get('syncedAt')
+            if synced_at is not None and (high_water is None or synced_at > high_water):
+                high_water = synced_at
+        return high_water, True
+
+    def watch(self, idle_seconds=1.0):
+        """
+        Follow course_content through a MongoDB change stream and project changes in batches.
+
+        Requires a replica set; raises pymongo.errors.OperationFailure on a standalone server.
+        The stream resumes from the last fully projected change after a restart.
+        """
+        state = self.state.find_one({'_id': STATE_ID}) or {}
+        with self.content.watch(full_document='updateLookup', resume_after=state.get('resume_token')) as stream:
+            batch = []
+            holding = False
+            while stream.alive:
+                change = stream.try_next()
+                if change is not None:
+                    if change['operationType'] == 'delete':
+                        # Only _id survives a delete, so find the item through the mapping we stored
+                        entry = self.events.find_one({'sourceId': change['documentKey']['_id']})
+                        if entry:
+                            batch.append(('delete', entry['contentId']))
+                    elif change.get('fullDocument'):
+                        batch.append(change['fullDocument'])
+                    if len(batch) < MAX_BATCH_SIZE:
+                        continue
+                if batch:
+                    failed = self.project(batch)
+                    batch = []
+                    if failed and not holding:
+                        # Stop saving the resume token so these changes are replayed after a restart
+                        print(f"Could not update {len(failed)} calendar events, will retry after restart.")
+                        holding = True
+                if not holding:
+                    self.state.update_one({'_id': STATE_ID}, {'$set': {'resume_token': stream.resume_token}},
+                                          upsert=True)
+                if change is None:
+                    time.sleep(idle_seconds)
+
+_projection = None
+
+def poll():
+    """
+    Run one polling pass with a process-wide projection, connecting on first use.
+
+    Returns:
+        dict: Running totals of created, updated, deleted, unchanged and failed events.
+    """
+    global _projection
+    if _projection is None:
+        _projection = CalendarProjection(get_db(), authenticate_google_calendar())
+    return _projection.poll_once()
+
+def main():
+    parser = argparse.ArgumentParser(description="Project course content due dates onto Google Calendar.")
+    parser.add_argument("--once", action="store_true", help="poll once and exit")
+    parser.add_argument("--interval", type=float, default=POLL_INTERVAL, help="seconds between polls")
+    args = parser.parse_args()
+
+    print(poll())
+    if args.once:
+        return
+    try:
+        _projection.watch()
+    except errors.OperationFailure:
+        print("Change streams need a replica set; polling the syncedAt high-water mark instead.")
+    while True:
+        time.sleep(args.interval)
+        print(poll())
+
+if __name__ == "__main__":
+    main()
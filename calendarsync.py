@@ -0,0 +1,197 @@
+import sqlite3
+import threading
+from googleapiclient.errors import HttpError
+
+def format_event(event):
+    """
+    Reduce a Google Calendar event resource to the fields the app displays.
+
+    Args:
+        event (dict): Raw event resource from the Google Calendar API.
+
+    Returns:
+        dict: The event ID, name, start date (YYYY-MM-DD) and raw start time.
+    """
+    event_start = event['start'].get('dateTime', event['start'].get('date'))
+    formatted_date = event_start.split('T')[0] if 'T' in event_start else event_start
+    return {'id': event['id'], 'name': event.get('summary', '(No title)'), 'start': formatted_date,
+            'start_time': event_start}
+
+class EventMirror:
+    """
+    Local SQLite copy of a Google Calendar plus the syncToken needed to update it.
+
+    Full resyncs use a generation counter instead of wiping the table first, so
+    readers keep seeing the old copy until the new one is complete.
+    """
+
+    def __init__(self, path):
+        """
+        Open (and create if needed) the mirror database.
+
+        Args:
+            path (str): SQLite database file, or ':memory:' for a throwaway mirror.
+        """
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS events ("
+                "id TEXT PRIMARY KEY, name TEXT, start TEXT, start_time TEXT, generation INTEGER)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS events_start ON events (start)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS sync_state (key TEXT PRIMARY KEY, value TEXT)")
+
+    def _get_state(self, key):
+        row = self._conn.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+        return row['value'] if row else None
+
+    def _set_state(self, key, value):
+        self._conn.execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)", (key, value))
+
+    def sync_token(self):
+        """
+        Returns:
+            str: The nextSyncToken from the last completed sync, or None before the first one.
+        """
+        with self._lock:
+            return self._get_state('sync_token')
+
+    def generation(self):
+        """
+        Returns:
+            int: The generation number of the last full sync.
+        """
+        with self._lock:
+            return int(self._get_state('generation') or 0)
+
+    def upsert(self, events, generation=None):
+        """
+        Insert or update events in the mirror.
+
+        Args:
+            events (list): Raw Google Calendar event resources.
+            generation (int, optional): Generation to stamp on the rows. Defaults to the current one.
+        """
+        rows = []
+        with self._lock:
+            if generation is None:
+                generation = int(self._get_state('generation') or 0)
+            for event in events:
+                formatted = format_event(event)
+                rows.append((formatted['id'], formatted['name'], formatted['start'], formatted['start_time'],
+                             generation))
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO events (id, name, start, start_time, generation) "
+                    "VALUES (?, ?, ?, ?, ?)", rows)
+
+    def remove(self, event_ids):
+        """
+        Delete events from the mirror.
+
+        Args:
+            event_ids (list): IDs of the events to drop.
+        """
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM events WHERE id = ?", [(event_id,) for event_id in event_ids])
+
+    def existing(self, keys):
+        """
+        Find which (name, start date) pairs already have an event in the mirror.
+
+        Args:
+            keys (iterable): (name, start date as YYYY-MM-DD) pairs.
+
+        Returns:
+            set: The pairs that match a mirrored event.
+        """
+        keys = set(keys)
+        starts = sorted({start for _, start in keys})
+        if not starts:
+            return set()
+        placeholders = ", ".join("?" * len(starts))
+        with self._lock:
+            rows = self._conn.execute(f"SELECT name, start FROM events WHERE start IN ({placeholders})", starts)
+            return {(row['name'], row['start']) for row in rows} & keys
+
+    def finish_sync(self, sync_token, generation=None):
+        """
+        Record a completed sync.
+
+        Args:
+            sync_token (str): The nextSyncToken returned on the last page.
+            generation (int, optional): Set after a full sync; rows from older generations are dropped.
+        """
+        with self._lock, self._conn:
+            if generation is not None:
+                self._conn.execute("DELETE FROM events WHERE generation < ?", (generation,))
+                self._set_state('generation', str(generation))
+            self._set_state('sync_token', sync_token)
+
+    def events_between(self, start_date, end_date=None):
+        """
+        Read mirrored events ordered by start time.
+
+        Args:
+            start_date (str): First day to include (YYYY-MM-DD).
+            end_date (str, optional): Last day to include (YYYY-MM-DD).
+
+        Returns:
+            list: Events with their ID, name, and start date (formatted as YYYY-MM-DD).
+        """
+        query = "SELECT id, name, start FROM events WHERE start >= ?"
+        params = [start_date]
+        if end_date is not None:
+            query += " AND start <= ?"
+            params.append(end_date)
+        query += " ORDER BY start_time"
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(query, params)]
+
+def _pull(calendar_service, mirror, sync_token, page_size):
+    params = {'calendarId': 'primary', 'singleEvents': True, 'maxResults': page_size}
+    generation = None
+    if sync_token:
+        params['syncToken'] = sync_token
+    else:
+        generation = mirror.generation() + 1
+    stats = {'full': sync_token is None, 'updated': 0, 'deleted': 0}
+    page_token = None
+    while True:
+        result = calendar_service.events().list(pageToken=page_token, **params).execute()
+        items = result.get('items', [])
+        cancelled = [event['id'] for event in items if event.get('status') == 'cancelled']
+        changed = [event for event in items if event.get('status') != 'cancelled']
+        mirror.upsert(changed, generation)
+        mirror.remove(cancelled)
+        stats['updated'] += len(changed)
+        stats['deleted'] += len(cancelled)
+        page_token = result.get('nextPageToken')
+        if not page_token:
+            mirror.finish_sync(result.get('nextSyncToken'), generation)
+            return stats
+
+def sync_events(calendar_service, mirror, page_size=250):
+    """
+    Bring the local mirror up to date with Google Calendar.
+
+    With a stored syncToken only changed and deleted events are fetched. Without one,
+    or when Google answers 410 Gone because the token has expired, a full resync runs.
+
+    Args:
+        calendar_service (googleapiclient.discovery.Resource): Authenticated Google Calendar service object.
+        mirror (EventMirror): The local event mirror to update.
+        page_size (int): Number of events requested per page.
+
+    Returns:
+        dict: Whether this was a 'full' sync and how many events were 'updated' and 'deleted'.
+    """
+    sync_token = mirror.sync_token()
+    try:
+        return _pull(calendar_service, mirror, sync_token, page_size)
+    except HttpError as e:
+        if sync_token is None or e.resp.status != 410:
+            raise
+        print("Sync token expired, running a full calendar resync.")
+        return _pull(calendar_service, mirror, None, page_size)
@@ -1,88 +1,362 @@
-from flask import Flask, request, render_template_string
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-import pickle
-from datetime import datetime
+from flask import Flask, Response, g, request, render_template_string, jsonify, redirect, stream_with_context, url_for
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from calendarfiles import ics_chunks
+from calendarsync import EventMirror, format_event, sync_events
+from credentialstore import CREDENTIALS_DB, CredentialStore, LRUCache, UnknownUserError
+import metrics
 
 app = Flask(__name__)
 
 SCOPES = ['https://www.googleapis.com/auth/calendar']
+# Single-user token file written by older versions; imported into the credential store once.
+TOKEN_FILE = 'token.pickle'
 
-def authenticate_google_calendar():
+# User whose calendar is shown when a request does not say which user it is for.
+DEFAULT_USER = 'default'
+# Header carrying the signed-in user, set by the authenticating proxy in front of the app.
+# Anyone who can reach the app directly can set it, so only expose it through that proxy.
+USER_HEADER = 'X-Forwarded-User'
+
+# Time zone the events are created in; a date-only event is due at 23:59:59 of that day there.
+CALENDAR_TZ = 'America/New_York'
+
+# Google rejects Calendar batch requests with more than 50 calls in them.
+MAX_BATCH_SIZE = 50
+
+# Events requested per page when listing, and how far ahead the index page looks.
+DEFAULT_PAGE_SIZE = 250
+INDEX_WINDOW_DAYS = 30
+
+# Local copy of the default user's calendar that the index page reads from;
+# other users get their own file in MIRROR_DIR.
+MIRROR_FILE = 'events.sqlite3'
+MIRROR_DIR = 'mirrors'
+
+# Refresh cached credentials this long before they actually expire, so a
+# request never goes out with a token that dies mid-flight.
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
+
+# Users whose credentials, service objects and mirrors are kept in memory, and
+# how long (seconds) an idle user's are kept. Older ones are rebuilt on their next request.
+MAX_CACHED_USERS = 200
+USER_CACHE_TTL = 1800
+# Token refreshes are serialized per user through this many locks, so two
+# requests of one user never refresh the same token twice.
+REFRESH_LOCK_STRIPES = 64
+
+# Seconds the index page and /events reuse a user's last synced event list
+# before asking Google for changes again. Creating or deleting an event drops it sooner.
+INDEX_CACHE_TTL = 30
+
+ROUTE_SECONDS = metrics.histogram('edusync_route_seconds', 'Latency of the Flask routes.', ('route', 'method', 'status'))
+CALENDAR_BATCH_SECONDS = metrics.histogram('edusync_calendar_batch_seconds',
+                                           'Time spent executing one Google Calendar batch request.', ('outcome',))
+
+_credentials = LRUCache(MAX_CACHED_USERS, USER_CACHE_TTL)
+_refresh_locks = [threading.Lock() for _ in range(REFRESH_LOCK_STRIPES)]
+# httplib2 is not thread-safe, so service objects are keyed by user and thread
+# while the credentials themselves are shared by all of a user's requests.
+_services = LRUCache(MAX_CACHED_USERS * 4, USER_CACHE_TTL)
+_mirrors = LRUCache(MAX_CACHED_USERS, USER_CACHE_TTL)
+_mirror_lock = threading.Lock()
+# user -> [expires at, event list, ETag, rendered page or None]
+_index_cache = LRUCache(MAX_CACHED_USERS)
+_stats_lock = threading.Lock()
+_cache_stats = {'hits': 0, 'misses': 0, 'refreshes': 0}
+_store_lock = threading.Lock()
+_credential_store = None
+
+# googleapiclient and google_auth_oauthlib take longer to import than the rest of
+# the app together, so they are only imported by the first call that needs them.
+def _build_service(credentials):
+    from googleapiclient.discovery import build
+    return build('calendar', 'v3', credentials=credentials)
+
+def _auth_request():
+    from google.auth.transport.requests import Request
+    return Request()
+
+def _run_oauth_flow(client_secrets_file, scopes):
+    # Opens the browser for the Google sign-in and returns the new credentials
+    from google_auth_oauthlib.flow import InstalledAppFlow
+    flow = InstalledAppFlow.from_client_secrets_file(client_secrets_file, scopes)
+    return flow.run_local_server(port=0)
+
+def _count(stat):
+    with _stats_lock:
+        _cache_stats[stat] += 1
+
+def calendar_cache_stats():
+    """
+    Return a snapshot of the Calendar service cache counters.
+
+    Returns:
+        dict: Number of cache hits, misses (service builds), token refreshes and
+        service objects evicted to keep the cache within its bounds.
+    """
+    with _stats_lock:
+        return dict(_cache_stats, evictions=_services.evictions)
+
+def reset_calendar_cache():
+    """
+    Drop the cached credentials, service objects and mirrors and zero the counters.
+    """
+    _credentials.clear()
+    _services.clear()
+    _mirrors.clear()
+    _index_cache.clear()
+    with _stats_lock:
+        for stat in _cache_stats:
+            _cache_stats[stat] = 0
+
+def current_user():
+    """
+    Returns:
+        str: The user the current request is for, as named by USER_HEADER, or DEFAULT_USER.
+
+    Raises:
+        UnknownUserError: USER_HEADER names a user without stored credentials (answered with 403).
+    """
+    user_id = request.headers.get(USER_HEADER) or DEFAULT_USER
+    if user_id != DEFAULT_USER and _credentials.get(user_id) is None \
+            and not get_credential_store().has_user(user_id):
+        raise UnknownUserError(f"No Google credentials stored for {user_id}")
+    return user_id
+
+def get_credential_store():
+    """
+    Return the process-wide credential store, opening it on first use.
+
+    The first call moves a token.pickle left by older versions into the store
+    as the default user's credentials.
+
+    Returns:
+        CredentialStore: The store backed by CREDENTIALS_DB.
+    """
+    global _credential_store
+    with _store_lock:
+        if _credential_store is None:
+            store = CredentialStore(CREDENTIALS_DB, SCOPES)
+            if DEFAULT_USER not in store.users():
+                store.import_pickle(TOKEN_FILE, DEFAULT_USER)
+            _credential_store = store
+        return _credential_store
+
+def get_event_mirror(user_id=DEFAULT_USER):
+    """
+    Return a user's local event mirror, opening it on first use.
+
+    Args:
+        user_id (str): User whose calendar the mirror holds.
+
+    Returns:
+        EventMirror: MIRROR_FILE for the default user, a file in MIRROR_DIR for everyone else.
+
+    Raises:
+        UnknownUserError: `user_id` has no stored credentials, so no mirror file is created for it.
+    """
+    with _mirror_lock:
+        mirror = _mirrors.get(user_id)
+        if mirror is None:
+            if user_id == DEFAULT_USER:
+                path = MIRROR_FILE
+            elif not get_credential_store().has_user(user_id):
+                raise UnknownUserError(f"No Google credentials stored for {user_id}")
+            else:
+                # Named after a hash so user names do not end up in file names
+                os.makedirs(MIRROR_DIR, exist_ok=True)
+                path = os.path.join(MIRROR_DIR, hashlib.sha256(user_id.encode('utf-8')).hexdigest()[:16] + '.sqlite3')
+            # Evicted mirrors are not closed; their connection closes once no request uses them
+            mirror = EventMirror(path)
+            _mirrors.put(user_id, mirror)
+        return mirror
+
+def _credentials_need_refresh(creds):
+    if not creds.valid:
+        return True
+    expiry = getattr(creds, 'expiry', None)
+    if not isinstance(expiry, datetime):
+        return False
+    return datetime.utcnow() >= expiry - TOKEN_REFRESH_MARGIN
+
+def _refresh_lock(user_id):
+    return _refresh_locks[hash(user_id) % len(_refresh_locks)]
+
+def _load_credentials(user_id):
+    store = get_credential_store()
+    creds = store.load(user_id)
+    if not creds or _credentials_need_refresh(creds):
+        if creds and creds.refresh_token:
+            creds.refresh(_auth_request())
+            _count('refreshes')
+        elif user_id == DEFAULT_USER:
+            creds = _run_oauth_flow('credentials.json', SCOPES)
+        else:
+            raise UnknownUserError(f"No Google credentials stored for {user_id}; "
+                              f"run python credentialstore.py --add {user_id}")
+        store.save(user_id, creds)
+    return creds
+
+def get_credentials(user_id=DEFAULT_USER):
+    """
+    Return a user's Google credentials, refreshing them only when close to expiry.
+
+    A user's token is read from the credential store on their first request and
+    only written back when it is refreshed. Refreshes are single-flight: threads
+    that find the token expiring while another thread refreshes it wait for that
+    refresh instead of starting their own.
+
+    Args:
+        user_id (str): User whose credentials to return.
+
+    Returns:
+        google.oauth2.credentials.Credentials: Valid user credentials.
+
+    Raises:
+        UnknownUserError: No credentials are stored for `user_id` (other than the default user,
+            who is sent through the browser sign-in instead).
+    """
+    creds = _credentials.get(user_id)
+    if creds is not None and not _credentials_need_refresh(creds):
+        return creds
+    with _refresh_lock(user_id):
+        creds = _credentials.get(user_id)
+        if creds is not None and not _credentials_need_refresh(creds):
+            return creds
+        if creds is not None and creds.refresh_token:
+            creds.refresh(_auth_request())
+            _count('refreshes')
+            get_credential_store().save(user_id, creds)
+        else:
+            creds = _load_credentials(user_id)
+        _credentials.put(user_id, creds)
+        return creds
+
+def authenticate_google_calendar(user_id=DEFAULT_USER):
     """
     Authenticate the user with Google Calendar API and return the service object.
 
-    This function checks if there are existing credentials saved in a file. If not, 
-    it initiates the OAuth flow to obtain new credentials and saves them for future use.
+    Credentials come from the credential store; the default user without stored
+    credentials is sent through the OAuth flow and the result is saved for future use.
+    Credentials are cached per user and the built service object is reused by the
+    calling thread, so only a user's first request pays for the discovery build.
+    Both caches are bounded (MAX_CACHED_USERS, USER_CACHE_TTL), so memory does not
+    grow with the number of users.
+
+    Args:
+        user_id (str): User whose calendar to open.
 
     Returns:
         googleapiclient.discovery.Resource: Authenticated Google Calendar service object.
     """
-    creds = None
-    if creds_file := "token.pickle":
-        try:
-            with open(creds_file, 'rb') as token:
-                creds = pickle.load(token)
-        except FileNotFoundError:
-            pass
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file('credentials.json', SCOPES)
-            creds = flow.run_local_server(port=0)
-        with open('token.pickle', 'wb') as token:
-            pickle.dump(creds, token)
-    return build('calendar', 'v3', credentials=creds)
+    creds = get_credentials(user_id)
+    key = (user_id, threading.get_ident())
+    cached = _services.get(key)
+    if cached is not None and cached[0] is creds:
+        _count('hits')
+        return cached[1]
+    _count('misses')
+    service = _build_service(creds)
+    _services.put(key, (creds, service))
+    return service
+
+def _to_rfc3339(value):
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            return value.isoformat() + 'Z'
+        return value.isoformat()
+    return value
 
-def fetch_events(calendar_service):
+def iter_events(calendar_service, time_min=None, time_max=None, page_size=DEFAULT_PAGE_SIZE):
     """
-    Fetch upcoming events from Google Calendar.
+    Lazily yield events from Google Calendar, following pagination.
+
+    Only one page of events is held in memory at a time; the next page is requested
+    with its nextPageToken once the caller has consumed the current one.
 
     Args:
         calendar_service (googleapiclient.discovery.Resource): Authenticated Google Calendar service object.
+        time_min (datetime or str, optional): Start of the window. Defaults to now.
+        time_max (datetime or str, optional): End of the window. Unbounded when omitted.
+        page_size (int): Number of events requested per page (Google allows up to 2500).
 
-    Returns:
-        list: A list of events with their ID, name, and start date (formatted as YYYY-MM-DD).
+    Yields:
+        dict: An event with its ID, name, and start date (formatted as YYYY-MM-DD).
     """
-    now = datetime.utcnow().isoformat() + 'Z'  
-    events_result = calendar_service.events().list(
-        calendarId='primary', timeMin=now, maxResults=10, singleEvents=True,
-        orderBy='startTime').execute()
-    events = events_result.get('items', [])
-    
-    formatted_events = []
-    for event in events:
-        event_start = event['start'].get('dateTime', event['start'].get('date'))
-        formatted_date = event_start.split('T')[0] if 'T' in event_start else event_start
-        formatted_events.append({'id': event['id'], 'name': event['summary'], 'start': formatted_date})
-    
-    return formatted_events
+    params = {
+        'calendarId': 'primary',
+        'timeMin': _to_rfc3339(time_min or datetime.utcnow()),
+        'maxResults': page_size,
+        'singleEvents': True,
+        'orderBy': 'startTime',
+    }
+    if time_max is not None:
+        params['timeMax'] = _to_rfc3339(time_max)
+    page_token = None
+    while True:
+        events_result = calendar_service.events().list(pageToken=page_token, **params).execute()
+        for event in events_result.get('items', []):
+            yield format_event(event)
+        page_token = events_result.get('nextPageToken')
+        if not page_token:
+            return
 
-def create_event(calendar_service, event_name, event_date):
+def fetch_events(calendar_service, time_min=None, time_max=None, page_size=DEFAULT_PAGE_SIZE):
     """
-    Create a new event in Google Calendar.
+    Fetch upcoming events from Google Calendar.
 
     Args:
         calendar_service (googleapiclient.discovery.Resource): Authenticated Google Calendar service object.
-        event_name (str): The name or title of the event.
-        event_date (str): The date of the event in YYYY-MM-DD format.
+        time_min (datetime or str, optional): Start of the window. Defaults to now.
+        time_max (datetime or str, optional): End of the window. Unbounded when omitted.
+        page_size (int): Number of events requested per page.
 
     Returns:
-        dict: The created event object as returned by Google Calendar API.
+        list: A list of events with their ID, name, and start date (formatted as YYYY-MM-DD).
     """
-    event = {
+    return list(iter_events(calendar_service, time_min, time_max, page_size))
+
+def _event_body(event_name, event_date, description=None, content_id=None):
+    body = {
         'summary': event_name,
         'start': {
             'dateTime': f"{event_date}T23:59:59",  
-            'timeZone': 'America/New_York',
+            'timeZone': CALENDAR_TZ,
         },
         'end': {
             'dateTime': f"{event_date}T23:59:59",  
-            'timeZone': 'America/New_York',
+            'timeZone': CALENDAR_TZ,
         },
     }
+    if description:
+        body['description'] = description
+    if content_id:
+        # Lets an event be traced back to the Blackboard item it was made from
+        body['extendedProperties'] = {'private': {'contentId': content_id}}
+    return body
+
+def _bulk_event_body(event):
+    return _event_body(event['name'], event['date'], event.get('description'), event.get('contentId'))
+
+def create_event(calendar_service, event_name, event_date):
+    """
+    Create a new event in Google Calendar.
+
+    Args:
+        calendar_service (googleapiclient.discovery.Resource): Authenticated Google Calendar service object.
+        event_name (str): The name or title of the event.
+        event_date (str): The date of the event in YYYY-MM-DD format.
+
+    Returns:
+        dict: The created event object as returned by Google Calendar API.
+    """
+    event = _event_body(event_name, event_date)
     return calendar_service.events().insert(calendarId='primary', body=event).execute()
 
 def delete_event(calendar_service, event_id):
@@ -98,6 +372,118 @@ def delete_event(calendar_service, event_id):
     """
     calendar_service.events().delete(calendarId='primary', eventId=event_id).execute()
 
+def _execute_in_batches(calendar_service, api_requests):
+    """
+    Send API requests as Google batch HTTP requests of at most MAX_BATCH_SIZE calls.
+
+    Args:
+        calendar_service (googleapiclient.discovery.Resource): Authenticated Google Calendar service object.
+        api_requests (list): Unexecuted googleapiclient HttpRequest objects.
+
+    Returns:
+        list: One result per request, in input order. Each result has an 'ok' flag and
+        either the API 'result' or an 'error' message.
+    """
+    results = [None] * len(api_requests)
+
+    def callback(request_id, response, exception):
+        if exception is not None:
+            status = getattr(getattr(exception, 'resp', None), 'status', None)
+            results[int(request_id)] = {'ok': False, 'error': str(exception), 'status': status}
+        else:
+            results[int(request_id)] = {'ok': True, 'result': response}
+
+    for start in range(0, len(api_requests), MAX_BATCH_SIZE):
+        stop = min(start + MAX_BATCH_SIZE, len(api_requests))
+        batch = calendar_service.new_batch_http_request(callback=callback)
+        for index in range(start, stop):
+            batch.add(api_requests[index], request_id=str(index))
+        try:
+            with CALENDAR_BATCH_SECONDS.time(outcome='sent'):
+                batch.execute()
+        except Exception as e:
+            # The whole batch failed in transport; report it against every item
+            # that did not already get an answer and carry on with the next one.
+            for index in range(start, stop):
+                if results[index] is None:
+                    results[index] = {'ok': False, 'error': str(e)}
+    return results
+
+def create_events(calendar_service, events):
+    """
+    Create many events in Google Calendar using batched API calls.
+
+    Args:
+        calendar_service (googleapiclient.discovery.Resource): Authenticated Google Calendar service object.
+        events (list): Dicts with the event 'name' and 'date' (YYYY-MM-DD), and optionally
+            a 'description' and the Blackboard 'contentId' it came from.
+
+    Returns:
+        list: Per-event results in input order; successful ones carry the created event as 'result'.
+    """
+    api_requests = [
+        calendar_service.events().insert(calendarId='primary', body=_bulk_event_body(event))
+        for event in events
+    ]
+    return _execute_in_batches(calendar_service, api_requests)
+
+def update_events(calendar_service, events):
+    """
+    Update many existing events in Google Calendar using batched API calls.
+
+    Args:
+        calendar_service (googleapiclient.discovery.Resource): Authenticated Google Calendar service object.
+        events (list): Dicts like those given to create_events, plus the event 'id' to update.
+
+    Returns:
+        list: Per-event results in input order; successful ones carry the updated event as 'result'.
+    """
+    api_requests = [
+        calendar_service.events().patch(calendarId='primary', eventId=event['id'], body=_bulk_event_body(event))
+        for event in events
+    ]
+    return _execute_in_batches(calendar_service, api_requests)
+
+def delete_events(calendar_service, event_ids):
+    """
+    Delete many events from Google Calendar using batched API calls.
+
+    Args:
+        calendar_service (googleapiclient.discovery.Resource): Authenticated Google Calendar service object.
+        event_ids (list): Unique IDs of the events to be deleted.
+
+    Returns:
+        list: Per-event results in input order, each tagged with the event 'id'.
+    """
+    api_requests = [
+        calendar_service.events().delete(calendarId='primary', eventId=event_id)
+        for event_id in event_ids
+    ]
+    results = _execute_in_batches(calendar_service, api_requests)
+    for event_id, result in zip(event_ids, results):
+        result['id'] = event_id
+    return results
+
+@app.errorhandler(UnknownUserError)
+def _unknown_user(error):
+    return jsonify({'error': str(error)}), 403
+
+@app.before_request
+def _start_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def _record_latency(response):
+    """
+    Record how long the route took, labelled with its URL rule rather than the raw path.
+    """
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        ROUTE_SECONDS.observe(time.perf_counter() - started, route=route, method=request.method,
+                              status=response.status_code)
+    return response
+
 html_template = """
 <!DOCTYPE html>
 <html lang="en">
@@ -131,22 +517,96 @@ html_template = """
 </html>
 """
 
+def invalidate_index_cache(user_id=DEFAULT_USER):
+    """
+    Forget a user's cached event list so the next page view syncs with Google again.
+
+    Args:
+        user_id (str): User whose calendar changed.
+    """
+    _index_cache.pop(user_id)
+
+def _index_entry(user_id):
+    """
+    Return a user's upcoming events, syncing the mirror at most once per INDEX_CACHE_TTL.
+
+    Returns:
+        list: [expires at, event list, ETag of the list, rendered page or None].
+    """
+    entry = _index_cache.get(user_id)
+    if entry is not None and time.monotonic() < entry[0]:
+        return entry
+    # Authenticate first, so a user without credentials never gets a mirror file
+    try:
+        service = authenticate_google_calendar(user_id)
+    except UnknownUserError:
+        raise
+    except Exception as e:
+        service = None
+        metrics.log_event('calendar_sync_failed', level=logging.WARNING, error=str(e))
+    mirror = get_event_mirror(user_id)
+    if service is not None:
+        try:
+            sync_events(service, mirror)
+        except Exception as e:
+            metrics.log_event('calendar_sync_failed', level=logging.WARNING, error=str(e))
+    today = datetime.utcnow().date()
+    events = mirror.events_between(today.isoformat(), (today + timedelta(days=INDEX_WINDOW_DAYS)).isoformat())
+    digest = hashlib.sha256(json.dumps([user_id, events], sort_keys=True).encode('utf-8')).hexdigest()[:32]
+    entry = [time.monotonic() + INDEX_CACHE_TTL, events, digest, None]
+    _index_cache.put(user_id, entry)
+    return entry
+
+def _conditional(etag, body):
+    """
+    Answer with 304 when the client already has `etag`, otherwise with the body `body()` builds.
+    """
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = body()
+    response.set_etag(etag)
+    # Browsers must check back every time, so a change shows up on the next load
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
 @app.route("/", methods=["GET"])
 def index():
     """
     Display the HTML form for creating a Google Calendar event
     and fetch current events to display on the page.
 
+    Events are read from the local mirror after pulling only the changes made
+    since the last sync. If Google cannot be reached the last mirrored copy is shown.
+    The rendered page is kept for INDEX_CACHE_TTL seconds per user, and a browser
+    that sends the page's ETag back gets a 304 without a body.
+
     Returns:
-        str: The rendered HTML form with current events.
+        Response: The rendered HTML form with current events, or 304 Not Modified.
     """
-    try:
-        service = authenticate_google_calendar()
-        events = fetch_events(service)
-    except Exception as e:
-        events = []
-        print(f"An error occurred while fetching events: {e}")
-    return render_template_string(html_template, events=events)
+    entry = _index_entry(current_user())
+
+    def render():
+        # Rendered on the first full request only; later ones within the TTL reuse the page
+        if entry[3] is None:
+            entry[3] = render_template_string(html_template, events=entry[1])
+        return Response(entry[3], content_type='text/html; charset=utf-8')
+
+    return _conditional('h-' + entry[2], render)
+
+@app.route("/events", methods=["GET"])
+def handle_list_events():
+    """
+    Return the events shown on the index page as JSON, for clients that poll.
+
+    Uses the same per-user cache as the index page; send the last ETag in
+    If-None-Match to get a 304 while nothing changed.
+
+    Returns:
+        Response: JSON {"events": [...]} or 304 Not Modified.
+    """
+    _, events, digest, _ = _index_entry(current_user())
+    return _conditional('j-' + digest, lambda: jsonify({'events': events}))
 
 @app.route("/create_event", methods=["POST"])
 def handle_form_submission():
@@ -154,19 +614,23 @@ def handle_form_submission():
     Handle form submission, create a Google Calendar event, and refresh the page.
 
     Extracts event name and date from the submitted form, authenticates with Google Calendar,
-    and creates the event. Refreshes the page to show updated events.
+    and creates the event. Redirects to the index page, so reloading it does not create
+    the event again.
 
     Returns:
-        str: Rendered HTML page with updated events.
+        Response: 303 redirect to the index page, or the error message.
     """
+    user_id = current_user()
     event_name = request.form.get("event_name")
     event_date = request.form.get("event_date")
     try:
-        service = authenticate_google_calendar()
-        create_event(service, event_name, event_date)
+        service = authenticate_google_calendar(user_id)
+        event = create_event(service, event_name, event_date)
+        get_event_mirror(user_id).upsert([event])
     except Exception as e:
         return f"An error occurred: {e}"
-    return index()
+    invalidate_index_cache(user_id)
+    return redirect(url_for('index'), code=303)
 
 @app.route("/delete_event", methods=["POST"])
 def handle_event_deletion():
@@ -174,18 +638,97 @@ def handle_event_deletion():
     Handle event deletion from Google Calendar and refresh the page.
 
     Extracts event ID from the submitted form, authenticates with Google Calendar,
-    and deletes the specified event. Refreshes the page to show updated events.
+    and deletes the specified event. Redirects to the index page, so reloading it
+    does not send the deletion again.
 
     Returns:
-        str: Rendered HTML page with updated events.
+        Response: 303 redirect to the index page, or the error message.
     """
+    user_id = current_user()
     event_id = request.form.get("event_id")
     try:
-        service = authenticate_google_calendar()
+        service = authenticate_google_calendar(user_id)
         delete_event(service, event_id)
+        get_event_mirror(user_id).remove([event_id])
     except Exception as e:
         return f"An error occurred: {e}"
-    return index()
+    invalidate_index_cache(user_id)
+    return redirect(url_for('index'), code=303)
+
+@app.route("/events/bulk", methods=["POST"])
+def handle_bulk_events():
+    """
+    Create and delete many events in one call using Google batch requests.
+
+    Expects a JSON body such as {"create": [{"name": ..., "date": ...}], "delete": [event_id, ...]}.
+
+    Returns:
+        Response: JSON with per-item 'created' and 'deleted' results.
+    """
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+    to_create = payload.get('create', [])
+    to_delete = payload.get('delete', [])
+    if not isinstance(to_create, list) or not isinstance(to_delete, list):
+        return jsonify({'error': "'create' and 'delete' must be lists"}), 400
+    if any(not isinstance(event_id, str) for event_id in to_delete):
+        return jsonify({'error': "Every event to delete must be given by its ID"}), 400
+    if any(not isinstance(event, dict) or 'name' not in event or 'date' not in event for event in to_create):
+        return jsonify({'error': "Every event to create needs a 'name' and a 'date'"}), 400
+    user_id = current_user()
+    try:
+        service = authenticate_google_calendar(user_id)
+        created = create_events(service, to_create) if to_create else []
+        deleted = delete_events(service, to_delete) if to_delete else []
+    except Exception as e:
+        return jsonify({'error': f"An error occurred: {e}"}), 500
+    invalidate_index_cache(user_id)
+    return jsonify({'created': created, 'deleted': deleted})
+
+@app.route("/export.ics", methods=["GET"])
+def handle_export():
+    """
+    Download the calendar as an iCalendar file.
+
+    Events are fetched from Google one page at a time and written out in chunks
+    as they arrive, so the whole calendar is never held in memory. The optional
+    `from` and `to` query parameters (YYYY-MM-DD) limit the export to those days;
+    by default it starts today and has no end.
+
+    Returns:
+        Response: A streamed text/calendar document, or 400 for a bad date.
+    """
+    try:
+        time_min = datetime.fromisoformat(request.args['from']) if 'from' in request.args else None
+        time_max = datetime.fromisoformat(request.args['to']) + timedelta(days=1) if 'to' in request.args else None
+    except ValueError:
+        return jsonify({'error': "'from' and 'to' must be dates in YYYY-MM-DD format"}), 400
+    user_id = current_user()
+    try:
+        service = authenticate_google_calendar(user_id)
+    except Exception as e:
+        return jsonify({'error': f"An error occurred: {e}"}), 500
+
+    def generate():
+        try:
+            yield from ics_chunks(iter_events(service, time_min, time_max))
+        except Exception as e:
+            # The status is already sent; the missing END:VCALENDAR marks the file as cut short
+            metrics.log_event('calendar_export_failed', level=logging.WARNING, error=str(e))
+
+    return Response(stream_with_context(generate()), content_type='text/calendar; charset=utf-8',
+                    headers={'Content-Disposition': 'attachment; filename="calendar.ics"'})
+
+@app.route("/metrics", methods=["GET"])
+def handle_metrics():
+    """
+    Expose counters and latency histograms for Prometheus.
+
+    Returns:
+        Response: Every metric of this process in the Prometheus text format.
+    """
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
 
 if __name__ == "__main__":
     """
@@ -0,0 +1,450 @@
+import hashlib
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+import unicodedata
+from datetime import date, datetime, timedelta, timezone
+from pymongo import ASCENDING, DeleteMany, IndexModel, MongoClient, UpdateOne, errors
+import metrics
+
+# MongoDB connection settings; each can be overridden with an environment variable or an init() argument
+MONGO_URI = os.environ.get("EDUSYNC_MONGO_URI", "mongodb://localhost:27017/")  # Replace with your MongoDB connection string
+MONGO_DB = os.environ.get("EDUSYNC_MONGO_DB", "blackboard_db")
+# Connections each process keeps per MongoDB server (pymongo's default of 100 is far more than a sync needs)
+MONGO_MAX_POOL_SIZE = int(os.environ.get("EDUSYNC_MONGO_POOL_SIZE", "20"))
+# Milliseconds to wait for a reachable server or a new connection before failing instead of hanging a sync
+MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get("EDUSYNC_MONGO_CONNECT_TIMEOUT_MS", "5000"))
+# Milliseconds to wait for the reply to one operation (a full bulk_write of FLUSH_SIZE documents included)
+MONGO_SOCKET_TIMEOUT_MS = int(os.environ.get("EDUSYNC_MONGO_SOCKET_TIMEOUT_MS", "30000"))
+
+# Number of documents buffered before they are written in one bulk_write
+FLUSH_SIZE = 500
+# Seconds after which a partly filled buffer is written anyway
+FLUSH_INTERVAL = 5.0
+
+DB_SECONDS = metrics.histogram("edusync_db_seconds", "Time spent on MongoDB calls made by the content writer.",
+                               ("operation",))
+CONTENT_ITEMS = metrics.counter("edusync_content_items_total",
+                                "Course content items seen by the writer, by outcome (inserted/updated/unchanged/errors).",
+                                ("result",))
+
+# Fields stored as BSON datetimes (UTC) so range queries and sorting work on real dates
+DATE_FIELDS = ("created", "modified", "due")
+# Fields returned by the deadline lookups
+DEADLINE_FIELDS = {"_id": 0, "contentId": 1, "courseId": 1, "title": 1, "due": 1}
+
+# contentId is unique; the compound indexes serve "what is due / what changed in course X" queries
+# and syncedAt serves "what did we store since" (see calendarprojection.py)
+INDEXES = [
+    IndexModel([("contentId", ASCENDING)], unique=True),
+    IndexModel([("courseId", ASCENDING), ("due", ASCENDING)]),
+    IndexModel([("courseId", ASCENDING), ("modified", ASCENDING)]),
+    IndexModel([("due", ASCENDING)]),
+    IndexModel([("syncedAt", ASCENDING)]),
+]
+
+_db = None
+_indexes_ready = False
+_db_lock = threading.Lock()
+
+def init(uri=None, db_name=None, max_pool_size=None, connect_timeout_ms=None, socket_timeout_ms=None, client=None):
+    """
+    Set up the process-wide MongoDB connection. Nothing connects when a module is imported;
+    this runs on the first get_db() unless it was called explicitly first.
+
+    Args:
+        uri (str, optional): Connection string. Defaults to MONGO_URI.
+        db_name (str, optional): Database name. Defaults to MONGO_DB.
+        max_pool_size (int, optional): Defaults to MONGO_MAX_POOL_SIZE.
+        connect_timeout_ms (int, optional): Defaults to MONGO_CONNECT_TIMEOUT_MS.
+        socket_timeout_ms (int, optional): Defaults to MONGO_SOCKET_TIMEOUT_MS.
+        client (pymongo.MongoClient, optional): Ready-made client to use instead (e.g. mongomock in tests).
+
+    Returns:
+        pymongo.database.Database: The database holding course_content.
+    """
+    global _db, _indexes_ready
+    with _db_lock:
+        if _db is not None:
+            _db.client.close()
+        if client is None:
+            connect_timeout_ms = connect_timeout_ms or MONGO_CONNECT_TIMEOUT_MS
+            # pymongo connects in the background, so building the client never blocks
+            client = MongoClient(uri or MONGO_URI, maxPoolSize=max_pool_size or MONGO_MAX_POOL_SIZE,
+                                 serverSelectionTimeoutMS=connect_timeout_ms, connectTimeoutMS=connect_timeout_ms,
+                                 socketTimeoutMS=socket_timeout_ms or MONGO_SOCKET_TIMEOUT_MS)
+        _db = client[db_name or MONGO_DB]
+        _indexes_ready = False
+        return _ensure_ready()
+
+def get_db():
+    """
+    Return the process-wide database, connecting and creating indexes on first use.
+
+    Returns:
+        pymongo.database.Database: The database holding course_content.
+    """
+    if _db is None:
+        return init()
+    if not _indexes_ready:
+        with _db_lock:
+            return _ensure_ready()
+    return _db
+
+def _ensure_ready():
+    # Called with _db_lock held; a server that is down is retried on the next get_db()
+    global _indexes_ready
+    if not _indexes_ready:
+        try:
+            ensure_indexes(_db["course_content"])
+            _indexes_ready = True
+        except Exception as e:
+            metrics.log_event("db_error", level=logging.ERROR, operation="create_indexes", error=str(e))
+    return _db
+
+def close():
+    """
+    Close the process-wide connection; the next get_db() opens a new one.
+    """
+    global _db, _indexes_ready
+    with _db_lock:
+        if _db is not None:
+            _db.client.close()
+        _db = None
+        _indexes_ready = False
+
+def ensure_indexes(collection):
+    """
+    Create the course_content indexes; indexes that already exist are left alone.
+
+    Args:
+        collection (pymongo.collection.Collection): The course_content collection.
+    """
+    collection.create_indexes(INDEXES)
+
+def parse_date(value):
+    """
+    Turn an ISO 8601 string (as sent by Blackboard or found in the page) into a naive UTC datetime.
+
+    Args:
+        value: A string, date or datetime. Anything that cannot be parsed is returned unchanged.
+
+    Returns:
+        datetime: The value in UTC without tzinfo, the way pymongo stores and returns it.
+    """
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+        except ValueError:
+            return value
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    return value
+
+def normalize_dates(document):
+    """
+    Returns:
+        dict: A copy of `document` with every field in DATE_FIELDS converted by parse_date.
+    """
+    return {key: parse_date(value) if key in DATE_FIELDS else value for key, value in document.items()}
+
+def deadlines_between(collection, start, end, course_id=None, fields=DEADLINE_FIELDS):
+    """
+    Find items due in [start, end), earliest first, using the courseId/due index.
+
+    Args:
+        collection (pymongo.collection.Collection): The course_content collection.
+        start (datetime): Start of the window (inclusive).
+        end (datetime): End of the window (exclusive).
+        course_id (str, optional): Restrict to one course.
+        fields (dict): Projection applied to the results.
+
+    Returns:
+        pymongo.cursor.Cursor: Matching documents.
+    """
+    query = {"due": {"$gte": parse_date(start), "$lt": parse_date(end)}}
+    if course_id is not None:
+        query["courseId"] = course_id
+    return collection.find(query, fields).sort("due", ASCENDING)
+
+def due_this_week(collection, course_id=None, now=None):
+    """
+    Find items due in the next seven days.
+
+    Returns:
+        pymongo.cursor.Cursor: Matching documents, earliest first.
+    """
+    now = parse_date(now or datetime.now(timezone.utc))
+    return deadlines_between(collection, now, now + timedelta(days=7), course_id)
+
+def modified_since(collection, course_id, since, fields=None):
+    """
+    Find a course's items modified at or after `since`, oldest first, using the courseId/modified index.
+
+    Returns:
+        pymongo.cursor.Cursor: Matching documents.
+    """
+    query = {"courseId": course_id, "modified": {"$gte": parse_date(since)}}
+    return collection.find(query, fields).sort("modified", ASCENDING)
+
+def migrate_dates(collection, batch_size=FLUSH_SIZE):
+    """
+    One-shot migration that converts date strings already stored in course_content to BSON datetimes.
+
+    Returns:
+        int: Number of documents converted.
+    """
+    operations = []
+    converted = 0
+    query = {"$or": [{field: {"$type": "string"}} for field in DATE_FIELDS]}
+    for document in collection.find(query, {field: 1 for field in DATE_FIELDS}):
+        changes = {field: parse_date(document[field]) for field in DATE_FIELDS
+                   if isinstance(document.get(field), str) and isinstance(parse_date(document[field]), datetime)}
+        if changes:
+            operations.append(UpdateOne({"_id": document["_id"]}, {"$set": changes}))
+        if len(operations) >= batch_size:
+            converted += collection.bulk_write(operations, ordered=False).modified_count
+            operations = []
+    if operations:
+        converted += collection.bulk_write(operations, ordered=False).modified_count
+    return converted
+
+# Key for content IDs derived from scraped pages; changing it changes every derived ID
+CONTENT_ID_KEY = b"edusync-content-id-v1"
+
+def canonicalize(text):
+    """
+    Normalize text so cosmetic differences (Unicode form, case, spacing) do not change derived IDs.
+    """
+    return " ".join(unicodedata.normalize("NFKC", str(text)).casefold().split())
+
+def make_content_id(*parts):
+    """
+    Derive a content ID that is the same in every process and on every run.
+
+    Unlike the built-in hash(), which is randomized per process, this is a keyed
+    SHA-256 of the canonicalized parts.
+
+    Args:
+        *parts: Values identifying the item, e.g. the course URL and the block's DOM id or title.
+
+    Returns:
+        str: A 32 character hex ID.
+    """
+    message = "\x1f".join(canonicalize(part) for part in parts).encode("utf-8")
+    return hmac.new(CONTENT_ID_KEY, message, hashlib.sha256).hexdigest()[:32]
+
+def rekey_content_ids(collection, new_id_for, query=None, set_fields=None, batch_size=FLUSH_SIZE):
+    """
+    One-shot migration that rewrites the contentId of existing documents and removes duplicates.
+
+    Documents that map to the same new ID are collapsed onto the most recently
+    modified copy. If a document with the new ID already exists, the old copies
+    are removed instead of rekeyed.
+
+    Args:
+        collection (pymongo.collection.Collection): Collection to migrate.
+        new_id_for (callable): Returns the new contentId for a stored document.
+        query (dict, optional): Selects the documents to migrate. Defaults to all.
+        set_fields (dict, optional): Extra fields to set on every rekeyed document.
+        batch_size (int): Number of write operations per bulk_write.
+
+    Returns:
+        dict: Number of documents 'rekeyed' and duplicates 'removed'.
+    """
+    groups = {}
+    for document in collection.find(query or {}, {"fingerprint": 0}):
+        groups.setdefault(new_id_for(document), []).append(document)
+
+    new_ids = list(groups)
+    already_stored = set()
+    for start in range(0, len(new_ids), batch_size):
+        chunk = new_ids[start:start + batch_size]
+        already_stored.update(doc["contentId"] for doc in collection.find(
+            {"contentId": {"$in": chunk}}, {"contentId": 1, "_id": 0}))
+
+    removed = []
+    updates = []
+    for new_id, documents in groups.items():
+        documents.sort(key=lambda document: str(document.get("modified") or ""), reverse=True)
+        if any(document["contentId"] == new_id for document in documents):
+            # One copy already carries the new ID; keep it rather than the newest
+            keeper = next(document for document in documents if document["contentId"] == new_id)
+        elif new_id in already_stored:
+            keeper = None
+        else:
+            keeper = documents[0]
+        removed.extend(document["_id"] for document in documents if document is not keeper)
+        if keeper is not None and (keeper["contentId"] != new_id or set_fields):
+            updates.append(UpdateOne({"_id": keeper["_id"]}, {"$set": {**(set_fields or {}), "contentId": new_id}}))
+
+    # Duplicates go first so no rekeyed document collides with one still waiting to be removed
+    operations = [DeleteMany({"_id": {"$in": removed[start:start + batch_size]}})
+                  for start in range(0, len(removed), batch_size)]
+    operations += updates
+    for start in range(0, len(operations), batch_size):
+        collection.bulk_write(operations[start:start + batch_size], ordered=True)
+    return {"rekeyed": len(updates), "removed": len(removed)}
+
+def fingerprint(document):
+    """
+    Compute a stable digest of the fields of a content document that matter for change detection.
+
+    Args:
+        document (dict): Course content document.
+
+    Returns:
+        str: Hex SHA-256 of the document without its `_id` and `fingerprint` fields.
+    """
+    relevant = {key: value for key, value in document.items() if key not in ("_id", "fingerprint")}
+    canonical = json.dumps(relevant, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+class ContentWriter:
+    """
+    Buffers course content documents and upserts them into MongoDB in unordered batches.
+
+    Documents are keyed on `contentId`, so each one costs a share of a single
+    bulk_write instead of a find_one plus an insert_one. Every stored document
+    carries a fingerprint of its fields; items whose fingerprint has not changed
+    are skipped without a write, and real changes are also recorded as change
+    events and stamped with the time they were stored in `syncedAt`. The writer
+    is safe to share between the threads of one poll cycle.
+    """
+
+    def __init__(self, collection, flush_size=FLUSH_SIZE, flush_interval=FLUSH_INTERVAL, changes_collection=None,
+                 on_failure=None):
+        """
+        Args:
+            collection (pymongo.collection.Collection): Collection to write to.
+            flush_size (int): Number of buffered documents that triggers a write.
+            flush_interval (float): Seconds after the last write at which the next add triggers one.
+            changes_collection (pymongo.collection.Collection, optional): Where change events are recorded.
+            on_failure (callable, optional): Called with the documents that could not be written and the
+                error, e.g. to park them in a dead-letter collection. Failures are only logged without it.
+        """
+        self.collection = collection
+        self.changes_collection = changes_collection
+        self.on_failure = on_failure
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.stats = {"inserted": 0, "updated": 0, "unchanged": 0, "errors": 0, "batches": 0}
+        self._buffer = {}
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+    def add(self, document):
+        """
+        Queue a document for upsert, writing the buffer if it is full or old enough.
+
+        Args:
+            document (dict): Course content document with a `contentId`. Date fields are
+                converted to datetimes before storing.
+        """
+        document = normalize_dates(document)
+        with self._lock:
+            # A later copy of the same item in one batch simply replaces the earlier one
+            self._buffer[document["contentId"]] = document
+            due = (len(self._buffer) >= self.flush_size
+                   or time.monotonic() - self._last_flush >= self.flush_interval)
+            if due:
+                self._flush_locked()
+
+    def flush(self):
+        """
+        Write everything that is buffered.
+
+        Returns:
+            dict: Running totals of inserted, updated, unchanged and failed documents.
+        """
+        with self._lock:
+            self._flush_locked()
+            return dict(self.stats)
+
+    def _count(self, result, amount):
+        self.stats[result] += amount
+        CONTENT_ITEMS.inc(amount, result=result)
+
+    def _failed(self, documents, error):
+        self._count("errors", len(documents))
+        if self.on_failure is None:
+            return
+        try:
+            self.on_failure(documents, error)
+        except Exception as e:
+            metrics.log_event("db_error", level=logging.ERROR, operation="on_failure", error=str(e))
+
+    def _flush_locked(self):
+        self._last_flush = time.monotonic()
+        if not self._buffer:
+            return
+        buffered, self._buffer = self._buffer, {}
+        self.stats["batches"] += 1
+        try:
+            # One read per batch tells us which items really changed
+            with DB_SECONDS.time(operation="find_fingerprints"):
+                stored = {doc["contentId"]: doc.get("fingerprint") for doc in self.collection.find(
+                    {"contentId": {"$in": list(buffered)}}, {"contentId": 1, "fingerprint": 1, "_id": 0})}
+        except Exception as e:
+            metrics.log_event("db_error", level=logging.ERROR, operation="find_fingerprints", error=str(e))
+            self._failed(list(buffered.values()), e)
+            return
+        operations = []
+        written = []
+        changes = []
+        detected_at = datetime.now(timezone.utc)
+        for content_id, document in buffered.items():
+            digest = fingerprint(document)
+            if content_id in stored and stored[content_id] == digest:
+                self._count("unchanged", 1)
+                continue
+            operations.append(UpdateOne({"contentId": content_id}, {"$set": {
+                **document, "fingerprint": digest, "syncedAt": detected_at.replace(tzinfo=None)}}, upsert=True))
+            written.append(document)
+            changes.append({
+                "contentId": content_id,
+                "courseId": document.get("courseId"),
+                "type": "updated" if content_id in stored else "created",
+                "fingerprint": digest,
+                "previousFingerprint": stored.get(content_id),
+                "detectedAt": detected_at,
+            })
+        if not operations:
+            return
+        try:
+            with DB_SECONDS.time(operation="bulk_write"):
+                result = self.collection.bulk_write(operations, ordered=False)
+            inserted, modified = result.upserted_count, result.modified_count
+        except errors.BulkWriteError as e:
+            details = e.details
+            inserted, modified = details["nUpserted"], details["nModified"]
+            failed = {error["index"] for error in details["writeErrors"]}
+            changes = [change for index, change in enumerate(changes) if index not in failed]
+            metrics.log_event("db_error", level=logging.ERROR, operation="bulk_write", failed=len(failed),
+                              error=details["writeErrors"][0]["errmsg"])
+            self._failed([written[index] for index in sorted(failed)], details["writeErrors"][0]["errmsg"])
+        except Exception as e:
+            metrics.log_event("db_error", level=logging.ERROR, operation="bulk_write", error=str(e))
+            self._failed(written, e)
+            return
+        self._count("inserted", inserted)
+        self._count("updated", modified)
+        if self.changes_collection is not None and changes:
+            try:
+                with DB_SECONDS.time(operation="insert_changes"):
+                    self.changes_collection.insert_many(changes, ordered=False)
+            except Exception as e:
+                metrics.log_event("db_error", level=logging.ERROR, operation="insert_changes", error=str(e))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
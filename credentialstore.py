@@ -0,0 +1,199 @@
+###GOOGLE CREDENTIALS OF EVERY CALENDAR USER IN ONE SQLITE FILE, AND THE BOUNDED CACHE THE CALENDAR APP KEEPS PER-USER CLIENTS IN. RUN "python credentialstore.py --add USER" TO AUTHORIZE A USER###
+import argparse
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# SQLite file holding one OAuth token per user (keep it private, the tokens give access to the calendars)
+CREDENTIALS_DB = "credentials.sqlite3"
+
+class UnknownUserError(LookupError):
+    """
+    A request or command named a user who has no stored credentials.
+    """
+
+class CredentialStore:
+    """
+    Google OAuth credentials keyed by user, stored as the JSON google-auth writes.
+
+    Tokens are only read when a user is first seen (or after the calendar app
+    forgot them) and only written after a login or a refresh, so requests do
+    not touch the file.
+    """
+
+    def __init__(self, path=CREDENTIALS_DB, scopes=None):
+        """
+        Open (and create if needed) the store.
+
+        Args:
+            path (str): SQLite database file, or ':memory:' for a throwaway store.
+            scopes (list, optional): OAuth scopes the loaded credentials are for.
+        """
+        self.scopes = scopes
+        self._lock = threading.Lock()
+        created = path != ":memory:" and not os.path.exists(path)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        if created:
+            os.chmod(path, 0o600)
+        with self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS credentials ("
+                               "user_id TEXT PRIMARY KEY, token TEXT NOT NULL, updated REAL NOT NULL)")
+
+    def load(self, user_id):
+        """
+        Args:
+            user_id (str): User whose credentials to read.
+
+        Returns:
+            google.oauth2.credentials.Credentials: The stored credentials, or None for an unknown user.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT token FROM credentials WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None:
+            return None
+        from google.oauth2.credentials import Credentials
+        return Credentials.from_authorized_user_info(json.loads(row[0]), self.scopes)
+
+    def save(self, user_id, creds):
+        """
+        Store (or replace) a user's credentials.
+
+        Args:
+            user_id (str): User the credentials belong to.
+            creds (google.oauth2.credentials.Credentials): Credentials with a refresh token.
+        """
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO credentials (user_id, token, updated) VALUES (?, ?, ?)",
+                               (user_id, creds.to_json(), time.time()))
+
+    def delete(self, user_id):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM credentials WHERE user_id = ?", (user_id,))
+
+    def has_user(self, user_id):
+        """
+        Returns:
+            bool: Whether credentials are stored for `user_id`.
+        """
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM credentials WHERE user_id = ?", (user_id,)).fetchone() is not None
+
+    def users(self):
+        """
+        Returns:
+            list: IDs of every user with stored credentials, sorted.
+        """
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT user_id FROM credentials ORDER BY user_id")]
+
+    def import_pickle(self, path, user_id):
+        """
+        Move credentials from a token.pickle written by older versions of the app into the store.
+
+        The pickle is renamed to `path`.imported afterwards so it is only read once.
+
+        Args:
+            path (str): The pickle file; only load files this app wrote itself.
+            user_id (str): User the pickled credentials belong to.
+
+        Returns:
+            bool: Whether credentials were imported.
+        """
+        if not os.path.exists(path):
+            return False
+        with open(path, "rb") as token:
+            creds = pickle.load(token)
+        self.save(user_id, creds)
+        os.replace(path, path + ".imported")
+        return True
+
+class LRUCache:
+    """
+    A thread-safe map that keeps at most `max_size` entries and drops entries
+    that have not been used for `ttl` seconds, so memory stays flat however
+    many keys pass through it.
+    """
+
+    def __init__(self, max_size, ttl=None, clock=time.monotonic):
+        """
+        Args:
+            max_size (int): Entries kept; the least recently used one is dropped first.
+            ttl (float, optional): Seconds an unused entry is kept. None keeps entries until they are pushed out.
+            clock (callable): Returns the current time in seconds.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.evictions = 0
+        self._clock = clock
+        self._lock = threading.Lock()
+        # key -> [value, last used]; ordered from least to most recently used
+        self._entries = OrderedDict()
+
+    def _expired(self, entry, now):
+        return self.ttl is not None and now - entry[1] >= self.ttl
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            now = self._clock()
+            if self._expired(entry, now):
+                del self._entries[key]
+                self.evictions += 1
+                return default
+            entry[1] = now
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value):
+        with self._lock:
+            now = self._clock()
+            self._entries[key] = [value, now]
+            self._entries.move_to_end(key)
+            # The oldest entries are at the front, so expired ones are dropped from there
+            while self._entries and (len(self._entries) > self.max_size
+                                     or self._expired(next(iter(self._entries.values())), now)):
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            return default if entry is None else entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.evictions = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the Google credentials of the calendar app's users.")
+    parser.add_argument("--db", default=CREDENTIALS_DB, help="credential store to use")
+    parser.add_argument("--add", metavar="USER", help="sign USER in to Google in the browser and store the token")
+    parser.add_argument("--remove", metavar="USER", help="forget USER's token")
+    parser.add_argument("--list", action="store_true", help="list users with stored tokens")
+    args = parser.parse_args()
+
+    # The calendar app owns the OAuth settings; it is only imported by this command
+    from calender import SCOPES, _run_oauth_flow
+    store = CredentialStore(args.db, SCOPES)
+    if args.add:
+        store.save(args.add, _run_oauth_flow("credentials.json", SCOPES))
+        print(f"Stored credentials for {args.add}")
+    if args.remove:
+        store.delete(args.remove)
+        print(f"Removed credentials for {args.remove}")
+    if args.list or not (args.add or args.remove):
+        print("\n".join(store.users()) or "No users yet.")
+
+if __name__ == "__main__":
+    main()
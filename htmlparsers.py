@@ -0,0 +1,108 @@
+from bs4 import BeautifulSoup, SoupStrainer
+import metrics
+
+# Optional faster parsers; the pure-Python html.parser backends work without them
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+
+PARSE_SECONDS = metrics.histogram('edusync_parse_seconds', 'Time spent parsing one course page.', ('backend',))
+
+# Blackboard wraps every content item in <div class="content-block"> (adjust to the real structure)
+BLOCK_TAG = 'div'
+BLOCK_CLASS = 'content-block'
+
+def _item(block_id, title, description, modified):
+    return {'block_id': block_id or None, 'title': title, 'description': description, 'modified': modified}
+
+def _parse_bs4(html, parse_only=None):
+    soup = BeautifulSoup(html, 'html.parser', parse_only=parse_only)
+    items = []
+    for block in soup.find_all(BLOCK_TAG, class_=BLOCK_CLASS):
+        title = block.find('h3').text
+        description = block.find('p').text
+        modified = block.find('time')['datetime']
+        items.append(_item(block.get('id'), title, description, modified))
+    return items
+
+def parse_with_html_parser(html):
+    """
+    Build a full BeautifulSoup tree with html.parser (the original behaviour).
+    """
+    return _parse_bs4(html)
+
+def parse_with_strainer(html):
+    """
+    Use html.parser but only build tree nodes for the content blocks.
+    """
+    return _parse_bs4(html, SoupStrainer(BLOCK_TAG, class_=BLOCK_CLASS))
+
+def parse_with_lxml(html):
+    """
+    Parse with lxml's C parser and select the content blocks with XPath.
+    """
+    tree = lxml.html.fromstring(html)
+    items = []
+    xpath = f'//{BLOCK_TAG}[contains(concat(" ", normalize-space(@class), " "), " {BLOCK_CLASS} ")]'
+    for block in tree.xpath(xpath):
+        title = block.xpath('.//h3')[0].text_content()
+        description = block.xpath('.//p')[0].text_content()
+        modified = block.xpath('.//time')[0].get('datetime')
+        items.append(_item(block.get('id'), title, description, modified))
+    return items
+
+def parse_with_selectolax(html):
+    """
+    Parse with selectolax (lexbor) and select the content blocks with a CSS selector.
+    """
+    tree = LexborHTMLParser(html)
+    items = []
+    for block in tree.css(f'{BLOCK_TAG}.{BLOCK_CLASS}'):
+        title = block.css_first('h3').text()
+        description = block.css_first('p').text()
+        modified = block.css_first('time').attributes['datetime']
+        items.append(_item(block.attributes.get('id'), title, description, modified))
+    return items
+
+# Backends in order of preference; the first available one is used by default
+BACKENDS = {
+    'selectolax': parse_with_selectolax,
+    'lxml': parse_with_lxml,
+    'strainer': parse_with_strainer,
+    'html.parser': parse_with_html_parser,
+}
+
+def available_backends():
+    """
+    Returns:
+        list: Names of the backends whose libraries are installed, fastest first.
+    """
+    missing = set()
+    if LexborHTMLParser is None:
+        missing.add('selectolax')
+    if lxml is None:
+        missing.add('lxml')
+    return [name for name in BACKENDS if name not in missing]
+
+def parse_content_blocks(html, backend=None):
+    """
+    Extract the content blocks of a Blackboard course page.
+
+    Args:
+        html (bytes or str): The course page.
+        backend (str, optional): One of BACKENDS. Defaults to the fastest installed one.
+
+    Returns:
+        list: Dicts with the DOM 'block_id' (None if absent), 'title', 'description' and 'modified' date of each block.
+    """
+    if backend is None:
+        backend = available_backends()[0]
+    elif backend not in available_backends():
+        raise ValueError(f"Parser backend '{backend}' is not available")
+    with PARSE_SECONDS.time(backend=backend):
+        return BACKENDS[backend](html)
@@ -0,0 +1,477 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+import metrics
+
+# Connections kept open (and requests allowed in flight) per host
+MAX_CONNECTIONS_PER_HOST = 8
+# Seconds to wait for a connection, and for each read of the response, before giving up on a request
+CONNECT_TIMEOUT = 5.0
+READ_TIMEOUT = 30.0
+# Requests per second sent to one host on average, and how many may go out back to back
+RATE_PER_HOST = 10.0
+BURST_PER_HOST = 20
+# How often a rate-limited or failed request is retried before giving up
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0  # seconds, doubled on every retry
+MAX_BACKOFF = 60.0  # seconds
+RETRY_STATUSES = {429, 502, 503, 504}
+# Statuses meaning the server did not act on the request, so even a POST can be resent
+RETRY_STATUSES_UNSAFE = {429, 503}
+# Methods that can be resent after a timeout or dropped connection
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+# Consecutive failed requests after which a host is given a rest, and how many seconds it lasts
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 30.0
+# Tokens are renewed this many seconds before the server says they expire
+TOKEN_EXPIRY_MARGIN = 60
+
+HTTP_SECONDS = metrics.histogram('edusync_http_request_seconds', 'Outgoing HTTP request latency.',
+                                 ('method', 'host', 'status'))
+HTTP_RETRIES = metrics.counter('edusync_http_retries_total', 'Requests retried after a 429/503.', ('host', 'status'))
+HTTP_THROTTLED_SECONDS = metrics.counter('edusync_http_throttled_seconds_total',
+                                         'Seconds requests waited for the per-host rate limit.', ('host',))
+HTTP_COALESCED = metrics.counter('edusync_http_coalesced_total', 'GETs answered by an identical request in flight.',
+                                 ('host',))
+BREAKER_OPENED = metrics.counter('edusync_circuit_opened_total', 'Times a host circuit breaker opened.', ('host',))
+TOKEN_FETCH_SECONDS = metrics.histogram('edusync_token_fetch_seconds', 'Time spent renewing an OAuth token.',
+                                        ('outcome',))
+
+_session = None
+_session_lock = threading.Lock()
+_hosts = {}
+_hosts_lock = threading.Lock()
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+class CircuitOpenError(requests.RequestException):
+    """
+    Raised instead of sending a request to a host whose circuit breaker is open.
+    """
+
+class TokenBucket:
+    """
+    Spaces requests out to `rate` per second on average while allowing bursts of `capacity`.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Take one token, going into debt if none is left.
+
+        Returns:
+            float: Seconds the caller must wait before sending its request.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+class CircuitBreaker:
+    """
+    Stops sending requests to a host after BREAKER_THRESHOLD consecutive failures.
+
+    Once the cooldown has passed a single trial request is let through; if it
+    succeeds the circuit closes again, otherwise it stays open for another cooldown.
+    """
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = 'closed'
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        Returns:
+            bool: Whether a request may be sent now. Every allowed request must be followed by `record`.
+        """
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self._opened_at >= self.cooldown:
+                self.state = 'half-open'
+                return True
+            return False
+
+    def record(self, ok):
+        """
+        Report the outcome of an allowed request.
+
+        Returns:
+            bool: True if this failure opened the circuit.
+        """
+        with self._lock:
+            if ok:
+                self._failures = 0
+                self.state = 'closed'
+                return False
+            self._failures += 1
+            if self.state == 'half-open' or (self.state == 'closed' and self._failures >= self.threshold):
+                self.state = 'open'
+                self._opened_at = time.monotonic()
+                return True
+            return False
+
+class HostGate:
+    """
+    Limits concurrent requests to one host, spaces them out with a token bucket,
+    pauses all of them after a 429 and tracks the host's circuit breaker.
+    """
+
+    def __init__(self, max_concurrency, rate=RATE_PER_HOST, burst=BURST_PER_HOST):
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._blocked_until = 0.0
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker()
+        self.throttled = 0.0
+
+    def block_for(self, seconds):
+        """
+        Hold back every request to this host for the given number of seconds.
+        """
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def __enter__(self):
+        while True:
+            with self._lock:
+                wait = self._blocked_until - time.monotonic()
+            if wait <= 0:
+                break
+            time.sleep(wait)
+        wait = self.bucket.reserve()
+        if wait > 0:
+            self.throttled += wait
+            time.sleep(wait)
+        self._slots.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._slots.release()
+
+class TokenManager:
+    """
+    Caches an OAuth access token until shortly before it expires.
+
+    Renewal happens under a lock, so when many workers find the token stale at
+    once only the first one calls the token endpoint and the rest reuse its result.
+    """
+
+    def __init__(self, fetch_token, margin=TOKEN_EXPIRY_MARGIN):
+        """
+        Args:
+            fetch_token (callable): Returns (access_token, expires_in_seconds), or (None, 0) on failure.
+            margin (float): Seconds before expiry at which the token is renewed.
+        """
+        self._fetch_token = fetch_token
+        self._margin = margin
+        self._lock = threading.Lock()
+        self._token = None
+        self._expires_at = 0.0
+
+    def get(self):
+        """
+        Returns:
+            str: A valid access token, or None if the token endpoint failed.
+        """
+        with self._lock:
+            if self._token is None or time.monotonic() >= self._expires_at - self._margin:
+                start = time.perf_counter()
+                token, expires_in = self._fetch_token()
+                TOKEN_FETCH_SECONDS.observe(time.perf_counter() - start, outcome='ok' if token else 'failed')
+                self._token = token
+                self._expires_at = time.monotonic() + (expires_in or 0)
+            return self._token
+
+    def invalidate(self, token):
+        """
+        Forget `token` (e.g. after a 401) unless another worker has already replaced it.
+        """
+        with self._lock:
+            if self._token == token:
+                self._token = None
+
+class ValidatorCache:
+    """
+    Remembers ETag, Last-Modified and a body hash per URL so unchanged pages can be skipped.
+
+    A page counts as unchanged when the server answers 304 to a conditional request,
+    or, for servers that send no validators, when the body hashes to the same value
+    as last time. New validators are only kept once `commit` is called, so a page
+    whose content failed to be stored is processed again on the next run.
+
+    The file is only read on first use, and a missing, unreadable or truncated
+    file counts as empty, so at worst every page is processed once more.
+    """
+
+    def __init__(self, path=None):
+        """
+        Args:
+            path (str, optional): JSON file the validators are persisted to. Kept in memory only when omitted.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = None
+        self._pending = {}
+
+    def _load(self):
+        # Called with the lock held
+        if self._entries is None:
+            self._entries = {}
+            if self.path:
+                try:
+                    with open(self.path) as f:
+                        entries = json.load(f)
+                    if isinstance(entries, dict):
+                        self._entries = entries
+                except FileNotFoundError:
+                    pass
+                except (OSError, ValueError) as e:
+                    metrics.log_event('validator_cache_unreadable', level=logging.WARNING, path=self.path, error=str(e))
+        return self._entries
+
+    def _save(self):
+        # Called with the lock held; a crash mid-write leaves the previous file in place
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(self._entries, f)
+        os.replace(temp_path, self.path)
+
+    def conditional_headers(self, url):
+        """
+        Returns:
+            dict: If-None-Match / If-Modified-Since headers for the last stored version of `url`.
+        """
+        with self._lock:
+            entry = self._load().get(url, {})
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def has_changed(self, url, response):
+        """
+        Decide whether `response` holds a new version of `url` and stage its validators.
+
+        Args:
+            url (str): The requested URL.
+            response (requests.Response): Response to a request made with `conditional_headers(url)`.
+
+        Returns:
+            bool: False for a 304 or a body identical to the last committed one.
+        """
+        if response.status_code == 304:
+            return False
+        entry = {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'body_hash': hashlib.sha256(response.content).hexdigest(),
+        }
+        with self._lock:
+            if self._load().get(url, {}).get('body_hash') == entry['body_hash']:
+                return False
+            self._pending[url] = entry
+        return True
+
+    def commit(self, url):
+        """
+        Keep the validators staged by `has_changed` for `url`, once its content has been stored.
+        """
+        with self._lock:
+            if url not in self._pending:
+                return
+            self._load()[url] = self._pending.pop(url)
+            if self.path:
+                self._save()
+
+def get_session():
+    """
+    Return the shared keep-alive session used for every Blackboard call.
+
+    Returns:
+        requests.Session: A session whose connection pool holds MAX_CONNECTIONS_PER_HOST per host.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=MAX_CONNECTIONS_PER_HOST, pool_maxsize=MAX_CONNECTIONS_PER_HOST)
+            _session.mount('https://', adapter)
+            _session.mount('http://', adapter)
+        return _session
+
+def reset_hosts():
+    """
+    Forget every host's limits, pauses and circuit breaker state (used by the tests).
+    """
+    with _hosts_lock:
+        _hosts.clear()
+
+def host_gate(url):
+    """
+    Return the concurrency gate shared by all requests to the host of `url`.
+    """
+    host = urlsplit(url).netloc
+    with _hosts_lock:
+        if host not in _hosts:
+            _hosts[host] = HostGate(MAX_CONNECTIONS_PER_HOST)
+        return _hosts[host]
+
+def retry_delay(response, attempt):
+    """
+    Work out how long to wait before retrying a rate-limited response.
+
+    Honors a Retry-After header given either in seconds or as an HTTP date, and
+    otherwise backs off exponentially.
+
+    Args:
+        response (requests.Response): The 429/503 response.
+        attempt (int): Number of retries already made.
+
+    Returns:
+        float: Seconds to wait.
+    """
+    retry_after = response.headers.get('Retry-After')
+    if retry_after:
+        try:
+            return min(MAX_BACKOFF, max(0.0, float(retry_after)))
+        except ValueError:
+            try:
+                retry_at = parsedate_to_datetime(retry_after)
+                return min(MAX_BACKOFF, max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds()))
+            except (TypeError, ValueError):
+                pass
+    return min(MAX_BACKOFF, BACKOFF_BASE * 2 ** attempt)
+
+def _succeeded(response):
+    # 4xx other than 429 means the host is healthy and the request itself was wrong
+    return response.status_code < 500 and response.status_code != 429
+
+def _send(method, url, session, **kwargs):
+    gate = host_gate(url)
+    host = urlsplit(url).netloc
+    if not gate.breaker.allow():
+        raise CircuitOpenError(f"Circuit for {host} is open after repeated failures, not sending {method} {url}")
+    kwargs.setdefault('timeout', (CONNECT_TIMEOUT, READ_TIMEOUT))
+    idempotent = method.upper() in IDEMPOTENT_METHODS
+    retry_statuses = RETRY_STATUSES if idempotent else RETRY_STATUSES_UNSAFE
+    for attempt in range(MAX_RETRIES + 1):
+        with gate:
+            throttled, gate.throttled = gate.throttled, 0.0
+            start = time.perf_counter()
+            try:
+                response = session.request(method, url, **kwargs)
+            except requests.RequestException as e:
+                HTTP_SECONDS.observe(time.perf_counter() - start, method=method, host=host, status='error')
+                retryable = idempotent and isinstance(e, (requests.ConnectionError, requests.Timeout))
+                if not retryable or attempt == MAX_RETRIES:
+                    _record(gate, host, False)
+                    raise
+                response = None
+            else:
+                HTTP_SECONDS.observe(time.perf_counter() - start, method=method, host=host, status=response.status_code)
+        if throttled:
+            HTTP_THROTTLED_SECONDS.inc(throttled, host=host)
+        if response is not None and (response.status_code not in retry_statuses or attempt == MAX_RETRIES):
+            _record(gate, host, _succeeded(response))
+            return response
+        if response is None:
+            delay, status = min(MAX_BACKOFF, BACKOFF_BASE * 2 ** attempt), 'error'
+        else:
+            delay, status = retry_delay(response, attempt), response.status_code
+        HTTP_RETRIES.inc(host=host, status=status)
+        metrics.log_event('http_retry', level=logging.WARNING, host=host, status=status, delay=round(delay, 1))
+        # Every request to the host waits, so a struggling LMS sees fewer requests instead of more
+        gate.block_for(delay)
+
+def _record(gate, host, ok):
+    if gate.breaker.record(ok):
+        BREAKER_OPENED.inc(host=host)
+        metrics.log_event('circuit_open', level=logging.ERROR, host=host, cooldown=gate.breaker.cooldown)
+
+class _InFlight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+def _coalesce_key(session, url, kwargs):
+    if kwargs.get('stream'):
+        return None  # A streamed body can only be read once
+    return (id(session), url, json.dumps({key: kwargs.get(key) for key in ('params', 'headers', 'cookies')},
+                                         sort_keys=True, default=str))
+
+def request(method, url, session=None, **kwargs):
+    """
+    Send a request through the shared session with timeouts, per-host rate limits, backoff and a circuit breaker.
+
+    Identical GETs made while one is already in flight wait for it and share its response
+    instead of hitting the server again.
+
+    Args:
+        method (str): HTTP method.
+        url (str): Absolute URL.
+        session (requests.Session, optional): Session to use instead of the shared one.
+        **kwargs: Passed through to `requests.Session.request`. `timeout` defaults to
+            (CONNECT_TIMEOUT, READ_TIMEOUT).
+
+    Returns:
+        requests.Response: The final response, which may still be a 429/5xx once retries run out.
+
+    Raises:
+        CircuitOpenError: The host failed BREAKER_THRESHOLD times in a row and is cooling down.
+        requests.RequestException: The request timed out or the connection failed on every attempt.
+    """
+    session = session or get_session()
+    key = _coalesce_key(session, url, kwargs) if method.upper() == 'GET' else None
+    if key is None:
+        return _send(method, url, session, **kwargs)
+    with _in_flight_lock:
+        call = _in_flight.get(key)
+        leader = call is None
+        if leader:
+            call = _in_flight[key] = _InFlight()
+    if not leader:
+        HTTP_COALESCED.inc(host=urlsplit(url).netloc)
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.response
+    try:
+        call.response = _send(method, url, session, **kwargs)
+        return call.response
+    except BaseException as e:
+        call.error = e
+        raise
+    finally:
+        with _in_flight_lock:
+            del _in_flight[key]
+        call.done.set()
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
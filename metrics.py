@@ -0,0 +1,232 @@
+###COUNTERS, TIMING HISTOGRAMS AND STRUCTURED LOGS SHARED BY THE PARSERS, THE SYNC DAEMON AND THE CALENDAR APP. SCRAPE /metrics (PROMETHEUS TEXT FORMAT)###
+import bisect
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the latency histogram buckets; covers a fast DB write up to a slow page fetch
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Content type Prometheus expects from a /metrics endpoint
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# Level of the JSON log lines; set EDUSYNC_LOG_LEVEL=WARNING to keep only errors
+LOG_LEVEL = os.environ.get('EDUSYNC_LOG_LEVEL', 'INFO')
+
+logger = logging.getLogger('edusync')
+if not logger.handlers:
+    _handler = logging.StreamHandler(sys.stdout)
+    _handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(_handler)
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+
+def _label_key(names, labels):
+    if set(labels) != set(names):
+        raise ValueError(f"Expected labels {names}, got {sorted(labels)}")
+    return tuple(str(labels[name]) for name in names)
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+class Counter:
+    """
+    A monotonically increasing count, one series per combination of label values.
+    """
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labels, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(_label_key(self.labels, labels), 0)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labels, key)} {value}')
+        return lines
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+class Histogram:
+    """
+    Observations (usually durations in seconds) counted into cumulative buckets.
+    """
+
+    def __init__(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labels, labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observe how long the `with` block took, including when it raises.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels):
+        with self._lock:
+            series = self._series.get(_label_key(self.labels, labels))
+            return series[2] if series else 0
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += bucket_count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'{self.name}_bucket{_format_labels(self.labels, key, [("le", le)])} {cumulative}')
+                lines.append(f'{self.name}_sum{_format_labels(self.labels, key)} {total}')
+                lines.append(f'{self.name}_count{_format_labels(self.labels, key)} {count}')
+        return lines
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+def _register(cls, name, description, labels, **kwargs):
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = _registry[name] = cls(name, description, labels, **kwargs)
+        elif not isinstance(metric, cls) or metric.labels != tuple(labels):
+            raise ValueError(f"Metric {name} is already registered with a different type or labels")
+        return metric
+
+def counter(name, description, labels=()):
+    """
+    Return the process-wide counter called `name`, creating it on first use.
+
+    Args:
+        name (str): Prometheus metric name, ending in _total by convention.
+        description (str): Help text shown on /metrics.
+        labels (tuple): Label names every `inc` call must supply.
+
+    Returns:
+        Counter: The shared counter.
+    """
+    return _register(Counter, name, description, labels)
+
+def histogram(name, description, labels=(), buckets=DEFAULT_BUCKETS):
+    """
+    Return the process-wide histogram called `name`, creating it on first use.
+
+    Args:
+        name (str): Prometheus metric name, ending in _seconds for durations.
+        description (str): Help text shown on /metrics.
+        labels (tuple): Label names every `observe` call must supply.
+        buckets (tuple): Upper bounds of the buckets.
+
+    Returns:
+        Histogram: The shared histogram.
+    """
+    return _register(Histogram, name, description, labels, buckets=buckets)
+
+def render():
+    """
+    Returns:
+        str: Every registered metric in the Prometheus text exposition format.
+    """
+    with _registry_lock:
+        metrics = sorted(_registry.values(), key=lambda metric: metric.name)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+def reset():
+    """
+    Zero every registered metric (used by the tests).
+    """
+    with _registry_lock:
+        for metric in _registry.values():
+            metric.reset()
+
+def log_event(event, level=logging.INFO, **fields):
+    """
+    Write one JSON log line such as {"ts": ..., "event": "sync_cycle", "inserted": 3}.
+
+    Args:
+        event (str): Short machine-readable name of what happened.
+        level (int): logging level of the line.
+        **fields: Values added to the line; anything not JSON-serializable is written with str().
+    """
+    if logger.isEnabledFor(level):
+        record = {'ts': round(time.time(), 3), 'level': logging.getLevelName(level).lower(), 'event': event, **fields}
+        logger.log(level, json.dumps(record, default=str))
+
+def serve_metrics(port, host='0.0.0.0'):
+    """
+    Serve /metrics from a background thread, for processes without a Flask app (the sync daemon).
+
+    Args:
+        port (int): Port to listen on; 0 picks a free one.
+        host (str): Interface to bind.
+
+    Returns:
+        ThreadingHTTPServer: The running server; call shutdown() to stop it.
+    """
+    # http.server is only imported by the process that serves metrics
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Scrapes every few seconds would flood the log
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    return server
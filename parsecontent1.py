@@ -1,31 +1,38 @@
 ###THIS IS THE CODE USING AN AI TOOL FOR P2. THIS CODE ASSUMES ACCESS TO BLACKBOARD REST API AND REQUIRES ... THIS CODE PARSES BLACKBOARD'S CONTENT FOR CHANGES EVERY HOUR AND WILL ADD ANY NEW ONES TO MONGODB###
-import requests
 import json
-import schedule
+import asyncio
 import time
-from pymongo import MongoClient, errors
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urljoin
+import httpclient
+import metrics
+from contentstore import get_db
+from workqueue import WorkQueue, drain, retry_dead_letters, task_writer
 
 # Blackboard API base URL and your credentials
 BB_API_URL = "https://blackboard.example.com/learn/api/public/v1"
+# Gradebook columns, which hold the due dates, are served by version 2 of the API
+GRADEBOOK_API_URL = "https://blackboard.example.com/learn/api/public/v2"
 CLIENT_ID = "your_client_id"
 CLIENT_SECRET = "your_client_secret"
 
-# MongoDB setup
-mongo_client = MongoClient('mongodb://localhost:27017/')  # Replace with your MongoDB connection string
-db = mongo_client['blackboard_db']  # Database
-collection = db['course_content']  # Collection for storing course content
+# JSON file with the list of Blackboard course IDs to poll, e.g. ["_123_1", "_456_1"]
+COURSES_FILE = "courses.json"
+# Number of courses fetched at the same time (each host is further capped by httpclient)
+MAX_WORKERS = 16
+# Number of content pages/folders fetched at the same time within one course
+MAX_FOLDER_WORKERS = 4
+# Only ask Blackboard for the fields we store, to keep payloads small
+CONTENT_FIELDS = "id,title,description,created,modified,hasChildren"
+GRADEBOOK_FIELDS = "contentId,grading.due"
+# Kind of the per-course tasks in the sync queue (see workqueue.py)
+TASK_KIND = "rest"
+# Pages fetched between two checkpoints of a course task
+CHECKPOINT_PAGES = 10
 
-# Create an index on "contentId" to ensure uniqueness
-try:
-    collection.create_index("contentId", unique=True)
-    print("Index on 'contentId' created successfully.")
-except errors.DuplicateKeyError:
-    print("Index on 'contentId' already exists.")
-except Exception as e:
-    print(f"Error creating index: {e}")
-
-# Function to get the OAuth2 token
-def get_access_token():
+# Function to request a new OAuth2 token and its lifetime in seconds
+def request_access_token():
     url = f"{BB_API_URL}/oauth2/token"
     headers = {
         "Content-Type": "application/x-www-form-urlencoded"
@@ -35,80 +42,179 @@ def get_access_token():
         "client_id": CLIENT_ID,
         "client_secret": CLIENT_SECRET
     }
-    response = requests.post(url, headers=headers, data=data)
+    response = httpclient.post(url, headers=headers, data=data)
     if response.status_code == 200:
         token_info = response.json()
-        return token_info['access_token']
+        return token_info['access_token'], token_info.get('expires_in', 0)
     else:
         print(f"Error getting token: {response.status_code}")
-        return None
+        return None, 0
 
-# Function to get course content using the Blackboard REST API
-def get_course_content(course_id, token):
-    url = f"{BB_API_URL}/courses/{course_id}/contents"
-    headers = {
-        "Authorization": f"Bearer {token}"
-    }
-    response = requests.get(url, headers=headers)
-    if response.status_code == 200:
-        course_content = response.json()
-        return course_content['results']  # List of course content items
-    else:
+# The token is reused until shortly before it expires instead of being requested every cycle
+token_manager = httpclient.TokenManager(request_access_token)
+
+# Function to get the OAuth2 token
+def get_access_token():
+    return token_manager.get()
+
+# Function to make an authorized GET request, renewing the token once if it was rejected
+def authorized_get(url, params=None):
+    token = get_access_token()
+    response = httpclient.get(url, headers={"Authorization": f"Bearer {token}"}, params=params)
+    if response.status_code == 401:
+        # The token was revoked or expired early; renew it once and retry
+        token_manager.invalidate(token)
+        token = get_access_token()
+        response = httpclient.get(url, headers={"Authorization": f"Bearer {token}"}, params=params)
+    return response
+
+# Function to fetch one page of contents (or other listing); returns the page's items and the URL of the next page
+def get_content_page(url, fields=CONTENT_FIELDS):
+    # nextPage links already carry the original query string
+    params = None if "fields=" in url else {"fields": fields}
+    response = authorized_get(url, params=params)
+    if response.status_code != 200:
         print(f"Error getting course content: {response.status_code}")
-        return None
+        response.raise_for_status()
+    page = response.json()
+    next_page = page.get('paging', {}).get('nextPage')
+    return page['results'], urljoin(BB_API_URL, next_page) if next_page else None
 
-# Function to check if the content is new
-def is_new_content(item):
-    # Check if the content already exists in MongoDB by its Blackboard content ID
-    if collection.find_one({"contentId": item['id']}):
-        return False  # Content already exists
-    else:
-        return True
+# Function to get the due dates of a course's graded items from its gradebook columns, keyed by content ID
+# Content items carry no due date themselves; columns without a content item (e.g. participation) are ignored
+def get_due_dates(course_id):
+    url = f"{GRADEBOOK_API_URL}/courses/{course_id}/gradebook/columns"
+    due_dates = {}
+    while url:
+        columns, url = get_content_page(url, GRADEBOOK_FIELDS)
+        for column in columns:
+            due = (column.get('grading') or {}).get('due')
+            if column.get('contentId') and due:
+                due_dates[column['contentId']] = due
+    return due_dates
+
+# Function to walk a course page by page, following pagination and walking into folders
+# Yields (items, frontier): a page's items and every URL that still has to be fetched after it,
+# so a crashed walk can be resumed from the frontier saved after the last page it finished
+def iter_course_pages(course_id, start_urls=None, max_workers=MAX_FOLDER_WORKERS):
+    contents_url = f"{BB_API_URL}/courses/{course_id}/contents"
+    pending_urls = deque(start_urls or [contents_url])
+    in_flight = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending_urls or in_flight:
+            # Keep at most max_workers pages in flight; the rest wait as URLs, not responses
+            while pending_urls and len(in_flight) < max_workers:
+                url = pending_urls.popleft()
+                in_flight[executor.submit(get_content_page, url)] = url
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                del in_flight[future]
+                items, next_page_url = future.result()
+                if next_page_url:
+                    pending_urls.append(next_page_url)
+                for item in items:
+                    item['courseId'] = course_id  # Blackboard does not include it in content items
+                    if item.get('hasChildren'):
+                        pending_urls.append(f"{contents_url}/{item['id']}/children")
+                # Pages still in flight (or finished but not yet yielded) are part of the frontier
+                yield items, list(in_flight.values()) + list(pending_urls)
+
+# Function to stream every content item of a course, following pagination and walking into folders
+def iter_course_content(course_id, max_workers=MAX_FOLDER_WORKERS):
+    for items, _ in iter_course_pages(course_id, max_workers=max_workers):
+        yield from items
+
+# Function to get course content using the Blackboard REST API
+def get_course_content(course_id):
+    try:
+        return list(iter_course_content(course_id))  # List of course content items
+    except Exception as e:
+        print(f"Error getting course content: {e}")
+        return None
 
-# Function to add new content to MongoDB
-def add_new_content_to_db(content_item):
-    document = {
+# Function to turn a Blackboard content item, and the due date of its gradebook column, into the document stored in MongoDB
+def to_document(content_item, due=None):
+    return {
         "contentId": content_item['id'],
         "title": content_item['title'],
         "modified": content_item['modified'],
         "created": content_item.get('created', None),
         "description": content_item.get('description', None),
+        "due": due,
         "courseId": content_item['courseId']  # Ensure courseId is part of the item
     }
-    # Insert the new document into MongoDB
+
+# Function to read the list of courses to poll
+def load_course_ids():
     try:
-        collection.insert_one(document)
-        print(f"Added new content: {content_item['title']} to MongoDB.")
-    except errors.DuplicateKeyError:
-        print(f"Duplicate content found: {content_item['title']}")
-    except Exception as e:
-        print(f"Error inserting content to MongoDB: {e}")
+        with open(COURSES_FILE) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        print(f"{COURSES_FILE} not found, no courses to poll.")
+        return []
+
+# Function to run the queued task of one course, resuming from its checkpoint after a crash
+def sync_course_task(task, writer):
+    course_id = task.key
+    retried = retry_dead_letters(task, writer)
+    due_dates = get_due_dates(course_id)
+    pages = task.checkpoint.get("pages", 0)
+    last_modified = task.checkpoint.get("lastModified")
+    count = 0
+    for items, frontier in iter_course_pages(course_id, task.checkpoint.get("frontier")):
+        for item in items:
+            count += 1
+            try:
+                document = to_document(item, due_dates.get(item['id']))
+            except Exception as e:
+                # A malformed item would fail every retry; park it instead of failing the course
+                task.queue.dead_letter_item(task, item, e)
+                continue
+            writer.add(document)
+            last_modified = max(last_modified or "", item.get('modified') or "") or None
+        pages += 1
+        if pages % CHECKPOINT_PAGES == 0:
+            # Everything before the frontier must be stored before the checkpoint says so
+            writer.flush()
+            task.save(frontier=frontier, pages=pages, lastModified=last_modified)
+    writer.flush()
+    return {"items": count, "pages": pages, "retried": retried}
+
+# Function to sync many courses concurrently through the durable task queue
+# Setting `stop` (a threading.Event) ends the cycle after the courses already running
+def poll_courses(course_ids, max_workers=MAX_WORKERS, stop=None):
+    stats = {"courses": len(course_ids), "failed": 0, "items": 0}
+    if not course_ids:
+        # Tasks left in the queue for courses removed from courses.json are not ours to run
+        return stats
+    start = time.perf_counter()
+    # MongoDB is only connected (and indexed) on first use; see contentstore.init for the settings
+    queue = WorkQueue(get_db())
+    # Courses left unfinished by a crashed cycle keep their checkpoints and are resumed
+    queue.enqueue(TASK_KIND, course_ids)
+    # All courses share one writer so MongoDB sees a few large batches instead of 2 calls per item
+    with task_writer(queue, TASK_KIND) as writer:
+        stats.update(drain(queue, {TASK_KIND: lambda task: sync_course_task(task, writer)},
+                           threads=min(max_workers, len(course_ids)), keys=course_ids, stop=stop))
+    stats.update(writer.stats)
+    stats["seconds"] = time.perf_counter() - start
+    elapsed = max(stats["seconds"], 1e-9)
+    stats["courses_per_second"] = stats["courses"] / elapsed
+    stats["items_per_second"] = stats["items"] / elapsed
+    metrics.log_event("sync_cycle", source="rest", **stats)
+    return stats
 
 # Function to check for changes and add new events to MongoDB
-def check_for_changes():
+def check_for_changes(stop=None):
     print("Checking for course content updates...")
-    access_token = get_access_token()
-    if not access_token:
+    if not get_access_token():
         return
 
-    course_id = "course_id_here"  # Blackboard course ID
-    content = get_course_content(course_id, access_token)
-
-    if content:
-        for item in content:
-            # Check if the content is new
-            if is_new_content(item):
-                # Add the new content to MongoDB
-                add_new_content_to_db(item)
-            else:
-                print(f"Content already exists: {item['title']}")
-    else:
-        print("No content found or error occurred.")
+    course_ids = load_course_ids()  # Blackboard course IDs
+    return poll_courses(course_ids, stop=stop)
 
-# Schedule the scan to run every hour
-schedule.every().hour.do(check_for_changes)
+if __name__ == "__main__":
+    from syncdaemon import SyncDaemon, SyncJob
 
-# Keep the script running
-while True:
-    schedule.run_pending()
-    time.sleep(1)
+    # Check for changes every hour; "python syncdaemon.py" runs this together with the scraper
+    asyncio.run(SyncDaemon([SyncJob("blackboard-rest", check_for_changes, 3600)]).run())
@@ -1,66 +1,115 @@
 ###THIS CODE IS FOR P2 AND WAS CREATED USING AN AI TOOL. THIS CODE IS SUPPOSED TO PERFORM THE SAME ACTIONS AS PARSECONTENT1.PY BUT WITHOUT ACCESS TO BLACKBOARD'S REST API. ###
+import argparse
+import asyncio
+import threading
+from collections import Counter
 import requests
-from bs4 import BeautifulSoup
-import schedule
-import time
-from pymongo import MongoClient
-
-# MongoDB setup
-mongo_client = MongoClient('mongodb://localhost:27017/')  # Replace with your MongoDB connection string
-db = mongo_client['blackboard_db']  # Database
-collection = db['course_content']  # Collection for storing course content
-
-# Create an index on "contentId" to ensure uniqueness
-collection.create_index("contentId", unique=True)
+from contentstore import canonicalize, get_db, make_content_id, migrate_dates, parse_date, rekey_content_ids
+import metrics
+from httpclient import ValidatorCache
+from htmlparsers import parse_content_blocks
+from scrapesession import BlackboardSession
+from workqueue import WorkQueue, drain, retry_dead_letters, task_writer
 
 # Blackboard URLs
-LOGIN_URL = "https://blackboard.example.com/webapps/login/"
-COURSE_URL = "https://blackboard.example.com/learn/course_content/course_id_here"
+BB_URL = "https://blackboard.example.com"
+LOGIN_URL = f"{BB_URL}/webapps/login/"
+COURSE_ID = "course_id_here"  # Blackboard course ID
+COURSE_URL = f"{BB_URL}/learn/course_content/{COURSE_ID}"
+# Every course whose page is scraped; each one is fetched over its own pooled session
+COURSE_IDS = [COURSE_ID]
+# Number of course pages scraped at the same time
+MAX_WORKERS = 4
+# Kind of the per-course tasks in the sync queue (see workqueue.py)
+TASK_KIND = "scrape"
 
 # Your login credentials (modify accordingly)
 USERNAME = 'your_username'
 PASSWORD = 'your_password'
 
-# Start session for requests
-session = requests.Session()
-
-# Function to log in to Blackboard
+# Logged-in sessions, created on first use; cookies are saved in scrapesession.COOKIE_DIR between runs
+blackboard = None
+# Scrape workers ask for the session at the same time; only the first one creates it
+blackboard_lock = threading.Lock()
+
+# ETag/Last-Modified/body hash of the last course page we stored, so idle courses are not re-parsed (read on first use)
+VALIDATORS_FILE = "http_validators.json"
+validator_cache = ValidatorCache(VALIDATORS_FILE)
+
+# HTML parser backend (see htmlparsers.BACKENDS); None picks the fastest one installed
+PARSER_BACKEND = None
+
+# Function to get the shared Blackboard session, loading the saved cookies on first use
+def get_blackboard_session():
+    global blackboard
+    with blackboard_lock:
+        if blackboard is None:
+            # This will vary depending on Blackboard's login form (inspect form structure for field names)
+            login_payload = {
+                'user_id': USERNAME,
+                'password': PASSWORD,
+                'login': 'Login'
+            }
+            blackboard = BlackboardSession(LOGIN_URL, USERNAME, login_payload, pool_size=MAX_WORKERS)
+        return blackboard
+
+# Function to log in to Blackboard; cookies saved by the last run are reused instead of logging in again
 def login_to_blackboard():
-    # This will vary depending on Blackboard's login form (inspect form structure for field names)
-    login_payload = {
-        'user_id': USERNAME,
-        'password': PASSWORD,
-        'login': 'Login'
-    }
-
-    # Send POST request for login
-    response = session.post(LOGIN_URL, data=login_payload)
-    if "Welcome" in response.text:  # Change based on what the response looks like
+    if get_blackboard_session().ensure_logged_in():
         print("Logged in successfully!")
     else:
         print("Login failed.")
 
+# Function to get the URL of a course's content page
+def course_url(course_id):
+    return f"{BB_URL}/learn/course_content/{course_id}"
+
+# Function to build a contentId that stays the same across restarts
+def scraped_content_id(block_id, title, course_id=COURSE_ID, occurrence=0):
+    # Prefer the block's DOM id, which survives edits to the title; fall back to the title
+    # plus its position among earlier blocks with the same title, so two "Quiz" blocks get two IDs
+    url = course_url(course_id)
+    if block_id:
+        return make_content_id(url, "id", block_id)
+    if occurrence:
+        return make_content_id(url, "title", title, occurrence)
+    return make_content_id(url, "title", title)
+
 # Function to scrape course content
-def scrape_course_content():
-    # Make a GET request to the course page after logging in
-    response = session.get(COURSE_URL)
-    soup = BeautifulSoup(response.content, 'html.parser')
+def scrape_course_content(course_id=COURSE_ID, conditional=True):
+    url = course_url(course_id)
+    # Make a conditional GET request to the course page; an expired session is logged in again once
+    headers = validator_cache.conditional_headers(url) if conditional else {}
+    response = get_blackboard_session().get(url, headers=headers)
+    if response.status_code not in (200, 304):
+        # Raise so the queue retries the task instead of recording an empty page as done
+        raise requests.HTTPError(f"Error getting course page of {course_id}: {response.status_code}", response=response)
+    if conditional and not validator_cache.has_changed(url, response):
+        print(f"Course page of {course_id} has not changed since the last check, skipping parse.")
+        return []
 
     # Find content blocks, assuming they have a specific HTML structure
-    # Example: Modify selectors based on the Blackboard structure
-    content_blocks = soup.find_all('div', class_='content-block')  # Adjust the selector
+    # Example: Modify selectors based on the Blackboard structure (htmlparsers.BLOCK_TAG/BLOCK_CLASS)
+    content_blocks = parse_content_blocks(response.content, PARSER_BACKEND)
 
     course_updates = []
+    # Blocks without a DOM id seen so far per title
+    title_counts = Counter()
 
     # Loop through content blocks and extract title, description, etc.
     for block in content_blocks:
-        title = block.find('h3').text  # Assuming the title is in an <h3> tag
-        description = block.find('p').text  # Assuming the description is in a <p> tag
-        modified = block.find('time')['datetime']  # Assuming modified date is stored in <time>
+        title = block['title']
+        description = block['description']
+        modified = block['modified']
+        occurrence = 0
+        if not block['block_id']:
+            occurrence = title_counts[canonicalize(title)]
+            title_counts[canonicalize(title)] += 1
 
         # Create a content item dictionary
         content_item = {
-            'contentId': hash(title + modified),  # Use a hash of title + modified date as the contentId
+            'contentId': scraped_content_id(block['block_id'], title, course_id, occurrence),
+            'courseId': course_id,
             'title': title,
             'description': description,
             'modified': modified
@@ -69,41 +118,71 @@ def scrape_course_content():
 
     return course_updates
 
-# Function to check if the content is new
-def is_new_content(item):
-    if collection.find_one({"contentId": item['contentId']}):
-        return False
-    return True
-
-# Function to add new content to MongoDB
-def add_new_content_to_db(content_item):
-    try:
-        collection.insert_one(content_item)
-        print(f"Added new content: {content_item['title']} to MongoDB.")
-    except Exception as e:
-        print(f"Error inserting content to MongoDB: {e}")
-
-# Function to scrape and check for new content
-def check_for_new_content():
+# Function to run the queued task of one course: retry its parked items, then scrape its page
+def scrape_course_task(task, writer):
+    retried = retry_dead_letters(task, writer)
+    errors = writer.flush()['errors']
+    course_updates = scrape_course_content(task.key)
+    for item in course_updates:
+        writer.add(item)
+    # Only skip this version of the page next time if none of its items failed to store
+    # (the writer is shared, so a failure in another course also holds the commit back)
+    if writer.flush()['errors'] == errors:
+        validator_cache.commit(course_url(task.key))
+    return {"items": len(course_updates), "retried": retried}
+
+# Function to scrape and check for new content in every course; setting `stop` ends it after the courses already running
+def check_for_new_content(course_ids=None, stop=None):
     print("Checking for new course content...")
-    course_updates = scrape_course_content()
-
-    if course_updates:
-        for item in course_updates:
-            if is_new_content(item):
-                add_new_content_to_db(item)
-            else:
-                print(f"Content already exists: {item['title']}")
+    course_ids = COURSE_IDS if course_ids is None else course_ids
+    if not course_ids:
+        return {}
+    # MongoDB is only connected (and indexed) on first use; see contentstore.init for the settings
+    queue = WorkQueue(get_db())
+    queue.enqueue(TASK_KIND, course_ids)
+    # Upsert everything in batches keyed on contentId instead of a lookup and an insert per item
+    with task_writer(queue, TASK_KIND) as writer:
+        tasks = drain(queue, {TASK_KIND: lambda task: scrape_course_task(task, writer)},
+                      threads=min(MAX_WORKERS, len(course_ids)), keys=course_ids, stop=stop)
+    stats = writer.stats
+    metrics.log_event("sync_cycle", source="scrape", courses=len(course_ids), failed=tasks.get("failed", 0),
+                      **stats)
+    return stats
+
+# Function to rekey documents stored with the old per-process hash() IDs and drop the duplicates
+def migrate_content_ids():
+    # Old scraper documents have no courseId; match them to today's blocks to recover the DOM id
+    current_ids = {(item['title'], parse_date(item['modified'])): item['contentId']
+                   for item in scrape_course_content(conditional=False)}
+
+    def new_id_for(document):
+        key = (document.get('title'), parse_date(document.get('modified')))
+        return current_ids.get(key) or scraped_content_id(None, document.get('title'))
+
+    result = rekey_content_ids(get_db()['course_content'], new_id_for, query={'courseId': {'$exists': False}},
+                               set_fields={'courseId': COURSE_ID})
+    print(f"Rekeyed {result['rekeyed']} documents and removed {result['removed']} duplicates.")
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scrape Blackboard course content into MongoDB every hour.")
+    parser.add_argument("--migrate-ids", action="store_true",
+                        help="rekey documents saved with the old hash()-based contentId, then exit")
+    parser.add_argument("--migrate-dates", action="store_true",
+                        help="convert date strings saved by older versions to BSON dates, then exit")
+    args = parser.parse_args()
+
+    if args.migrate_dates:
+        print(f"Converted dates in {migrate_dates(get_db()['course_content'])} documents.")
+        raise SystemExit
+
+    # Login to Blackboard before starting the scraper
+    login_to_blackboard()
+
+    if args.migrate_ids:
+        migrate_content_ids()
     else:
-        print("No new content found or error occurred.")
-
-# Schedule the scraper to run every hour
-schedule.every().hour.do(check_for_new_content)
-
-# Login to Blackboard before starting the scraper
-login_to_blackboard()
+        from syncdaemon import SyncDaemon, SyncJob
 
-# Keep the script running
-while True:
-    schedule.run_pending()
-    time.sleep(1)
+        # Run the scraper every hour; "python syncdaemon.py" runs this together with the REST sync
+        asyncio.run(SyncDaemon([SyncJob("blackboard-scrape", check_for_new_content, 3600)]).run())
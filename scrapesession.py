@@ -0,0 +1,180 @@
+###BLACKBOARD WEB SESSIONS FOR THE PAGE SCRAPER: COOKIES SAVED PER ACCOUNT, EXPIRED SESSIONS RE-LOGGED IN ONCE, AND A POOL OF HTTP SESSIONS FOR SCRAPING COURSES IN PARALLEL###
+import hashlib
+import http.cookiejar
+import logging
+import os
+import queue
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+import requests
+import httpclient
+import metrics
+
+# Directory the cookie jars are saved in (one file per account; keep it private, the cookies log you in)
+COOKIE_DIR = "cookies"
+# HTTP sessions kept per account; they all share the account's cookies
+SESSION_POOL_SIZE = 4
+# Path Blackboard redirects to when the session has expired (adjust to the real login URL)
+LOGIN_PATH = "/webapps/login"
+# Text only found on the login form, for servers that show it without redirecting (adjust to the real page)
+LOGIN_PAGE_MARKERS = (b'name="user_id"', b'id="loginForm"')
+# Text the page after a successful login contains (change based on what the response looks like)
+LOGIN_SUCCESS_MARKER = "Welcome"
+
+LOGINS = metrics.counter("edusync_scraper_logins_total", "Login form posts made by the scraper.", ("outcome",))
+SESSIONS_EXPIRED = metrics.counter("edusync_scraper_sessions_expired_total",
+                                   "Scraper requests answered with the login page.")
+
+class SessionExpiredError(requests.RequestException):
+    """
+    Raised when a page still shows the login form after logging in again.
+    """
+
+def is_login_page(response, login_path=LOGIN_PATH):
+    """
+    Tell whether Blackboard answered with its login page instead of the requested one.
+
+    Args:
+        response (requests.Response): Response to a request made with the session cookies.
+        login_path (str): Path of the login page.
+
+    Returns:
+        bool: True when the session has expired and the request has to be made again after logging in.
+    """
+    if response.status_code in (401, 403):
+        return True
+    if login_path in urlsplit(response.url or "").path:
+        return True
+    for redirect in response.history or ():
+        if login_path in (redirect.headers.get("Location") or ""):
+            return True
+    content = response.content or b""
+    return any(marker in content for marker in LOGIN_PAGE_MARKERS)
+
+def cookie_file(login_url, username, cookie_dir=COOKIE_DIR):
+    # Named after a hash so the account name does not end up in a file name
+    digest = hashlib.sha256(f"{urlsplit(login_url).netloc}|{username}".encode("utf-8")).hexdigest()[:16]
+    return os.path.join(cookie_dir, f"{digest}.lwp")
+
+class BlackboardSession:
+    """
+    A logged-in Blackboard account shared by every scraper thread.
+
+    The cookies live in one jar that is saved to disk after each login, so a
+    restart reuses them instead of posting the login form again. Requests are
+    made over a pool of HTTP sessions that all share that jar. When a page
+    comes back as the login form, exactly one thread logs in again while the
+    others wait and then retry with the new cookies.
+    """
+
+    def __init__(self, login_url, username, login_form, cookie_dir=COOKIE_DIR, pool_size=SESSION_POOL_SIZE):
+        """
+        Args:
+            login_url (str): URL the login form is posted to.
+            username (str): Account name, used to find this account's cookie jar.
+            login_form (dict): Fields of the login form, credentials included.
+            cookie_dir (str, optional): Where cookie jars are saved. None keeps cookies in memory only.
+            pool_size (int): Number of HTTP sessions requests can be made over at the same time.
+        """
+        self.login_url = login_url
+        self.username = username
+        self.login_form = login_form
+        self.path = cookie_file(login_url, username, cookie_dir) if cookie_dir else None
+        self.jar = http.cookiejar.LWPCookieJar(self.path)
+        if self.path and os.path.exists(self.path):
+            try:
+                # Blackboard's session cookies have no expiry, so discard flags are ignored both ways
+                self.jar.load(ignore_discard=True)
+            except (OSError, http.cookiejar.LoadError) as e:
+                metrics.log_event("cookie_jar_unreadable", level=logging.WARNING, path=self.path, error=str(e))
+        self.generation = 0
+        self._login_lock = threading.Lock()
+        self._pool = queue.LifoQueue()
+        for _ in range(pool_size):
+            session = requests.Session()
+            session.cookies = self.jar
+            self._pool.put(session)
+
+    @contextmanager
+    def session(self):
+        """
+        Borrow one of the pooled HTTP sessions, waiting if they are all in use.
+        """
+        session = self._pool.get()
+        try:
+            yield session
+        finally:
+            self._pool.put(session)
+
+    def has_cookies(self):
+        return len(self.jar) > 0
+
+    def login(self, seen_generation=None):
+        """
+        Post the login form and save the new cookies.
+
+        Args:
+            seen_generation (int, optional): `generation` read before the request that found the session
+                expired. If another thread has logged in since then, its login is reused instead.
+
+        Returns:
+            bool: Whether the account is logged in.
+        """
+        with self._login_lock:
+            if seen_generation is not None and seen_generation != self.generation:
+                return True
+            with self.session() as session:
+                response = httpclient.post(self.login_url, session=session, data=self.login_form)
+            self.generation += 1
+            ok = LOGIN_SUCCESS_MARKER in response.text
+            LOGINS.inc(outcome="ok" if ok else "failed")
+            metrics.log_event("scraper_login", level=logging.INFO if ok else logging.ERROR, ok=ok,
+                              status=response.status_code)
+            if ok:
+                self.save()
+            return ok
+
+    def ensure_logged_in(self):
+        """
+        Log in unless cookies saved by an earlier run are available.
+
+        Returns:
+            bool: Whether the account is (probably) logged in; saved cookies are checked on first use.
+        """
+        return self.has_cookies() or self.login()
+
+    def get(self, url, **kwargs):
+        """
+        GET a page with the account's cookies, logging in again once if the session has expired.
+
+        Args:
+            url (str): Absolute URL.
+            **kwargs: Passed through to httpclient.get.
+
+        Returns:
+            requests.Response: The page.
+
+        Raises:
+            SessionExpiredError: The login page came back even after logging in again.
+        """
+        for attempt in range(2):
+            generation = self.generation
+            with self.session() as session:
+                response = httpclient.get(url, session=session, **kwargs)
+            if not is_login_page(response):
+                return response
+            SESSIONS_EXPIRED.inc()
+            if attempt == 0 and not self.login(generation):
+                break
+        raise SessionExpiredError(f"Blackboard keeps answering {url} with the login page")
+
+    def save(self):
+        """
+        Write the cookie jar to disk, readable by the owner only.
+        """
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.jar.save(ignore_discard=True)
+        os.chmod(self.path, 0o600)
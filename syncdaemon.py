@@ -0,0 +1,261 @@
+###SINGLE PROCESS THAT RUNS ALL BLACKBOARD SYNC JOBS (REST API PER COURSE AND THE PAGE SCRAPER) ON JITTERED SCHEDULES. RUN "python syncdaemon.py"; SEND SIGUSR1 TO SYNC EVERYTHING NOW###
+import argparse
+import asyncio
+import logging
+import random
+import signal
+import threading
+import time
+import metrics
+
+# Default seconds between two runs of the same job
+DEFAULT_INTERVAL = 3600
+# Each run is rescheduled at interval * (1 +/- JITTER) so jobs do not all fire together
+JITTER = 0.1
+# Jobs allowed to run at the same time (each may use its own threads for HTTP)
+MAX_CONCURRENT_JOBS = 4
+# Seconds to wait for running jobs to finish on shutdown; jobs still running after that are abandoned
+SHUTDOWN_TIMEOUT = 60
+
+JOB_SECONDS = metrics.histogram("edusync_sync_job_seconds", "Duration of one run of a sync job.", ("job", "outcome"),
+                                buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600))
+
+class SyncJob:
+    """
+    A blocking sync function run on its own jittered interval.
+    """
+
+    def __init__(self, name, func, interval=DEFAULT_INTERVAL, jitter=JITTER, partial=None, stoppable=False):
+        """
+        Args:
+            name (str): Name used in logs and for on-demand triggers.
+            func (callable): Blocking function that performs one sync; run in a worker thread.
+            interval (float): Seconds between runs.
+            jitter (float): Fraction of the interval by which each run is randomly moved.
+            partial (callable, optional): Blocking function syncing only some keys (e.g. course IDs),
+                called with their list when a trigger names keys.
+            stoppable (bool): func and partial take a `stop` threading.Event, set when the daemon shuts down.
+        """
+        self.name = name
+        self.func = func
+        self.partial = partial
+        self.stoppable = stoppable
+        # Keys named by triggers since the last run; empty means the next run syncs everything
+        self.requested = set()
+        self.interval = interval
+        self.jitter = jitter
+        self.running = False
+        self.runs = 0
+        self.last_result = None
+        self.last_error = None
+        self.wake = asyncio.Event()
+
+    def next_delay(self):
+        return self.interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def first_delay(self):
+        # Spread the first runs out instead of starting every job at once
+        return random.uniform(0, self.interval * self.jitter)
+
+class SyncDaemon:
+    """
+    Runs many SyncJobs in one asyncio event loop.
+
+    A job never overlaps with itself: a trigger that arrives while it is running
+    queues exactly one extra run right after the current one finishes.
+
+    Jobs run on daemon threads. On shutdown stoppable jobs are asked to stop
+    after their current task; a job still running after SHUTDOWN_TIMEOUT is
+    abandoned so the process can exit.
+    """
+
+    def __init__(self, jobs, max_concurrent=MAX_CONCURRENT_JOBS):
+        self.jobs = {job.name: job for job in jobs}
+        self.max_concurrent = max_concurrent
+        # Handed to stoppable jobs; set as soon as shutdown starts
+        self.stop_event = threading.Event()
+        self._loop = None
+        self._stopping = None
+
+    def trigger(self, name=None, keys=None):
+        """
+        Run one job (or all jobs when `name` is None) as soon as possible. Safe to call from any thread.
+
+        Args:
+            name (str, optional): Name of the job to run.
+            keys (list, optional): Only sync these keys (e.g. course IDs) with the job's partial function.
+        """
+        jobs = list(self.jobs.values()) if name is None else [self.jobs[name]]
+        for job in jobs:
+            if keys and job.partial is not None:
+                self._call_in_loop(lambda job=job: (job.requested.update(keys), job.wake.set()))
+            else:
+                self._call_in_loop(job.wake.set)
+
+    def stop(self):
+        """
+        Ask the daemon to finish running jobs and exit. Safe to call from any thread.
+        """
+        self._call_in_loop(self._stop)
+
+    def _call_in_loop(self, callback):
+        if self._loop is None:
+            callback()
+        else:
+            self._loop.call_soon_threadsafe(callback)
+
+    def _stop(self):
+        self.stop_event.set()
+        if self._stopping is not None:
+            self._stopping.set()
+        for job in self.jobs.values():
+            job.wake.set()
+
+    def _on_signal(self, sig):
+        # The next SIGINT/SIGTERM gets the default behaviour, so a hung job can still be interrupted
+        for default in (signal.SIGINT, signal.SIGTERM):
+            self._loop.remove_signal_handler(default)
+        print(f"Received {signal.Signals(sig).name}; send it again to exit without waiting.")
+        self._stop()
+
+    def _in_thread(self, job, func):
+        # Like asyncio.to_thread, but on a daemon thread that is not joined when the loop closes
+        loop = self._loop
+        future = loop.create_future()
+
+        def settle(result, error):
+            if not future.done():
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+
+        def target():
+            result, error = None, None
+            try:
+                result = func()
+            except Exception as e:
+                error = e
+            try:
+                loop.call_soon_threadsafe(settle, result, error)
+            except RuntimeError:
+                pass  # The daemon already exited and closed its loop
+        threading.Thread(target=target, name=f"sync-{job.name}", daemon=True).start()
+        return future
+
+    async def _run_job(self, job, slots):
+        delay = job.first_delay()
+        while not self._stopping.is_set():
+            timed_out = False
+            try:
+                await asyncio.wait_for(job.wake.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                timed_out = True
+            job.wake.clear()
+            if self._stopping.is_set():
+                break
+            # A scheduled run covers every key; a trigger that named keys only syncs those
+            keys, job.requested = job.requested, set()
+            stop = {"stop": self.stop_event} if job.stoppable else {}
+            if timed_out or not keys:
+                func = lambda: job.func(**stop)
+            else:
+                func = lambda: job.partial(sorted(keys), **stop)
+            async with slots:
+                job.running = True
+                start = time.perf_counter()
+                try:
+                    job.last_result = await self._in_thread(job, func)
+                    job.last_error = None
+                except Exception as e:
+                    job.last_error = e
+                    metrics.log_event("sync_job_failed", level=logging.ERROR, job=job.name, error=str(e))
+                finally:
+                    job.running = False
+                    job.runs += 1
+                seconds = time.perf_counter() - start
+                JOB_SECONDS.observe(seconds, job=job.name, outcome="failed" if job.last_error else "ok")
+                metrics.log_event("sync_job_finished", job=job.name, seconds=round(seconds, 3), ok=job.last_error is None)
+            delay = job.next_delay()
+
+    async def run(self):
+        """
+        Run every job until stop() is called or SIGINT/SIGTERM is received.
+
+        Running jobs get SHUTDOWN_TIMEOUT seconds to finish; the ones still running
+        are then abandoned and the method returns. A second SIGINT/SIGTERM exits at once.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        self.stop_event.clear()
+        slots = asyncio.Semaphore(self.max_concurrent)
+        for sig, handler, args in ((signal.SIGINT, self._on_signal, (signal.SIGINT,)),
+                                   (signal.SIGTERM, self._on_signal, (signal.SIGTERM,)),
+                                   (getattr(signal, "SIGUSR1", None), self.trigger, ())):
+            if sig is None:
+                continue
+            try:
+                self._loop.add_signal_handler(sig, handler, *args)
+            except (NotImplementedError, RuntimeError):
+                pass  # Not supported on Windows or outside the main thread
+        tasks = [asyncio.create_task(self._run_job(job, slots)) for job in self.jobs.values()]
+        print(f"Sync daemon started with {len(tasks)} jobs.")
+        await self._stopping.wait()
+        print("Shutting down, waiting for running jobs to finish...")
+        done, pending = await asyncio.wait(tasks, timeout=SHUTDOWN_TIMEOUT)
+        abandoned = [job.name for job in self.jobs.values() if job.running]
+        if abandoned:
+            metrics.log_event("sync_jobs_abandoned", level=logging.WARNING, jobs=",".join(abandoned))
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        for sig in (signal.SIGINT, signal.SIGTERM, getattr(signal, "SIGUSR1", None)):
+            if sig is not None:
+                try:
+                    self._loop.remove_signal_handler(sig)
+                except (NotImplementedError, RuntimeError):
+                    pass
+        self._loop = None
+
+def build_jobs(rest=True, scrape=True, calendar=False, interval=DEFAULT_INTERVAL):
+    """
+    Create one REST job covering every course in courses.json, one job for the page scraper and,
+    if asked, one job that projects due dates onto Google Calendar.
+
+    The REST job polls all courses through one worker pool and one writer; single
+    courses are synced on demand with trigger("rest", keys=[course_id]).
+
+    Returns:
+        list: SyncJob objects.
+    """
+    jobs = []
+    if rest:
+        import parsecontent1
+        jobs.append(SyncJob("rest", parsecontent1.check_for_changes, interval, partial=parsecontent1.poll_courses,
+                            stoppable=True))
+    if scrape:
+        import parsecontent2
+        parsecontent2.login_to_blackboard()
+        jobs.append(SyncJob(f"scrape:{parsecontent2.COURSE_ID}", parsecontent2.check_for_new_content, interval,
+                            stoppable=True))
+    if calendar:
+        import calendarprojection
+        jobs.append(SyncJob("calendar", calendarprojection.poll, calendarprojection.POLL_INTERVAL))
+    return jobs
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run all Blackboard sync jobs in one process.")
+    parser.add_argument("--interval", type=float, default=DEFAULT_INTERVAL, help="seconds between runs of each job")
+    parser.add_argument("--no-rest", action="store_true", help="do not sync courses through the REST API")
+    parser.add_argument("--no-scrape", action="store_true", help="do not run the page scraper")
+    parser.add_argument("--calendar", action="store_true", help="also push due dates to Google Calendar")
+    parser.add_argument("--metrics-port", type=int, help="serve Prometheus metrics on this port at /metrics")
+    args = parser.parse_args(argv)
+    if args.metrics_port is not None:
+        metrics.serve_metrics(args.metrics_port)
+    jobs = build_jobs(rest=not args.no_rest, scrape=not args.no_scrape, calendar=args.calendar,
+                      interval=args.interval)
+    asyncio.run(SyncDaemon(jobs).run())
+
+if __name__ == "__main__":
+    main()
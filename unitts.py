@@ -1,6 +1,51 @@
+import json
+import os
+import pickle
+import sqlite3
+import tempfile
+import time
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import patch, Mock
-from calender import app, authenticate_google_calendar, fetch_events, create_event, delete_event
+from datetime import datetime, timedelta
+from googleapiclient.discovery import build
+from googleapiclient.http import HttpMockSequence
+import calender
+from calendarsync import EventMirror, sync_events
+from googleapiclient.errors import HttpError
+from credentialstore import CredentialStore
+import calendarfiles
+from calender import (app, authenticate_google_calendar, fetch_events, create_event, delete_event,
+                      iter_events, create_events, delete_events, calendar_cache_stats, reset_calendar_cache)
+
+# The index page only lists upcoming events, so fixtures it should show must be in the future.
+SOON = (datetime.utcnow().date() + timedelta(days=1)).isoformat()
+LATER = (datetime.utcnow().date() + timedelta(days=2)).isoformat()
+
+def batch_response(parts):
+    """
+    Build a (headers, body) pair for HttpMockSequence that answers a Google batch request.
+
+    Args:
+        parts (list): (request_id, status, body) tuples, one per call in the batch.
+    """
+    boundary = 'batch_boundary'
+    chunks = []
+    for request_id, status, body in parts:
+        content = json.dumps(body) if body is not None else ''
+        chunks.append(
+            f"--{boundary}\r\nContent-Type: application/http\r\n"
+            f"Content-ID: <response-base + {request_id}>\r\n\r\n"
+            f"HTTP/1.1 {status} OK\r\nContent-Type: application/json\r\n\r\n{content}\r\n"
+        )
+    body = ''.join(chunks) + f"--{boundary}--"
+    return ({'status': '200', 'content-type': f'multipart/mixed; boundary="{boundary}"'}, body)
+
+def calendar_service_with(responses):
+    """
+    Build a real Calendar service object whose HTTP transport replays the given responses.
+    """
+    return build('calendar', 'v3', http=HttpMockSequence(responses), static_discovery=True)
 
 class TestGoogleCalendarApp(unittest.TestCase):
     """
@@ -13,42 +58,191 @@ class TestGoogleCalendarApp(unittest.TestCase):
         """
         app.testing = True  
         self.client = app.test_client()  
+        reset_calendar_cache()
+        self.mirror_patcher = patch('calender.get_event_mirror', return_value=EventMirror(':memory:'))
+        self.mirror = self.mirror_patcher.start()()
+        self.addCleanup(self.mirror_patcher.stop)
     
-    @patch('calender.pickle.load')
-    @patch('calender.pickle.dump')
-    @patch('calender.InstalledAppFlow.from_client_secrets_file')
-    @patch('calender.build')
-    def test_authenticate_google_calendar_valid_token(self, mock_build, mock_flow, mock_pickle_dump, mock_pickle_load):
+    @patch('calender.get_credential_store')
+    @patch('calender._run_oauth_flow')
+    @patch('calender._build_service')
+    def test_authenticate_google_calendar_valid_token(self, mock_build, mock_flow, mock_store):
         """
         Test the authenticate_google_calendar function when a valid token is available.
 
-        - Mocks the `pickle.load` to simulate a valid token.
-        - Mocks `build` to ensure the Google Calendar API is authenticated with the correct credentials.
+        - Mocks the credential store to return a valid token.
+        - Mocks `_build_service` to ensure the Google Calendar API is authenticated with the correct credentials.
         """
-        mock_pickle_load.return_value = Mock(valid=True, expired=False)
+        mock_store.return_value.load.return_value = Mock(valid=True, expired=False)
         mock_build.return_value = Mock()
         result = authenticate_google_calendar()
         self.assertIsNotNone(result)
-        mock_build.assert_called_once_with('calendar', 'v3', credentials=mock_pickle_load.return_value)
-        
-    @patch('calender.pickle.load')
-    @patch('calender.pickle.dump')
-    @patch('calender.InstalledAppFlow.from_client_secrets_file')
-    @patch('calender.build')
-    def test_authenticate_google_calendar_no_token(self, mock_build, mock_flow, mock_pickle_dump, mock_pickle_load):
-        """
-        Test the authenticate_google_calendar function when the token file is not found.
-
-        - Simulates a missing token file (via FileNotFoundError).
-        - Mocks `InstalledAppFlow` to simulate the flow for authenticating with Google OAuth.
-        - Verifies that the flow triggers the local server for authentication.
-        """
-        mock_pickle_load.side_effect = FileNotFoundError
-        mock_flow.return_value = Mock(run_local_server=Mock(return_value=Mock()))
+        mock_build.assert_called_once_with(mock_store.return_value.load.return_value)
+        mock_store.return_value.load.assert_called_once_with(calender.DEFAULT_USER)
+        mock_store.return_value.save.assert_not_called()
+
+    @patch('calender.get_credential_store')
+    @patch('calender._run_oauth_flow')
+    @patch('calender._build_service')
+    def test_authenticate_google_calendar_no_token(self, mock_build, mock_flow, mock_store):
+        """
+        Test the authenticate_google_calendar function when no token is stored.
+
+        - Simulates an empty credential store.
+        - Mocks `_run_oauth_flow` to simulate the browser flow for authenticating with Google OAuth.
+        - Verifies that the flow is started once and the token it returns is stored.
+        """
+        mock_store.return_value.load.return_value = None
         result = authenticate_google_calendar()
-        mock_flow.return_value.run_local_server.assert_called_once()
-        mock_build.assert_called_once_with('calendar', 'v3', credentials=mock_flow.return_value.run_local_server.return_value)
-        
+        mock_flow.assert_called_once_with('credentials.json', calender.SCOPES)
+        creds = mock_flow.return_value
+        mock_build.assert_called_once_with(creds)
+        mock_store.return_value.save.assert_called_once_with(calender.DEFAULT_USER, creds)
+
+    @patch('calender.get_credential_store')
+    @patch('calender._run_oauth_flow')
+    def test_unknown_user_is_not_sent_through_browser_flow(self, mock_flow, mock_store):
+        """
+        Test that users other than the default one must be authorized ahead of time.
+
+        - Simulates a user with no stored token.
+        - Verifies a LookupError is raised instead of starting a local OAuth server.
+        """
+        mock_store.return_value.load.return_value = None
+        with self.assertRaises(LookupError):
+            authenticate_google_calendar('alice')
+        mock_flow.assert_not_called()
+
+    @patch('calender.get_credential_store')
+    @patch('calender._build_service')
+    def test_authenticate_google_calendar_reuses_cached_service(self, mock_build, mock_store):
+        """
+        Test that repeated authentication reuses the cached credentials and service.
+
+        - Verifies the token is read from the store and the service is built only once.
+        - Verifies the hit/miss counters reflect the reuse.
+        """
+        mock_store.return_value.load.return_value = Mock(valid=True, expired=False, expiry=None)
+        first = authenticate_google_calendar()
+        second = authenticate_google_calendar()
+        self.assertIs(first, second)
+        mock_store.return_value.load.assert_called_once()
+        mock_build.assert_called_once()
+        self.assertEqual(calendar_cache_stats(), {'hits': 1, 'misses': 1, 'refreshes': 0, 'evictions': 0})
+
+    @patch('calender.get_credential_store')
+    @patch('calender._build_service')
+    def test_authenticate_google_calendar_refreshes_near_expiry(self, mock_build, mock_store):
+        """
+        Test that cached credentials are refreshed once they get close to expiry.
+
+        - Simulates a token that expires within the refresh margin on the second call.
+        - Verifies the token is refreshed in place, saved, and the service is not rebuilt.
+        """
+        creds = Mock(valid=True, expired=False, refresh_token='refresh', expiry=datetime.utcnow() + timedelta(hours=1))
+        mock_store.return_value.load.return_value = creds
+        authenticate_google_calendar()
+        creds.refresh.assert_not_called()
+
+        creds.expiry = datetime.utcnow() + timedelta(minutes=1)
+        authenticate_google_calendar()
+        creds.refresh.assert_called_once()
+        mock_store.return_value.save.assert_called_once_with(calender.DEFAULT_USER, creds)
+        mock_build.assert_called_once()
+        self.assertEqual(calendar_cache_stats(), {'hits': 1, 'misses': 1, 'refreshes': 1, 'evictions': 0})
+
+    @patch('calender.get_credential_store')
+    @patch('calender._build_service')
+    def test_credentials_and_services_are_kept_per_user(self, mock_build, mock_store):
+        """
+        Test that every user gets their own credentials and service object.
+
+        - Simulates a store holding a different token for each user.
+        - Verifies each user's service is built with that user's credentials.
+        """
+        tokens = {'alice': Mock(valid=True, expiry=None), 'bob': Mock(valid=True, expiry=None)}
+        mock_store.return_value.load.side_effect = tokens.get
+        mock_build.side_effect = lambda credentials: Mock(credentials=credentials)
+        alice = authenticate_google_calendar('alice')
+        bob = authenticate_google_calendar('bob')
+        self.assertIs(alice.credentials, tokens['alice'])
+        self.assertIs(bob.credentials, tokens['bob'])
+        self.assertIs(authenticate_google_calendar('alice'), alice)
+
+    @patch('calender.get_credential_store')
+    @patch('calender._build_service')
+    def test_service_cache_stays_bounded(self, mock_build, mock_store):
+        """
+        Test that the service cache drops the least recently used users once it is full.
+
+        - Shrinks the cache to two entries and authenticates three users.
+        - Verifies only two services are kept and the eviction is counted.
+        """
+        mock_store.return_value.load.return_value = Mock(valid=True, expiry=None)
+        with patch('calender._services', calender.LRUCache(2)):
+            for user_id in ('alice', 'bob', 'carol'):
+                authenticate_google_calendar(user_id)
+            self.assertEqual(len(calender._services), 2)
+            self.assertEqual(calendar_cache_stats()['evictions'], 1)
+
+    @patch('calender.get_credential_store')
+    @patch('calender._auth_request')
+    def test_concurrent_refreshes_are_single_flight(self, mock_request, mock_store):
+        """
+        Test that threads finding the same token expiring refresh it only once.
+
+        - Simulates a slow refresh that moves the expiry an hour ahead.
+        - Verifies eight concurrent callers cause a single refresh and all get the same credentials.
+        """
+        creds = Mock(valid=True, refresh_token='refresh', expiry=datetime.utcnow() + timedelta(hours=1))
+        mock_store.return_value.load.return_value = creds
+        calender.get_credentials('alice')
+        creds.expiry = datetime.utcnow()
+
+        def slow_refresh(request):
+            time.sleep(0.05)
+            creds.expiry = datetime.utcnow() + timedelta(hours=1)
+        creds.refresh.side_effect = slow_refresh
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            results = list(pool.map(lambda _: calender.get_credentials('alice'), range(8)))
+        creds.refresh.assert_called_once()
+        self.assertTrue(all(result is creds for result in results))
+
+    @patch('calender.get_credential_store')
+    @patch('calender.sync_events')
+    @patch('calender.authenticate_google_calendar')
+    @patch('calender.get_event_mirror')
+    def test_routes_act_for_forwarded_user(self, mock_mirror, mock_auth, mock_sync, mock_store):
+        """
+        Test that the routes use the user named by the authenticating proxy.
+
+        - Sends the index request with the user header set.
+        - Verifies that user's calendar and mirror are used.
+        """
+        mock_store.return_value.has_user.return_value = True
+        mock_mirror.return_value = EventMirror(':memory:')
+        self.client.get('/', headers={calender.USER_HEADER: 'alice'})
+        mock_auth.assert_called_once_with('alice')
+        mock_mirror.assert_called_once_with('alice')
+
+    def test_unknown_user_is_refused_without_creating_a_mirror(self):
+        """
+        Test that a user header naming someone without stored credentials gets 403 and no mirror file.
+        """
+        self.mirror_patcher.stop()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        with patch('calender.get_credential_store', return_value=CredentialStore(':memory:')), \
+                patch('calender.MIRROR_DIR', os.path.join(tmp.name, 'mirrors')), \
+                patch('calender.authenticate_google_calendar') as mock_auth:
+            for path in ('/', '/events', '/export.ics'):
+                response = self.client.get(path, headers={calender.USER_HEADER: 'mallory'})
+                self.assertEqual(response.status_code, 403)
+            with self.assertRaises(LookupError):
+                calender.get_event_mirror('mallory')
+        mock_auth.assert_not_called()
+        self.assertFalse(os.path.exists(os.path.join(tmp.name, 'mirrors')))
+
     @patch('calender.authenticate_google_calendar')
     def test_index(self, mock_authenticate):
         """
@@ -62,8 +256,8 @@ class TestGoogleCalendarApp(unittest.TestCase):
         mock_authenticate.return_value = mock_service
         mock_service.events.return_value.list.return_value.execute.return_value = {
             'items': [
-                {'id': '1', 'summary': 'Sample Event 1', 'start': {'dateTime': '2024-11-23T09:00:00'}},
-                {'id': '2', 'summary': 'Sample Event 2', 'start': {'date': '2024-11-24'}},
+                {'id': '1', 'summary': 'Sample Event 1', 'start': {'dateTime': f'{SOON}T09:00:00'}},
+                {'id': '2', 'summary': 'Sample Event 2', 'start': {'date': LATER}},
             ]
         }
 
@@ -87,15 +281,15 @@ class TestGoogleCalendarApp(unittest.TestCase):
         mock_create_event.return_value = {
             'id': '12345',
             'summary': 'New Event',
-            'start': {'dateTime': '2024-11-22T23:59:59'},
-            'end': {'dateTime': '2024-11-23T00:59:59'},
+            'start': {'dateTime': f'{SOON}T23:59:59'},
+            'end': {'dateTime': f'{SOON}T23:59:59'},
         }
         mock_fetch_events.return_value = [
-            {'id': '12345', 'name': 'New Event', 'start': '2024-11-22'}
+            {'id': '12345', 'name': 'New Event', 'start': SOON}
         ]
         response = self.client.post('/create_event', data={
             'event_name': 'New Event',
-            'event_date': '2024-11-22'
+            'event_date': SOON
         }, follow_redirects=True)
         self.assertIn(b'New Event', response.data)
 
@@ -106,7 +300,7 @@ class TestGoogleCalendarApp(unittest.TestCase):
         Test the delete_event route (POST /delete_event).
 
         - Mocks `authenticate_google_calendar` and `delete_event` functions.
-        - Simulates event deletion and verifies the correct status code (200).
+        - Simulates event deletion and verifies the browser is redirected back to the index page (303).
         """
         mock_service = Mock()
         mock_authenticate.return_value = mock_service
@@ -115,7 +309,49 @@ class TestGoogleCalendarApp(unittest.TestCase):
             'event_id': '12345'
         })
 
-        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.status_code, 303)
+        self.assertEqual(response.headers['Location'], '/')
+
+    @patch('calender.sync_events')
+    @patch('calender.authenticate_google_calendar')
+    def test_index_is_cached_and_conditional(self, mock_authenticate, mock_sync):
+        """
+        Test that the index page is served from the per-user cache with an ETag.
+
+        - Loads the page twice, the second time sending the ETag back.
+        - Verifies Google is synced once and the second answer is an empty 304.
+        """
+        self.mirror.upsert([{'id': '1', 'summary': 'Essay', 'start': {'date': SOON}}])
+        first = self.client.get('/')
+        self.assertEqual(first.status_code, 200)
+        self.assertIn(b'Essay', first.data)
+        second = self.client.get('/', headers={'If-None-Match': first.headers['ETag']})
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second.data, b'')
+        mock_sync.assert_called_once()
+
+    @patch('calender.sync_events')
+    @patch('calender.delete_event')
+    @patch('calender.authenticate_google_calendar')
+    def test_deletion_invalidates_cached_index(self, mock_authenticate, mock_delete_event, mock_sync):
+        """
+        Test that deleting an event drops the cached page so the change shows immediately.
+
+        - Polls /events, deletes the event, then polls again with the old ETag.
+        - Verifies the second poll is a fresh 200 without the deleted event.
+        """
+        self.mirror.upsert([{'id': '1', 'summary': 'Essay', 'start': {'date': SOON}}])
+        first = self.client.get('/events')
+        self.assertEqual(first.get_json(), {'events': [{'id': '1', 'name': 'Essay', 'start': SOON}]})
+        self.assertEqual(self.client.get('/events', headers={'If-None-Match': first.headers['ETag']}).status_code,
+                         304)
+
+        self.client.post('/delete_event', data={'event_id': '1'})
+        second = self.client.get('/events', headers={'If-None-Match': first.headers['ETag']})
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.get_json(), {'events': []})
+        self.assertEqual(mock_sync.call_count, 2)
+
     @patch('calender.delete_event')
     @patch('calender.authenticate_google_calendar')
     def test_delete_event_failure(self, mock_auth, mock_delete_event):
@@ -152,6 +388,39 @@ class TestGoogleCalendarApp(unittest.TestCase):
         self.assertEqual(events[0]['name'], 'Sample Event 1')
         self.assertEqual(events[1]['name'], 'Sample Event 2')
 
+    def test_iter_events_follows_page_tokens(self):
+        """
+        Test that iter_events requests every page until no nextPageToken is returned.
+
+        - Simulates two pages of results.
+        - Verifies events from both pages are yielded and the token is passed on.
+        """
+        mock_service = Mock()
+        mock_list = mock_service.events.return_value.list
+        mock_list.return_value.execute.side_effect = [
+            {'items': [{'id': '1', 'summary': 'Page 1', 'start': {'date': '2024-11-24'}}], 'nextPageToken': 'token2'},
+            {'items': [{'id': '2', 'summary': 'Page 2', 'start': {'dateTime': '2024-11-25T09:00:00'}}]},
+        ]
+        events = list(iter_events(mock_service, time_min='2024-11-01T00:00:00Z', page_size=1))
+        self.assertEqual([event['name'] for event in events], ['Page 1', 'Page 2'])
+        self.assertEqual(events[1]['start'], '2024-11-25')
+        self.assertEqual(mock_list.call_args_list[0].kwargs['pageToken'], None)
+        self.assertEqual(mock_list.call_args_list[1].kwargs['pageToken'], 'token2')
+        self.assertEqual(mock_list.call_args.kwargs['maxResults'], 1)
+
+    def test_iter_events_is_lazy_and_windowed(self):
+        """
+        Test that iter_events does not call the API before it is consumed and passes the window bounds.
+        """
+        mock_service = Mock()
+        mock_list = mock_service.events.return_value.list
+        mock_list.return_value.execute.return_value = {'items': []}
+        events = iter_events(mock_service, time_min=datetime(2024, 11, 1), time_max=datetime(2024, 12, 1))
+        mock_list.assert_not_called()
+        self.assertEqual(list(events), [])
+        self.assertEqual(mock_list.call_args.kwargs['timeMin'], '2024-11-01T00:00:00Z')
+        self.assertEqual(mock_list.call_args.kwargs['timeMax'], '2024-12-01T00:00:00Z')
+
     @patch('calender.authenticate_google_calendar')
     def test_create_event_function(self, mock_authenticate):
         """
@@ -200,5 +469,319 @@ class TestGoogleCalendarApp(unittest.TestCase):
             calendarId='primary', eventId='12345'
         )
 
+class TestCalendarSync(unittest.TestCase):
+    """
+    Tests for the incremental sync engine and its local SQLite mirror.
+    """
+    def setUp(self):
+        self.mirror = EventMirror(':memory:')
+        self.service = Mock()
+        self.list = self.service.events.return_value.list
+
+    def test_full_then_incremental_sync(self):
+        """
+        Test that the first sync lists everything and later ones only send the stored syncToken.
+
+        - Simulates a full sync followed by a delta that changes one event and cancels another.
+        - Verifies the mirror reflects both and the syncToken is reused.
+        """
+        self.list.return_value.execute.side_effect = [
+            {'items': [{'id': '1', 'summary': 'Essay', 'start': {'date': '2024-11-24'}}], 'nextPageToken': 'p2'},
+            {'items': [{'id': '2', 'summary': 'Quiz', 'start': {'date': '2024-11-25'}}], 'nextSyncToken': 's1'},
+            {'items': [
+                {'id': '1', 'summary': 'Essay (extended)', 'start': {'date': '2024-11-30'}},
+                {'id': '2', 'status': 'cancelled'},
+            ], 'nextSyncToken': 's2'},
+        ]
+        self.assertEqual(sync_events(self.service, self.mirror), {'full': True, 'updated': 2, 'deleted': 0})
+        self.assertNotIn('syncToken', self.list.call_args.kwargs)
+        self.assertEqual(len(self.mirror.events_between('2024-01-01')), 2)
+
+        self.assertEqual(sync_events(self.service, self.mirror), {'full': False, 'updated': 1, 'deleted': 1})
+        self.assertEqual(self.list.call_args.kwargs['syncToken'], 's1')
+        self.assertEqual(self.mirror.events_between('2024-01-01'),
+                         [{'id': '1', 'name': 'Essay (extended)', 'start': '2024-11-30'}])
+        self.assertEqual(self.mirror.sync_token(), 's2')
+
+    def test_expired_sync_token_triggers_full_resync(self):
+        """
+        Test that a 410 Gone answer drops the syncToken and rebuilds the mirror from scratch.
+
+        - Verifies events missing from the full resync are removed from the mirror.
+        """
+        self.mirror.upsert([{'id': 'stale', 'summary': 'Old', 'start': {'date': '2024-11-01'}}])
+        self.mirror.finish_sync('expired')
+        gone = HttpError(Mock(status=410), b'Gone')
+        self.list.return_value.execute.side_effect = [
+            gone,
+            {'items': [{'id': '1', 'summary': 'Essay', 'start': {'date': '2024-11-24'}}], 'nextSyncToken': 'fresh'},
+        ]
+        self.assertTrue(sync_events(self.service, self.mirror)['full'])
+        self.assertEqual([event['id'] for event in self.mirror.events_between('2024-01-01')], ['1'])
+        self.assertEqual(self.mirror.sync_token(), 'fresh')
+
+    def test_events_between_filters_and_orders_by_start(self):
+        """
+        Test that the mirror only returns events inside the requested window, earliest first.
+        """
+        self.mirror.upsert([
+            {'id': 'b', 'summary': 'Late', 'start': {'dateTime': '2024-11-24T15:00:00'}},
+            {'id': 'a', 'summary': 'Early', 'start': {'dateTime': '2024-11-24T09:00:00'}},
+            {'id': 'c', 'summary': 'Outside', 'start': {'date': '2024-12-24'}},
+        ])
+        events = self.mirror.events_between('2024-11-24', '2024-11-30')
+        self.assertEqual([event['id'] for event in events], ['a', 'b'])
+
+class TestBulkEvents(unittest.TestCase):
+    """
+    Tests for batched event creation and deletion against a mocked HTTP transport.
+    """
+    def setUp(self):
+        app.testing = True
+        self.client = app.test_client()
+        reset_calendar_cache()
+        self.mirror_patcher = patch('calender.get_event_mirror', return_value=EventMirror(':memory:'))
+        self.mirror = self.mirror_patcher.start()()
+        self.addCleanup(self.mirror_patcher.stop)
+
+    def test_create_events_reports_per_item_results(self):
+        """
+        Test that create_events sends one batch and maps each answer back to its event.
+        """
+        service = calendar_service_with([batch_response([
+            (0, 200, {'id': 'a', 'summary': 'Essay'}),
+            (1, 400, {'error': {'code': 400, 'message': 'Bad date'}}),
+        ])])
+        results = create_events(service, [
+            {'name': 'Essay', 'date': '2024-12-01'},
+            {'name': 'Quiz', 'date': 'not-a-date'},
+        ])
+        self.assertTrue(results[0]['ok'])
+        self.assertEqual(results[0]['result']['id'], 'a')
+        self.assertFalse(results[1]['ok'])
+        self.assertIn('Bad date', results[1]['error'])
+
+    def test_delete_events_splits_into_batch_size_chunks(self):
+        """
+        Test that delete_events never puts more than MAX_BATCH_SIZE calls in one batch.
+        """
+        event_ids = [f"event{i}" for i in range(5)]
+        with patch.object(calender, 'MAX_BATCH_SIZE', 2):
+            service = calendar_service_with([
+                batch_response([(0, 204, None), (1, 204, None)]),
+                batch_response([(2, 204, None), (3, 204, None)]),
+                batch_response([(4, 404, {'error': {'code': 404, 'message': 'Not Found'}})]),
+            ])
+            results = delete_events(service, event_ids)
+        self.assertEqual([result['id'] for result in results], event_ids)
+        self.assertEqual([result['ok'] for result in results], [True, True, True, True, False])
+
+    def test_transport_failure_marks_whole_batch_failed(self):
+        """
+        Test that a failed batch HTTP call is reported against every item in it.
+        """
+        service = calendar_service_with([({'status': '503'}, 'Service Unavailable')])
+        results = delete_events(service, ['x', 'y'])
+        self.assertEqual([result['ok'] for result in results], [False, False])
+
+    @patch('calender.authenticate_google_calendar')
+    @patch('calender.delete_events')
+    @patch('calender.create_events')
+    def test_bulk_route(self, mock_create_events, mock_delete_events, mock_auth):
+        """
+        Test the bulk route (POST /events/bulk) passes items through and returns JSON results.
+        """
+        mock_create_events.return_value = [{'ok': True, 'result': {'id': 'a'}}]
+        mock_delete_events.return_value = [{'ok': True, 'result': None, 'id': 'b'}]
+        response = self.client.post('/events/bulk', json={
+            'create': [{'name': 'Essay', 'date': '2024-12-01'}],
+            'delete': ['b'],
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['created'][0]['result']['id'], 'a')
+        self.assertEqual(response.get_json()['deleted'][0]['id'], 'b')
+        mock_create_events.assert_called_once_with(mock_auth.return_value, [{'name': 'Essay', 'date': '2024-12-01'}])
+
+    def test_bulk_route_rejects_bad_payload(self):
+        """
+        Test the bulk route returns 400 for events missing a name or date, and for lists of the wrong shape.
+        """
+        response = self.client.post('/events/bulk', json={'create': [{'name': 'Essay'}]})
+        self.assertEqual(response.status_code, 400)
+        for payload in ({'create': {'name': 'Essay', 'date': '2024-12-01'}}, {'delete': 'evt-1'},
+                        {'delete': [{'id': 'evt-1'}]}, {'create': None}):
+            with self.subTest(payload=payload):
+                self.assertEqual(self.client.post('/events/bulk', json=payload).status_code, 400)
+
+    def test_metrics_route_reports_route_latency(self):
+        """
+        Test that /metrics exposes the latency of earlier requests, labelled by URL rule and status.
+        """
+        calender.metrics.reset()
+        self.client.post('/events/bulk', json={'create': [{'name': 'Essay'}]})
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        self.assertIn('edusync_route_seconds_count{route="/events/bulk",method="POST",status="400"} 1',
+                      response.get_data(as_text=True))
+
+class TestCredentialStore(unittest.TestCase):
+    """
+    Test suite for the per-user credential store and the bounded cache of per-user clients.
+    """
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = os.path.join(self.tmp.name, 'credentials.sqlite3')
+
+    def credentials(self, token='access'):
+        from google.oauth2.credentials import Credentials
+        return Credentials(token=token, refresh_token='refresh', client_id='client', client_secret='secret',
+                           token_uri='https://oauth2.googleapis.com/token',
+                           expiry=datetime.utcnow().replace(microsecond=0) + timedelta(hours=1))
+
+    def test_round_trip_per_user(self):
+        """
+        Test that credentials are stored per user as JSON and read back intact.
+
+        - Saves two users' tokens and reopens the file.
+        - Verifies each user gets their own token and the file is private.
+        """
+        store = CredentialStore(self.path, calender.SCOPES)
+        store.save('alice', self.credentials('alice-token'))
+        store.save('bob', self.credentials('bob-token'))
+
+        reopened = CredentialStore(self.path, calender.SCOPES)
+        self.assertEqual(reopened.users(), ['alice', 'bob'])
+        alice = reopened.load('alice')
+        self.assertEqual(alice.token, 'alice-token')
+        self.assertEqual(alice.refresh_token, 'refresh')
+        self.assertIsNone(reopened.load('carol'))
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+
+    def test_import_pickle_moves_legacy_token(self):
+        """
+        Test that a token.pickle from the single-user version is imported once.
+
+        - Writes a pickled token and imports it.
+        - Verifies it is stored for the given user and the pickle is renamed.
+        """
+        legacy = os.path.join(self.tmp.name, 'token.pickle')
+        with open(legacy, 'wb') as token:
+            pickle.dump(self.credentials('legacy-token'), token)
+        store = CredentialStore(self.path, calender.SCOPES)
+        self.assertTrue(store.import_pickle(legacy, calender.DEFAULT_USER))
+        self.assertFalse(store.import_pickle(legacy, calender.DEFAULT_USER))
+        self.assertEqual(store.load(calender.DEFAULT_USER).token, 'legacy-token')
+        self.assertTrue(os.path.exists(legacy + '.imported'))
+
+    def test_lru_cache_evicts_least_recently_used_and_idle_entries(self):
+        """
+        Test the size and idle-time bounds of the cache.
+
+        - Uses a fake clock so entries can be aged without sleeping.
+        - Verifies the least recently used entry goes first and idle entries expire.
+        """
+        now = [0.0]
+        cache = calender.LRUCache(2, ttl=10, clock=lambda: now[0])
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((cache.get('a'), cache.get('c')), (1, 3))
+
+        now[0] = 10
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.evictions, 2)
+
+class TestCalendarFiles(unittest.TestCase):
+    """
+    Test suite for the bulk import and the iCalendar export.
+    """
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        reset_calendar_cache()
+        self.client = app.test_client()
+
+    def write(self, name, text):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, 'w', newline='') as out:
+            out.write(text)
+        return path
+
+    def test_readers_stream_csv_ics_and_assignments_table(self):
+        """
+        Test that every input format yields the same events and marks unusable rows.
+
+        - Reads a CSV file, a folded and escaped ICS file and a SQLite assignments table.
+        - Verifies the parsed names, dates and descriptions.
+        """
+        csv_path = self.write('due.csv', 'title,due_date,description\nEssay,2024-10-21,Read\n,2024-10-22,\n')
+        self.assertEqual(list(calendarfiles.read_csv(csv_path)),
+                         [{'name': 'Essay', 'date': '2024-10-21', 'description': 'Read'}, None])
+
+        ics_path = self.write('due.ics', 'BEGIN:VCALENDAR\r\nBEGIN:VEVENT\r\nSUMMARY:Essay\\, part\r\n  one\r\n'
+                                         'DTSTART;VALUE=DATE:20241021\r\nEND:VEVENT\r\nEND:VCALENDAR\r\n')
+        self.assertEqual(list(calendarfiles.read_ics(ics_path)),
+                         [{'name': 'Essay, part one', 'date': '2024-10-21', 'description': None}])
+
+        db_path = os.path.join(self.tmp.name, 'assignments.sqlite')
+        conn = sqlite3.connect(db_path)
+        with conn:
+            conn.execute("CREATE TABLE Assignments (id INTEGER PRIMARY KEY, title TEXT, dueDate TEXT)")
+            conn.execute("INSERT INTO Assignments (title, dueDate) VALUES ('Quiz', '2024-11-01 00:00:00.000 +00:00')")
+        conn.close()
+        self.assertEqual(list(calendarfiles.read_assignments(db_path)),
+                         [{'name': 'Quiz', 'date': '2024-11-01', 'description': None}])
+
+    @patch('calender.create_events')
+    def test_import_skips_events_already_in_calendar(self, mock_create_events):
+        """
+        Test that the import only creates events the calendar does not have yet.
+
+        - Puts one event in the mirror and imports it again together with a new one and a repeat.
+        - Verifies only the new event is sent, in chunks, and is added to the mirror.
+        """
+        mirror = EventMirror(':memory:')
+        mirror.upsert([{'id': '1', 'summary': 'Essay', 'start': {'date': '2024-10-21'}}])
+        mock_create_events.side_effect = lambda service, events: [
+            {'ok': True, 'result': {'id': f"new-{event['name']}", 'summary': event['name'],
+                                    'start': {'dateTime': f"{event['date']}T23:59:59"}}} for event in events]
+        events = [{'name': 'Essay', 'date': '2024-10-21'}, {'name': 'Quiz', 'date': '2024-11-01'},
+                  {'name': 'Quiz', 'date': '2024-11-01'}, None]
+
+        stats = calendarfiles.import_events(Mock(), mirror, events, chunk_size=1)
+        self.assertEqual(stats, {'created': 1, 'duplicate': 2, 'invalid': 1, 'failed': 0})
+        mock_create_events.assert_called_once()
+        self.assertEqual(mirror.existing([('Quiz', '2024-11-01')]), {('Quiz', '2024-11-01')})
+
+    @patch('calender.authenticate_google_calendar')
+    def test_export_streams_every_page(self, mock_authenticate):
+        """
+        Test the /export.ics route.
+
+        - Serves two pages of events.
+        - Verifies both pages end up in one iCalendar document and the date window is passed on.
+        """
+        pages = [
+            {'items': [{'id': '1', 'summary': 'Essay', 'start': {'date': '2024-10-21'}}], 'nextPageToken': 'p2'},
+            {'items': [{'id': '2', 'summary': 'Quiz', 'start': {'dateTime': '2024-11-01T09:00:00Z'}}]},
+        ]
+        mock_list = mock_authenticate.return_value.events.return_value.list
+        mock_list.return_value.execute.side_effect = pages
+
+        response = self.client.get('/export.ics?from=2024-10-01&to=2024-11-30')
+        body = response.get_data(as_text=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(body.startswith('BEGIN:VCALENDAR') and body.endswith('END:VCALENDAR\r\n'))
+        self.assertIn('SUMMARY:Essay\r\n', body)
+        self.assertIn('DTSTART;VALUE=DATE:20241021', body)
+        self.assertIn('DTSTART:20241101T090000Z', body)
+        self.assertEqual(mock_list.call_args_list[0].kwargs['timeMax'], '2024-12-01T00:00:00Z')
+        self.assertEqual(self.client.get('/export.ics?from=soon').status_code, 400)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
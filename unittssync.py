@@ -0,0 +1,1176 @@
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch, Mock
+import mongomock
+import httpclient
+import parsecontent1
+import workqueue
+import htmlparsers
+import metrics
+import contentstore
+from syncdaemon import SyncDaemon, SyncJob, build_jobs
+import benchstubs
+import scrapesession
+from bench_sync import calendar_service, compare, percentile
+import calendarprojection
+from calendarprojection import CalendarProjection
+from calender import create_events, iter_events
+from contentstore import (ContentWriter, deadlines_between, due_this_week, ensure_indexes, fingerprint,
+                          make_content_id, migrate_dates, modified_since, normalize_dates, parse_date,
+                          rekey_content_ids)
+
+def fake_response(status_code, headers=None, json_body=None, content=b''):
+    """
+    Build a stand-in for requests.Response with the given status, headers and body.
+    """
+    response = Mock(status_code=status_code, headers=headers or {}, content=content)
+    response.json.return_value = json_body
+    return response
+
+class TestHttpClient(unittest.TestCase):
+    """
+    Test suite for the shared Blackboard HTTP layer.
+    Tests include rate-limit backoff and Retry-After handling.
+    """
+    def setUp(self):
+        httpclient.reset_hosts()
+        self.addCleanup(httpclient.reset_hosts)
+
+    @patch('httpclient.HostGate.block_for')
+    def test_request_retries_after_429(self, mock_block_for):
+        """
+        Test that a 429 response is retried after waiting for its Retry-After.
+
+        - Simulates one rate-limited answer followed by a success.
+        - Verifies the host is paused for the advertised number of seconds.
+        """
+        session = Mock()
+        session.request.side_effect = [fake_response(429, {'Retry-After': '3'}), fake_response(200)]
+        response = httpclient.get('https://lms.test/learn/api', session=session)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(session.request.call_count, 2)
+        mock_block_for.assert_called_once_with(3.0)
+
+    @patch('httpclient.HostGate.block_for')
+    def test_request_gives_up_after_max_retries(self, mock_block_for):
+        """
+        Test that the last rate-limited response is returned once retries run out.
+        """
+        session = Mock()
+        session.request.return_value = fake_response(429)
+        with patch.object(httpclient, 'MAX_RETRIES', 2):
+            response = httpclient.get('https://lms.test/other', session=session)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(session.request.call_count, 3)
+
+    def test_retry_delay_backs_off_exponentially_without_header(self):
+        """
+        Test that the delay doubles with each attempt and is capped at MAX_BACKOFF.
+        """
+        response = fake_response(503)
+        self.assertEqual(httpclient.retry_delay(response, 0), httpclient.BACKOFF_BASE)
+        self.assertEqual(httpclient.retry_delay(response, 2), httpclient.BACKOFF_BASE * 4)
+        self.assertEqual(httpclient.retry_delay(response, 50), httpclient.MAX_BACKOFF)
+
+    @patch('httpclient.HostGate.block_for')
+    def test_timeouts_are_set_and_dropped_connections_retried_for_gets_only(self, mock_block_for):
+        """
+        Test that requests get the default timeouts and only GETs are resent after a connection error.
+        """
+        session = Mock()
+        session.request.side_effect = [httpclient.requests.ConnectionError('reset'), fake_response(200)]
+        self.assertEqual(httpclient.get('https://lms.test/page', session=session).status_code, 200)
+        self.assertEqual(session.request.call_args.kwargs['timeout'],
+                         (httpclient.CONNECT_TIMEOUT, httpclient.READ_TIMEOUT))
+
+        session.request.side_effect = [httpclient.requests.ConnectionError('reset'), fake_response(200)]
+        with self.assertRaises(httpclient.requests.ConnectionError):
+            httpclient.post('https://lms.test/token', session=session)
+
+    @patch('httpclient.HostGate.block_for')
+    def test_circuit_opens_after_repeated_failures_and_closes_after_trial(self, mock_block_for):
+        """
+        Test that a failing host is short-circuited and retried once its cooldown has passed.
+
+        - Verifies no request is sent while the circuit is open.
+        - Verifies a successful trial request closes the circuit.
+        """
+        session = Mock()
+        session.request.return_value = fake_response(500)
+        for _ in range(httpclient.BREAKER_THRESHOLD):
+            httpclient.get('https://lms.test/broken', session=session)
+        with self.assertRaises(httpclient.CircuitOpenError):
+            httpclient.get('https://lms.test/broken', session=session)
+        self.assertEqual(session.request.call_count, httpclient.BREAKER_THRESHOLD)
+
+        breaker = httpclient.host_gate('https://lms.test/').breaker
+        breaker._opened_at -= breaker.cooldown
+        session.request.return_value = fake_response(200)
+        self.assertEqual(httpclient.get('https://lms.test/broken', session=session).status_code, 200)
+        self.assertEqual(breaker.state, 'closed')
+
+    def test_token_bucket_spaces_requests_after_a_burst(self):
+        """
+        Test that the bucket lets a burst through and then asks for waits of 1/rate each.
+        """
+        bucket = httpclient.TokenBucket(rate=10, capacity=2)
+        waits = [bucket.reserve() for _ in range(4)]
+        self.assertEqual(waits[:2], [0.0, 0.0])
+        self.assertAlmostEqual(waits[2], 0.1, places=2)
+        self.assertAlmostEqual(waits[3], 0.2, places=2)
+
+    def test_identical_gets_in_flight_are_coalesced(self):
+        """
+        Test that concurrent identical GETs share one request while different ones do not.
+        """
+        release = threading.Event()
+        session = Mock()
+
+        def slow_request(method, url, **kwargs):
+            release.wait(5)
+            return fake_response(200, content=url.encode())
+        session.request.side_effect = slow_request
+
+        results = []
+        threads = [threading.Thread(target=lambda url=url: results.append(httpclient.get(url, session=session)))
+                   for url in ('https://lms.test/a', 'https://lms.test/a', 'https://lms.test/a', 'https://lms.test/b')]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.2)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(session.request.call_count, 2)
+        self.assertEqual(sorted(response.content for response in results), [b'https://lms.test/a'] * 3 + [b'https://lms.test/b'])
+
+class TestTokenManager(unittest.TestCase):
+    """
+    Tests for OAuth token reuse and single-flight renewal.
+    """
+    def test_token_is_reused_until_close_to_expiry(self):
+        """
+        Test that the token endpoint is only called again once the token enters the expiry margin.
+        """
+        fetch = Mock(side_effect=[('first', 3600), ('second', 3600)])
+        manager = httpclient.TokenManager(fetch, margin=60)
+        with patch('httpclient.time.monotonic', return_value=1000.0):
+            self.assertEqual(manager.get(), 'first')
+            self.assertEqual(manager.get(), 'first')
+        with patch('httpclient.time.monotonic', return_value=1000.0 + 3600 - 30):
+            self.assertEqual(manager.get(), 'second')
+        self.assertEqual(fetch.call_count, 2)
+
+    def test_concurrent_workers_share_one_refresh(self):
+        """
+        Test that many threads asking for a token at once trigger a single fetch.
+        """
+        fetch = Mock(return_value=('shared', 3600))
+        manager = httpclient.TokenManager(fetch)
+        tokens = []
+        threads = [threading.Thread(target=lambda: tokens.append(manager.get())) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(tokens, ['shared'] * 20)
+        fetch.assert_called_once()
+
+    def test_invalidate_ignores_tokens_already_replaced(self):
+        """
+        Test that a late 401 for an old token does not throw away its replacement.
+        """
+        fetch = Mock(side_effect=[('old', 3600), ('new', 3600)])
+        manager = httpclient.TokenManager(fetch)
+        manager.get()
+        manager.invalidate('old')
+        self.assertEqual(manager.get(), 'new')
+        manager.invalidate('old')
+        self.assertEqual(manager.get(), 'new')
+        self.assertEqual(fetch.call_count, 2)
+
+class TestValidatorCache(unittest.TestCase):
+    """
+    Tests for conditional fetching of scraped pages.
+    """
+    URL = 'https://lms.test/course'
+
+    def test_conditional_headers_and_304(self):
+        """
+        Test that committed validators are sent back and a 304 counts as unchanged.
+        """
+        cache = httpclient.ValidatorCache()
+        self.assertEqual(cache.conditional_headers(self.URL), {})
+        first = fake_response(200, {'ETag': '"v1"', 'Last-Modified': 'Mon, 02 Dec 2024 10:00:00 GMT'}, content=b'<html>')
+        self.assertTrue(cache.has_changed(self.URL, first))
+        self.assertEqual(cache.conditional_headers(self.URL), {})
+        cache.commit(self.URL)
+        self.assertEqual(cache.conditional_headers(self.URL), {
+            'If-None-Match': '"v1"', 'If-Modified-Since': 'Mon, 02 Dec 2024 10:00:00 GMT'})
+        self.assertFalse(cache.has_changed(self.URL, fake_response(304)))
+
+    def test_body_hash_used_without_validators(self):
+        """
+        Test that a server without ETag/Last-Modified is skipped when the body is byte-identical.
+        """
+        cache = httpclient.ValidatorCache()
+        self.assertTrue(cache.has_changed(self.URL, fake_response(200, content=b'<html>a</html>')))
+        cache.commit(self.URL)
+        self.assertFalse(cache.has_changed(self.URL, fake_response(200, content=b'<html>a</html>')))
+        self.assertTrue(cache.has_changed(self.URL, fake_response(200, content=b'<html>b</html>')))
+
+    def test_validators_persist_to_file(self):
+        """
+        Test that committed validators survive a restart when a file path is given.
+        """
+        path = os.path.join(tempfile.mkdtemp(), 'validators.json')
+        cache = httpclient.ValidatorCache(path)
+        cache.has_changed(self.URL, fake_response(200, {'ETag': '"v1"'}, content=b'x'))
+        cache.commit(self.URL)
+        self.assertEqual(httpclient.ValidatorCache(path).conditional_headers(self.URL), {'If-None-Match': '"v1"'})
+
+    def test_truncated_file_counts_as_empty_and_is_replaced_whole(self):
+        """
+        Test that a half-written validators file is ignored and the next commit writes a complete one.
+
+        - Verifies creating the cache does not touch the file.
+        - Verifies no temporary file is left next to it.
+        """
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'validators.json')
+        cache = httpclient.ValidatorCache(path)
+        with open(path, 'w') as f:
+            f.write('{"https://lms.test/course": {"etag": "')
+        self.assertEqual(cache.conditional_headers(self.URL), {})
+        cache.has_changed(self.URL, fake_response(200, {'ETag': '"v2"'}, content=b'y'))
+        cache.commit(self.URL)
+        self.assertEqual(os.listdir(directory), ['validators.json'])
+        self.assertEqual(httpclient.ValidatorCache(path).conditional_headers(self.URL), {'If-None-Match': '"v2"'})
+
+class TestMetrics(unittest.TestCase):
+    """
+    Tests for the shared counters, histograms and the Prometheus text output.
+    """
+    def setUp(self):
+        metrics.reset()
+
+    def test_histogram_buckets_are_cumulative(self):
+        """
+        Test that observations land in cumulative buckets with matching _sum and _count lines.
+        """
+        latency = metrics.histogram('test_latency_seconds', 'Test latency.', ('route',), buckets=(0.1, 1.0))
+        latency.observe(0.05, route='/')
+        latency.observe(0.5, route='/')
+        latency.observe(5, route='/')
+        text = metrics.render()
+        self.assertIn('test_latency_seconds_bucket{route="/",le="0.1"} 1', text)
+        self.assertIn('test_latency_seconds_bucket{route="/",le="1.0"} 2', text)
+        self.assertIn('test_latency_seconds_bucket{route="/",le="+Inf"} 3', text)
+        self.assertIn('test_latency_seconds_count{route="/"} 3', text)
+        self.assertIn('# TYPE test_latency_seconds histogram', text)
+
+    def test_counters_are_shared_and_labels_checked(self):
+        """
+        Test that asking for a metric twice returns the same one and wrong labels are rejected.
+        """
+        items = metrics.counter('test_items_total', 'Test items.', ('result',))
+        metrics.counter('test_items_total', 'Test items.', ('result',)).inc(2, result='inserted')
+        self.assertEqual(items.value(result='inserted'), 2)
+        with self.assertRaises(ValueError):
+            items.inc(outcome='inserted')
+        with self.assertRaises(ValueError):
+            metrics.histogram('test_items_total', 'Not a counter.')
+
+    def test_hot_paths_are_recorded(self):
+        """
+        Test that HTTP calls, token renewals and content writes update their metrics.
+
+        - Verifies the writer's unchanged items show up in edusync_content_items_total.
+        """
+        session = Mock()
+        session.request.return_value = Mock(status_code=200, headers={})
+        httpclient.get('https://lms.test/page', session=session)
+        self.assertEqual(httpclient.HTTP_SECONDS.count(method='GET', host='lms.test', status=200), 1)
+
+        httpclient.TokenManager(lambda: ('abc', 3600)).get()
+        self.assertEqual(httpclient.TOKEN_FETCH_SECONDS.count(outcome='ok'), 1)
+
+        collection = mongomock.MongoClient()['blackboard_db']['course_content']
+        for _ in range(2):
+            with ContentWriter(collection) as writer:
+                writer.add({'contentId': '1', 'title': 'Essay'})
+        self.assertIn('edusync_content_items_total{result="unchanged"} 1', metrics.render())
+
+    def test_metrics_server_serves_prometheus_text(self):
+        """
+        Test that the daemon's metrics server answers /metrics and 404s anything else.
+        """
+        import urllib.error
+        import urllib.request
+        metrics.counter('test_items_total', 'Test items.', ('result',)).inc(result='inserted')
+        server = metrics.serve_metrics(0, host='127.0.0.1')
+        self.addCleanup(server.shutdown)
+        base = f"http://127.0.0.1:{server.server_address[1]}"
+        with urllib.request.urlopen(f"{base}/metrics") as response:
+            self.assertIn(b'test_items_total{result="inserted"} 1', response.read())
+        with self.assertRaises(urllib.error.HTTPError):
+            urllib.request.urlopen(f"{base}/other")
+
+class TestHtmlParsers(unittest.TestCase):
+    """
+    Tests for the pluggable course page parser backends.
+    """
+    def test_backends_agree_on_fixture_page(self):
+        """
+        Test that every installed backend extracts the same blocks as the original html.parser code.
+        """
+        with open(os.path.join(os.path.dirname(__file__), 'fixtures', 'pages', 'course_small.html'), 'rb') as f:
+            html = f.read()
+        expected = htmlparsers.parse_content_blocks(html, 'html.parser')
+        self.assertEqual(len(expected), 12)
+        self.assertEqual(expected[0]['modified'], '2024-09-01T23:59:00Z')
+        for backend in htmlparsers.available_backends():
+            self.assertEqual(htmlparsers.parse_content_blocks(html, backend), expected, backend)
+
+    def test_unavailable_backend_is_rejected(self):
+        """
+        Test that asking for a backend whose library is missing raises a clear error.
+        """
+        with patch.object(htmlparsers, 'lxml', None):
+            with self.assertRaises(ValueError):
+                htmlparsers.parse_content_blocks('<html></html>', 'lxml')
+
+class TestContentWriter(unittest.TestCase):
+    """
+    Tests for the buffered bulk upsert stage shared by both parsers.
+    """
+    def setUp(self):
+        self.collection = mongomock.MongoClient()['blackboard_db']['course_content']
+
+    def test_flush_counts_inserted_updated_and_unchanged(self):
+        """
+        Test that a second cycle reports edits as updates and identical items as unchanged.
+        """
+        with ContentWriter(self.collection) as writer:
+            writer.add({'contentId': '1', 'title': 'Essay'})
+            writer.add({'contentId': '2', 'title': 'Quiz'})
+        self.assertEqual((writer.stats['inserted'], writer.stats['updated'], writer.stats['unchanged']), (2, 0, 0))
+
+        with ContentWriter(self.collection) as writer:
+            writer.add({'contentId': '1', 'title': 'Essay (revised)'})
+            writer.add({'contentId': '2', 'title': 'Quiz'})
+            writer.add({'contentId': '3', 'title': 'Lab'})
+        self.assertEqual((writer.stats['inserted'], writer.stats['updated'], writer.stats['unchanged']), (1, 1, 1))
+        self.assertEqual(self.collection.find_one({'contentId': '1'})['title'], 'Essay (revised)')
+
+    def test_unchanged_items_are_skipped_and_changes_recorded(self):
+        """
+        Test that only items whose fingerprint changed are written and produce a change event.
+
+        - Verifies a repeat cycle with identical content makes no bulk write at all.
+        - Verifies an edited description is stored and logged as an 'updated' event.
+        """
+        changes = mongomock.MongoClient()['blackboard_db']['content_changes']
+        item = {'contentId': '1', 'title': 'Essay', 'description': 'Draft', 'modified': '2024-11-01'}
+        with ContentWriter(self.collection, changes_collection=changes) as writer:
+            writer.add(dict(item))
+        self.assertEqual(self.collection.find_one({'contentId': '1'})['fingerprint'], fingerprint(normalize_dates(item)))
+
+        with patch.object(self.collection, 'bulk_write') as mock_bulk_write:
+            with ContentWriter(self.collection, changes_collection=changes) as writer:
+                writer.add(dict(item))
+            mock_bulk_write.assert_not_called()
+        self.assertEqual(writer.stats['unchanged'], 1)
+
+        with ContentWriter(self.collection, changes_collection=changes) as writer:
+            writer.add({**item, 'description': 'Final', 'modified': '2024-11-02'})
+        self.assertEqual(writer.stats['updated'], 1)
+        self.assertEqual(self.collection.find_one({'contentId': '1'})['description'], 'Final')
+        self.assertEqual([change['type'] for change in changes.find().sort('detectedAt')], ['created', 'updated'])
+
+    def test_fingerprint_ignores_key_order_and_storage_fields(self):
+        """
+        Test that the fingerprint is stable across key order and ignores `_id` and `fingerprint`.
+        """
+        self.assertEqual(fingerprint({'a': 1, 'b': 2}), fingerprint({'b': 2, 'a': 1, '_id': 'x', 'fingerprint': 'y'}))
+        self.assertNotEqual(fingerprint({'a': 1}), fingerprint({'a': 2}))
+
+    def test_writes_in_batches_of_flush_size(self):
+        """
+        Test that documents are written once the buffer reaches flush_size.
+        """
+        writer = ContentWriter(self.collection, flush_size=2, flush_interval=3600)
+        writer.add({'contentId': '1'})
+        self.assertEqual(self.collection.count_documents({}), 0)
+        writer.add({'contentId': '2'})
+        self.assertEqual(self.collection.count_documents({}), 2)
+        writer.add({'contentId': '3'})
+        writer.flush()
+        self.assertEqual(writer.stats['batches'], 2)
+        self.assertEqual(self.collection.count_documents({}), 3)
+
+    def test_duplicate_ids_in_one_batch_keep_the_latest(self):
+        """
+        Test that the same contentId twice in one batch results in a single upsert of the last copy.
+        """
+        with ContentWriter(self.collection) as writer:
+            writer.add({'contentId': '1', 'title': 'Draft'})
+            writer.add({'contentId': '1', 'title': 'Final'})
+        self.assertEqual(writer.stats['inserted'], 1)
+        self.assertEqual(self.collection.find_one({'contentId': '1'})['title'], 'Final')
+
+class TestContentIds(unittest.TestCase):
+    """
+    Tests for deterministic content IDs and the one-shot rekey migration.
+    """
+    def setUp(self):
+        self.collection = mongomock.MongoClient()['blackboard_db']['course_content']
+        self.collection.create_index('contentId', unique=True)
+
+    def test_content_id_is_stable_and_canonical(self):
+        """
+        Test that IDs do not depend on the process and ignore case, spacing and Unicode form.
+        """
+        content_id = make_content_id('https://lms.test/course', 'title', 'Essay 1')
+        self.assertEqual(content_id, make_content_id('https://lms.test/course', 'title', '  essay\u00a01 '))
+        # A fixed value: the same ID must come out of every process, whatever PYTHONHASHSEED is
+        self.assertEqual(content_id, 'eae81f63998ed68316bca634bf827929')
+        self.assertEqual(len(content_id), 32)
+        self.assertNotEqual(content_id, make_content_id('https://lms.test/course', 'title', 'Essay 2'))
+
+    @patch('parsecontent2.get_blackboard_session')
+    def test_blocks_with_the_same_title_get_different_ids(self, mock_session):
+        """
+        Test that scraped blocks without a DOM id but with the same title do not share a contentId.
+
+        - Verifies the first block keeps the title-only ID used before.
+        """
+        import parsecontent2
+        blocks = [{'block_id': None, 'title': title, 'description': None, 'modified': '2024-11-01'}
+                  for title in ('Quiz', 'Essay', 'quiz')]
+        mock_session.return_value.get.return_value = fake_response(200, content=b'<html>')
+        with patch('parsecontent2.parse_content_blocks', return_value=blocks):
+            items = parsecontent2.scrape_course_content('_1_1', conditional=False)
+        ids = [item['contentId'] for item in items]
+        self.assertEqual(len(set(ids)), 3)
+        self.assertEqual(ids[0], parsecontent2.scraped_content_id(None, 'Quiz', '_1_1'))
+
+    def test_rekey_collapses_duplicates_onto_newest_copy(self):
+        """
+        Test that documents re-inserted after restarts collapse into one document with the new ID.
+
+        - Simulates three copies of one item saved under different hash() values.
+        - Verifies only the most recently modified copy survives, under the stable ID.
+        """
+        self.collection.insert_many([
+            {'contentId': 111, 'title': 'Essay', 'modified': '2024-11-01'},
+            {'contentId': 222, 'title': 'Essay', 'modified': '2024-11-03'},
+            {'contentId': 333, 'title': 'Essay', 'modified': '2024-11-02'},
+            {'contentId': 444, 'title': 'Quiz', 'modified': '2024-11-01'},
+        ])
+        result = rekey_content_ids(self.collection, lambda document: f"id-{document['title']}",
+                                   set_fields={'courseId': 'c1'})
+        self.assertEqual(result, {'rekeyed': 2, 'removed': 2})
+        essay = self.collection.find_one({'contentId': 'id-Essay'})
+        self.assertEqual(essay['modified'], '2024-11-03')
+        self.assertEqual(essay['courseId'], 'c1')
+        self.assertEqual(self.collection.count_documents({}), 2)
+
+    def test_rekey_drops_old_copies_when_new_id_already_stored(self):
+        """
+        Test that old copies are removed when the scraper already saved the item under its new ID.
+        """
+        self.collection.insert_many([
+            {'contentId': 'id-Essay', 'title': 'Essay', 'modified': '2024-11-01', 'courseId': 'c1'},
+            {'contentId': 111, 'title': 'Essay', 'modified': '2024-11-05'},
+        ])
+        result = rekey_content_ids(self.collection, lambda document: f"id-{document['title']}",
+                                   query={'courseId': {'$exists': False}})
+        self.assertEqual(result, {'rekeyed': 0, 'removed': 1})
+        self.assertEqual([doc['contentId'] for doc in self.collection.find()], ['id-Essay'])
+
+class TestDeadlineQueries(unittest.TestCase):
+    """
+    Tests for the course_content indexes, date normalization and the deadline lookups.
+    """
+    def setUp(self):
+        self.collection = mongomock.MongoClient()['blackboard_db']['course_content']
+        ensure_indexes(self.collection)
+
+    def test_dates_are_stored_as_utc_datetimes(self):
+        """
+        Test that the writer stores Blackboard's ISO strings as naive UTC datetimes.
+
+        - Verifies offsets are converted to UTC and date-only values become midnight.
+        - Verifies values that are not dates are kept as they are.
+        """
+        self.assertEqual(parse_date('2024-12-01T23:59:00Z'), datetime(2024, 12, 1, 23, 59))
+        self.assertEqual(parse_date('2024-12-02T01:00:00+02:00'), datetime(2024, 12, 1, 23, 0))
+        self.assertEqual(parse_date('2024-12-01'), datetime(2024, 12, 1))
+        self.assertEqual(parse_date('next week'), 'next week')
+        with ContentWriter(self.collection) as writer:
+            writer.add({'contentId': '1', 'due': '2024-12-01T23:59:00Z', 'modified': '2024-11-01'})
+        stored = self.collection.find_one({'contentId': '1'})
+        self.assertEqual((stored['due'], stored['modified']), (datetime(2024, 12, 1, 23, 59), datetime(2024, 11, 1)))
+
+    def test_deadline_lookups_filter_sort_and_project(self):
+        """
+        Test that deadlines_between/due_this_week/modified_since return the right items in order.
+        """
+        with ContentWriter(self.collection) as writer:
+            writer.add({'contentId': '1', 'courseId': 'c1', 'title': 'Essay', 'due': '2024-12-05', 'modified': '2024-11-01'})
+            writer.add({'contentId': '2', 'courseId': 'c1', 'title': 'Quiz', 'due': '2024-12-03', 'modified': '2024-11-04'})
+            writer.add({'contentId': '3', 'courseId': 'c2', 'title': 'Lab', 'due': '2024-12-04', 'modified': '2024-11-02'})
+            writer.add({'contentId': '4', 'courseId': 'c1', 'title': 'Exam', 'due': '2025-01-20', 'modified': '2024-11-03'})
+        week = list(due_this_week(self.collection, now=datetime(2024, 12, 1)))
+        self.assertEqual([item['title'] for item in week], ['Quiz', 'Lab', 'Essay'])
+        self.assertEqual(set(week[0]), {'contentId', 'courseId', 'title', 'due'})
+        course = deadlines_between(self.collection, '2024-12-01', '2025-02-01', course_id='c1')
+        self.assertEqual([item['contentId'] for item in course], ['2', '1', '4'])
+        changed = modified_since(self.collection, 'c1', '2024-11-02')
+        self.assertEqual([item['contentId'] for item in changed], ['4', '2'])
+
+    def test_migrate_dates_converts_stored_strings(self):
+        """
+        Test that the one-shot migration rewrites date strings saved by older versions.
+        """
+        self.collection.insert_many([
+            {'contentId': '1', 'due': '2024-12-01T23:59:00Z', 'modified': '2024-11-01'},
+            {'contentId': '2', 'modified': datetime(2024, 11, 2), 'created': 'unknown'},
+        ])
+        self.assertEqual(migrate_dates(self.collection), 1)
+        self.assertEqual(self.collection.find_one({'contentId': '1'})['due'], datetime(2024, 12, 1, 23, 59))
+        self.assertEqual(self.collection.find_one({'contentId': '2'})['created'], 'unknown')
+
+class TestSyncDaemon(unittest.TestCase):
+    """
+    Tests for the asyncio daemon that runs all sync jobs in one process.
+    """
+    def run_daemon(self, daemon, seconds, while_running=None):
+        async def scenario():
+            runner = asyncio.create_task(daemon.run())
+            await asyncio.sleep(0.05)
+            if while_running:
+                while_running()
+            await asyncio.sleep(seconds)
+            daemon.stop()
+            await runner
+        asyncio.run(scenario())
+
+    def test_jobs_run_on_their_interval_without_overlapping(self):
+        """
+        Test that a slow job is never started again while its previous run is still going.
+        """
+        active = []
+        overlaps = []
+
+        def slow_sync():
+            if active:
+                overlaps.append(True)
+            active.append(True)
+            time.sleep(0.05)
+            active.pop()
+
+        job = SyncJob('slow', slow_sync, interval=0.01, jitter=0)
+        self.run_daemon(SyncDaemon([job]), 0.3)
+        self.assertGreater(job.runs, 1)
+        self.assertEqual(overlaps, [])
+
+    def test_trigger_runs_job_now(self):
+        """
+        Test that trigger() runs a job immediately instead of waiting for its interval.
+
+        - The job runs once at startup, then once more on the trigger rather than an hour later.
+        """
+        job = SyncJob('hourly', Mock(return_value={'items': 3}), interval=3600, jitter=0)
+        daemon = SyncDaemon([job])
+        self.run_daemon(daemon, 0.1, while_running=lambda: daemon.trigger('hourly'))
+        self.assertEqual(job.runs, 2)
+        self.assertEqual(job.last_result, {'items': 3})
+
+    def test_trigger_with_keys_syncs_only_those_courses(self):
+        """
+        Test that build_jobs registers a single REST job and trigger() can sync chosen courses.
+
+        - The scheduled run polls every course; the trigger polls only the named ones.
+        """
+        with patch('parsecontent1.check_for_changes') as check, patch('parsecontent1.poll_courses') as poll:
+            jobs = build_jobs(rest=True, scrape=False, interval=3600)
+            self.assertEqual([job.name for job in jobs], ['rest'])
+            for job in jobs:
+                job.jitter = 0
+            daemon = SyncDaemon(jobs)
+            self.run_daemon(daemon, 0.1, while_running=lambda: daemon.trigger('rest', keys=['_2_1', '_1_1']))
+        check.assert_called_once_with(stop=daemon.stop_event)
+        poll.assert_called_once_with(['_1_1', '_2_1'], stop=daemon.stop_event)
+
+    def test_shutdown_stops_stoppable_jobs_and_abandons_hung_ones(self):
+        """
+        Test that shutdown asks jobs to stop and does not wait past SHUTDOWN_TIMEOUT for one that ignores it.
+
+        - A stoppable job returns as soon as the stop event is set.
+        - A hung job is abandoned and run() returns well before it would finish.
+        """
+        release = threading.Event()
+        self.addCleanup(release.set)
+        polite = SyncJob('polite', lambda stop: 'stopped' if stop.wait(5) else 'timed out', interval=3600,
+                         jitter=0, stoppable=True)
+        hung = SyncJob('hung', lambda: release.wait(5), interval=3600, jitter=0)
+        start = time.perf_counter()
+        with patch('syncdaemon.SHUTDOWN_TIMEOUT', 0.2):
+            self.run_daemon(SyncDaemon([polite, hung]), 0.05)
+        self.assertLess(time.perf_counter() - start, 2)
+        self.assertEqual(polite.last_result, 'stopped')
+        self.assertIsNone(hung.last_result)
+
+    def test_failing_job_does_not_stop_the_others(self):
+        """
+        Test that an exception in one job is recorded and other jobs keep running.
+        """
+        broken = SyncJob('broken', Mock(side_effect=RuntimeError('LMS down')), interval=0.01, jitter=0)
+        healthy = SyncJob('healthy', Mock(), interval=0.01, jitter=0)
+        self.run_daemon(SyncDaemon([broken, healthy]), 0.1)
+        self.assertIsInstance(broken.last_error, RuntimeError)
+        self.assertGreater(healthy.runs, 1)
+
+class TestCalendarProjection(unittest.TestCase):
+    """
+    Tests for projecting course content due dates onto Google Calendar.
+    """
+    def setUp(self):
+        self.db = mongomock.MongoClient()['blackboard_db']
+        self.content = self.db['course_content']
+        patchers = {name: patch(f'calendarprojection.{name}')
+                    for name in ('create_events', 'update_events', 'delete_events')}
+        self.api = {name: patcher.start() for name, patcher in patchers.items()}
+        for patcher in patchers.values():
+            self.addCleanup(patcher.stop)
+        self.api['create_events'].side_effect = lambda service, events: [
+            {'ok': True, 'result': {'id': f"evt-{event['contentId']}"}} for event in events]
+        self.api['update_events'].side_effect = lambda service, events: [{'ok': True, 'result': {}} for _ in events]
+        self.api['delete_events'].side_effect = lambda service, ids: [{'ok': True, 'id': event_id} for event_id in ids]
+        self.projection = CalendarProjection(self.db, Mock())
+        self.clock = datetime(2024, 11, 1)
+
+    def store(self, *documents):
+        # Stamp syncedAt the way ContentWriter does, one second after the previous write
+        for document in documents:
+            self.clock += timedelta(seconds=1)
+            self.content.update_one({'contentId': document['contentId']},
+                                    {'$set': {**document, 'syncedAt': self.clock}}, upsert=True)
+
+    def test_creates_once_and_skips_unchanged_items(self):
+        """
+        Test that items with a due date become events once and are not re-sent on the next poll.
+        """
+        self.store({'contentId': '1', 'title': 'Essay', 'due': '2024-12-01T23:59:00Z', 'modified': '2024-11-01'},
+                   {'contentId': '2', 'title': 'Slides', 'modified': '2024-11-02'})
+        self.projection.poll_once()
+        created = self.api['create_events'].call_args[0][1]
+        self.assertEqual([(event['name'], event['date']) for event in created], [('Essay', '2024-12-01')])
+        self.assertEqual(self.db['calendar_events'].find_one({'contentId': '1'})['eventId'], 'evt-1')
+
+        self.api['create_events'].reset_mock()
+        stats = self.projection.poll_once()
+        self.api['create_events'].assert_not_called()
+        self.api['update_events'].assert_not_called()
+        self.assertEqual(stats['created'], 1)
+
+    def test_evening_deadline_lands_on_its_day_in_the_calendar_zone(self):
+        """
+        Test that a deadline at 11:59 PM Eastern, stored as 03:59 UTC the next day, gets an event on its own day.
+        """
+        event = calendarprojection.event_for({'contentId': '1', 'title': 'Essay',
+                                              'due': parse_date('2026-10-18T03:59:00Z')})
+        self.assertEqual(event['date'], '2026-10-17')
+        # Standard time: 11:59 PM EST is 04:59 UTC
+        event = calendarprojection.event_for({'contentId': '1', 'title': 'Essay',
+                                              'due': parse_date('2026-12-02T04:59:00Z')})
+        self.assertEqual(event['date'], '2026-12-01')
+        self.assertEqual(calendarprojection.event_for({'contentId': '1', 'due': datetime(2026, 10, 18)})['date'],
+                         '2026-10-18')
+
+    def test_items_stored_later_are_projected_whatever_their_modified_date(self):
+        """
+        Test that the mark follows when items were stored, not when Blackboard last changed them.
+
+        - Projects course A, then stores course B, whose item was last edited before A's.
+        - Verifies B's item is created, and so is a due date moved without a new modified date.
+        """
+        with ContentWriter(self.content) as writer:
+            writer.add({'contentId': 'a', 'courseId': 'A', 'title': 'Essay', 'due': '2024-12-01',
+                        'modified': '2024-11-10'})
+        self.projection.poll_once()
+        with ContentWriter(self.content) as writer:
+            writer.add({'contentId': 'b', 'courseId': 'B', 'title': 'Lab', 'due': '2024-12-02',
+                        'modified': '2024-09-01'})
+        self.projection.poll_once()
+        self.assertEqual(self.api['create_events'].call_args[0][1][0]['contentId'], 'b')
+
+        with ContentWriter(self.content) as writer:
+            writer.add({'contentId': 'a', 'courseId': 'A', 'title': 'Essay', 'due': '2024-12-09',
+                        'modified': '2024-11-10'})
+        self.projection.poll_once()
+        self.assertEqual(self.api['update_events'].call_args[0][1][0]['date'], '2024-12-09')
+
+    def test_changed_and_removed_due_dates_update_and_delete(self):
+        """
+        Test that a moved due date patches the event and a removed one deletes it.
+        """
+        self.store({'contentId': '1', 'title': 'Essay', 'due': datetime(2024, 12, 1), 'modified': datetime(2024, 11, 1)},
+                   {'contentId': '2', 'title': 'Quiz', 'due': datetime(2024, 12, 2), 'modified': datetime(2024, 11, 1)})
+        self.projection.poll_once()
+        self.store({'contentId': '1', 'due': datetime(2024, 12, 8), 'modified': datetime(2024, 11, 5)},
+                   {'contentId': '2', 'due': None, 'modified': datetime(2024, 11, 6)})
+        stats = self.projection.poll_once()
+        self.assertEqual(self.api['update_events'].call_args[0][1][0]['id'], 'evt-1')
+        self.assertEqual(self.api['update_events'].call_args[0][1][0]['date'], '2024-12-08')
+        self.api['delete_events'].assert_called_once_with(self.projection.service, ['evt-2'])
+        self.assertIsNone(self.db['calendar_events'].find_one({'contentId': '2'}))
+        self.assertEqual((stats['updated'], stats['deleted']), (1, 1))
+
+    def test_failed_create_is_retried_on_next_poll(self):
+        """
+        Test that the high-water mark does not move past an item whose event could not be created.
+        """
+        self.store({'contentId': '1', 'title': 'Essay', 'due': '2024-12-01', 'modified': '2024-11-01'})
+        self.api['create_events'].side_effect = lambda service, events: [{'ok': False, 'error': '500'}]
+        self.projection.poll_once()
+        self.api['create_events'].side_effect = lambda service, events: [{'ok': True, 'result': {'id': 'evt-1'}}]
+        self.projection.poll_once()
+        self.assertEqual(self.db['calendar_events'].find_one({'contentId': '1'})['eventId'], 'evt-1')
+
+    def test_invalid_due_date_is_not_sent(self):
+        """
+        Test that an item whose due date cannot be parsed gets no event and does not hold back the others.
+        """
+        self.store({'contentId': 'bad', 'title': 'Broken', 'due': 'garbage', 'modified': datetime(2024, 11, 1)})
+        self.store(*[{'contentId': str(number), 'title': f'Item {number}', 'due': datetime(2024, 12, 1),
+                      'modified': datetime(2024, 11, 2)} for number in range(80)])
+        stats = self.projection.poll_once()
+        self.assertEqual(stats['created'], 80)
+        self.assertEqual(self.db['sync_state'].find_one({'_id': 'calendar_projection'})['syncedAt'], self.clock)
+
+    def test_rejected_item_does_not_stall_the_projection(self):
+        """
+        Test that an event Google refuses is parked and the high-water mark moves past it.
+
+        - Rejects the first item with a 400 and accepts the 80 after it.
+        - Verifies every valid item is projected in one poll and the rejected one is not resent until it changes.
+        """
+        self.store({'contentId': 'bad', 'title': 'Rejected', 'due': datetime(2024, 12, 1),
+                    'modified': datetime(2024, 11, 1)})
+        self.store(*[{'contentId': str(number), 'title': f'Item {number}', 'due': datetime(2024, 12, 1),
+                      'modified': datetime(2024, 11, 2)} for number in range(80)])
+        self.api['create_events'].side_effect = lambda service, events: [
+            {'ok': False, 'error': 'invalid', 'status': 400} if event['contentId'] == 'bad'
+            else {'ok': True, 'result': {'id': f"evt-{event['contentId']}"}} for event in events]
+
+        stats = self.projection.poll_once()
+        self.assertEqual(stats['created'], 80)
+        self.assertTrue(self.db['calendar_retry'].find_one({'contentId': 'bad'})['permanent'])
+
+        self.api['create_events'].reset_mock()
+        self.store({'contentId': 'bad', 'modified': datetime(2024, 11, 3)})
+        self.projection.poll_once()
+        self.api['create_events'].assert_not_called()
+
+        self.store({'contentId': 'bad', 'title': 'Fixed', 'modified': datetime(2024, 11, 4)})
+        self.projection.poll_once()
+        self.assertEqual(self.api['create_events'].call_args[0][1][0]['name'], 'Fixed')
+
+    def test_item_failing_repeatedly_stops_holding_the_mark(self):
+        """
+        Test that after MAX_ATTEMPTS transient failures an item is retried on its own instead of blocking later items.
+        """
+        self.store({'contentId': 'flaky', 'title': 'Flaky', 'due': datetime(2024, 12, 1),
+                    'modified': datetime(2024, 11, 1)})
+        self.api['create_events'].side_effect = lambda service, events: [{'ok': False, 'error': '503', 'status': 503}]
+        for _ in range(calendarprojection.MAX_ATTEMPTS):
+            self.projection.poll_once()
+        self.assertEqual(self.db['sync_state'].find_one({'_id': 'calendar_projection'})['syncedAt'], self.clock)
+        self.assertEqual(self.db['calendar_retry'].find_one({'contentId': 'flaky'})['attempts'],
+                         calendarprojection.MAX_ATTEMPTS)
+
+        self.api['create_events'].side_effect = lambda service, events: [
+            {'ok': True, 'result': {'id': f"evt-{event['contentId']}"}} for event in events]
+        self.projection.poll_once()
+        self.assertEqual(self.db['calendar_events'].find_one({'contentId': 'flaky'})['eventId'], 'evt-flaky')
+        self.assertIsNone(self.db['calendar_retry'].find_one({'contentId': 'flaky'}))
+
+class TestRestPaging(unittest.TestCase):
+    """
+    Tests for walking a course through the REST API page by page and folder by folder.
+    """
+    @patch('parsecontent1.get_access_token', return_value='token')
+    @patch('parsecontent1.httpclient.get')
+    def test_next_pages_and_folders_are_followed(self, mock_get, mock_token):
+        """
+        Test that a two-page listing and a folder's children are all fetched.
+
+        - Verifies the relative nextPage link is resolved against the API host and keeps its own query string.
+        - Verifies the fields parameter is only added to URLs that do not carry one yet.
+        """
+        contents_url = f"{parsecontent1.BB_API_URL}/courses/_1_1/contents"
+        next_page = f"/learn/api/public/v1/courses/_1_1/contents?offset=2&fields={parsecontent1.CONTENT_FIELDS}"
+        pages = {
+            contents_url: {'results': [{'id': 'folder', 'hasChildren': True}, {'id': 'a'}],
+                           'paging': {'nextPage': next_page}},
+            'https://blackboard.example.com' + next_page: {'results': [{'id': 'b'}]},
+            f"{contents_url}/folder/children": {'results': [{'id': 'c'}]},
+        }
+        mock_get.side_effect = lambda url, headers=None, params=None: fake_response(200, json_body=pages[url])
+
+        items = list(parsecontent1.iter_course_content('_1_1', max_workers=1))
+        self.assertEqual(sorted(item['id'] for item in items), ['a', 'b', 'c', 'folder'])
+        params = {call.args[0]: call.kwargs['params'] for call in mock_get.call_args_list}
+        self.assertEqual(set(params), set(pages))
+        self.assertEqual(params[contents_url], {'fields': parsecontent1.CONTENT_FIELDS})
+        self.assertIsNone(params['https://blackboard.example.com' + next_page])
+        self.assertEqual(params[f"{contents_url}/folder/children"], {'fields': parsecontent1.CONTENT_FIELDS})
+
+    @patch('parsecontent1.get_access_token', return_value='token')
+    @patch('parsecontent1.get_db')
+    def test_due_dates_come_from_gradebook_columns(self, mock_get_db, mock_token):
+        """
+        Test that stored items get the due date of their gradebook column and ungraded items get none.
+
+        - Serves the recorded contents and gradebook columns from the Blackboard stub.
+        - Verifies the column's due date is stored rather than the end of the item's adaptive release window.
+        """
+        mock_get_db.return_value = mongomock.MongoClient()['blackboard_db']
+        server = benchstubs.start_stub(benchstubs.BlackboardHandler,
+                                       benchstubs.BlackboardData(benchstubs.Scale(courses=1, items=4)))
+        self.addCleanup(server.shutdown)
+        base = f"http://127.0.0.1:{server.server_address[1]}"
+        with patch.object(parsecontent1, 'BB_API_URL', base + benchstubs.API_PREFIX), \
+                patch.object(parsecontent1, 'GRADEBOOK_API_URL', base + benchstubs.GRADEBOOK_PREFIX):
+            self.assertEqual(parsecontent1.poll_courses(['_1_1'])['failed'], 0)
+        due = {document['title']: document['due'] for document in mock_get_db.return_value['course_content'].find()}
+        self.assertEqual(due['Assignment 1: Quiz (1)'], datetime(2024, 9, 7, 3, 59))
+        self.assertEqual(due['Lab 1: Setup (3)'], datetime(2024, 9, 4, 17, 0))
+        self.assertIsNone(due['Syllabus (2)'])
+
+class TestWorkQueue(unittest.TestCase):
+    """
+    Tests for the durable queue of per-course sync tasks.
+    """
+    def setUp(self):
+        self.db = mongomock.MongoClient()['blackboard_db']
+        self.queue = workqueue.WorkQueue(self.db, max_attempts=2)
+
+    def expire(self, **fields):
+        # Move every lease and retry delay into the past instead of sleeping
+        past = datetime(2000, 1, 1)
+        self.db['sync_tasks'].update_many({}, {'$set': {'leaseExpires': past, 'availableAt': past, **fields}})
+
+    def test_lease_is_exclusive_and_taken_over_after_expiry(self):
+        """
+        Test that a leased task is invisible to other workers until its lease runs out.
+
+        - Verifies the second worker resumes from the first one's checkpoint.
+        - Verifies the first worker can no longer write to the task.
+        """
+        self.queue.enqueue('rest', ['_1_1'])
+        first = self.queue.lease()
+        first.save(pages=3)
+        self.assertIsNone(self.queue.lease())
+
+        self.expire()
+        second = workqueue.WorkQueue(self.db).lease()
+        self.assertEqual((second.key, second.attempts, second.checkpoint), ('_1_1', 2, {'pages': 3}))
+        with self.assertRaises(workqueue.LeaseLost):
+            first.save(pages=4)
+        self.queue.complete(second)
+
+        self.queue.enqueue('rest', ['_1_1'])
+        self.assertEqual(self.queue.lease().checkpoint, {})
+
+    @patch('parsecontent1.get_db')
+    def test_empty_course_list_runs_no_leftover_tasks(self, mock_get_db):
+        """
+        Test that an empty key list leases nothing, so courses removed from the config are not synced.
+        """
+        mock_get_db.return_value = self.db
+        self.queue.enqueue('rest', ['old_course'])
+        handler = Mock(return_value={})
+        self.assertEqual(workqueue.drain(self.queue, {'rest': handler}, keys=[])['tasks'], 0)
+        self.assertEqual(parsecontent1.poll_courses([])['courses'], 0)
+        handler.assert_not_called()
+        self.assertEqual(self.queue.counts(), {'pending': 1})
+
+    def test_failing_task_is_retried_then_dead_lettered(self):
+        """
+        Test that a task that keeps failing is retried later and parked after max_attempts runs.
+        """
+        self.queue.enqueue('rest', ['_1_1'])
+        handler = Mock(side_effect=RuntimeError('boom'))
+        self.assertEqual(workqueue.drain(self.queue, {'rest': handler})['failed'], 1)
+        self.assertEqual(self.queue.counts(), {'pending': 1})
+        self.assertIsNone(self.queue.lease())
+
+        self.expire()
+        stats = workqueue.drain(self.queue, {'rest': handler})
+        self.assertEqual(stats['dead'], 1)
+        self.assertEqual(self.queue.counts(), {'dead': 1})
+        self.assertEqual(self.db['sync_dead_letters'].find_one({'_id': 'task:rest:_1_1'})['error'], 'boom')
+
+    def test_failed_writes_are_parked_and_retried(self):
+        """
+        Test that documents the writer could not store end up in the dead letters and are written on the next run.
+        """
+        broken = Mock()
+        broken.find.side_effect = RuntimeError('server down')
+        with ContentWriter(broken, on_failure=lambda documents, error: self.queue.dead_letter_items(
+                'rest', documents, error)) as writer:
+            writer.add({'contentId': '1', 'courseId': '_1_1', 'title': 'Essay'})
+        self.assertEqual(self.db['sync_dead_letters'].find_one({'_id': 'rest:1'})['error'], 'server down')
+
+        self.queue.enqueue('rest', ['_1_1'])
+        task = self.queue.lease()
+        with ContentWriter(self.db['course_content']) as writer:
+            self.assertEqual(workqueue.retry_dead_letters(task, writer), 1)
+        self.assertEqual(self.db['course_content'].find_one({'contentId': '1'})['title'], 'Essay')
+        self.assertEqual(self.db['sync_dead_letters'].count_documents({}), 0)
+
+    @patch('parsecontent1.CHECKPOINT_PAGES', 1)
+    @patch('parsecontent1.get_due_dates', Mock(return_value={}))
+    @patch('parsecontent1.get_content_page')
+    @patch('parsecontent1.get_db')
+    def test_crashed_course_resumes_from_last_checkpoint(self, mock_get_db, mock_get_page):
+        """
+        Test that a course sync that died part-way only fetches the pages it had not finished.
+
+        - Fails the third page of the first run.
+        - Verifies the next run starts at that page and the course ends up complete.
+        """
+        mock_get_db.return_value = self.db
+        contents_url = f"{parsecontent1.BB_API_URL}/courses/_1_1/contents"
+        pages = {contents_url: 'p2', 'p2': 'p3', 'p3': None}
+        fetched = []
+        crash = [True]
+
+        def get_page(url):
+            fetched.append(url)
+            if url == 'p3' and crash:
+                crash.pop()
+                raise ConnectionError('connection reset')
+            item = {'id': url, 'title': f'Item on {url}', 'modified': '2024-11-01T00:00:00Z'}
+            return [item], pages[url]
+        mock_get_page.side_effect = get_page
+
+        stats = parsecontent1.poll_courses(['_1_1'])
+        self.assertEqual((stats['failed'], stats['inserted']), (1, 2))
+        self.assertEqual(self.db['sync_tasks'].find_one()['checkpoint']['frontier'], ['p3'])
+
+        self.expire()
+        fetched.clear()
+        stats = parsecontent1.poll_courses(['_1_1'])
+        self.assertEqual(fetched, ['p3'])
+        self.assertEqual((stats['resumed'], stats['inserted']), (1, 1))
+        self.assertEqual(self.db['course_content'].count_documents({'courseId': '_1_1'}), 3)
+
+    @patch('parsecontent2.get_blackboard_session')
+    @patch('parsecontent2.get_db')
+    def test_failed_page_fetch_fails_the_scrape_task(self, mock_get_db, mock_session):
+        """
+        Test that a course page answered with an error leaves the task pending for a retry instead of done.
+        """
+        import parsecontent2
+        mock_get_db.return_value = self.db
+        mock_session.return_value.get.return_value = fake_response(503)
+        with patch.object(parsecontent2, 'validator_cache', httpclient.ValidatorCache()):
+            parsecontent2.check_for_new_content(['_1_1'])
+        task = self.db['sync_tasks'].find_one({'kind': parsecontent2.TASK_KIND, 'key': '_1_1'})
+        self.assertEqual(task['status'], 'pending')
+        self.assertIn('503', task['error'])
+
+class TestStartup(unittest.TestCase):
+    """
+    Tests that importing the modules stays cheap and free of side effects.
+    """
+    # Cold import budget per module in milliseconds, about twice what each takes today
+    IMPORT_BUDGET_MS = {
+        'metrics': 60, 'calendarsync': 120, 'syncdaemon': 200, 'httpclient': 350, 'htmlparsers': 350,
+        'contentstore': 350, 'calender': 450, 'parsecontent1': 600, 'parsecontent2': 700, 'calendarprojection': 800,
+    }
+
+    def cold_import_ms(self, module, code=''):
+        # Best of three fresh interpreters, read from -X importtime so interpreter startup is excluded
+        timings = []
+        for _ in range(3):
+            result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}\n{code}'],
+                                    capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+                                    env={**os.environ, 'EDUSYNC_MONGO_URI': 'mongodb://127.0.0.1:9/'}, timeout=60)
+            self.assertEqual(result.returncode, 0, result.stderr[-2000:])
+            line = [line for line in result.stderr.splitlines() if line.endswith(f'| {module}')][-1]
+            timings.append(int(line.split('|')[1]) / 1000)
+        return min(timings), result.stdout
+
+    def test_cold_imports_stay_within_budget(self):
+        """
+        Test that no module takes longer to import than its budget.
+        """
+        for module, budget in self.IMPORT_BUDGET_MS.items():
+            with self.subTest(module=module):
+                elapsed, _ = self.cold_import_ms(module)
+                self.assertLess(elapsed, budget, f"import {module} took {elapsed:.0f}ms (budget {budget}ms)")
+
+    def test_imports_have_no_side_effects(self):
+        """
+        Test that importing the parsers and the calendar app neither connects to MongoDB nor loads the Google client.
+
+        - Points MongoDB at a closed port so any connection attempt at import would fail or hang.
+        """
+        code = ('import sys, calender, parsecontent1, parsecontent2, contentstore\n'
+                'print(contentstore._db is None, "googleapiclient.discovery" in sys.modules,'
+                ' "google_auth_oauthlib" in sys.modules)')
+        _, output = self.cold_import_ms('calendarprojection', code)
+        self.assertEqual(output.split(), ['True', 'False', 'False'])
+
+    def test_get_db_connects_once_and_creates_indexes(self):
+        """
+        Test that get_db() uses the client given to init() and creates the course_content indexes.
+        """
+        self.addCleanup(contentstore.close)
+        client = mongomock.MongoClient()
+        db = contentstore.init(client=client, db_name='test_db')
+        self.assertIs(contentstore.get_db(), db)
+        self.assertEqual(db.name, 'test_db')
+        self.assertIn('courseId_1_due_1', db['course_content'].index_information())
+
+class TestScrapeSession(unittest.TestCase):
+    """
+    Tests for the scraper's persisted cookies and re-login against the Blackboard stub.
+    """
+    def setUp(self):
+        httpclient.reset_hosts()
+        self.server = benchstubs.start_stub(benchstubs.BlackboardHandler,
+                                            benchstubs.BlackboardData(benchstubs.Scale(courses=1, items=3)))
+        self.addCleanup(self.server.shutdown)
+        self.base = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.cookie_dir = tempfile.mkdtemp()
+        metrics.reset()
+
+    def make_session(self, pool_size=4):
+        return scrapesession.BlackboardSession(f"{self.base}/webapps/login/", 'student', {'user_id': 'student'},
+                                               cookie_dir=self.cookie_dir, pool_size=pool_size)
+
+    def test_expired_session_logs_in_once_and_cookies_survive_a_restart(self):
+        """
+        Test that a login page triggers one login and that a new process reuses the saved cookies.
+
+        - Verifies the cookie jar file is only readable by its owner.
+        - Verifies the second session fetches the page without posting the login form.
+        """
+        url = f"{self.base}/learn/course_content/_1_1"
+        response = self.make_session().get(url)
+        self.assertIn(b'content-block', response.content)
+        self.assertEqual(scrapesession.LOGINS.value(outcome='ok'), 1)
+        path = scrapesession.cookie_file(f"{self.base}/webapps/login/", 'student', self.cookie_dir)
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+
+        restarted = self.make_session()
+        self.assertTrue(restarted.ensure_logged_in())
+        self.assertIn(b'content-block', restarted.get(url).content)
+        self.assertEqual(scrapesession.LOGINS.value(outcome='ok'), 1)
+
+    def test_parallel_requests_share_a_single_relogin(self):
+        """
+        Test that many threads finding the session expired at once cause exactly one login.
+        """
+        session = self.make_session()
+        pages = []
+        threads = [threading.Thread(target=lambda: pages.append(session.get(f"{self.base}/learn/course_content/_1_1")))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+        self.assertEqual(len(pages), 4)
+        self.assertEqual(scrapesession.LOGINS.value(outcome='ok'), 1)
+
+    def test_concurrent_workers_share_one_scraper_session(self):
+        """
+        Test that workers asking for the scraper's session at the same time all get the same one.
+        """
+        import parsecontent2
+
+        def slow_session(*args, **kwargs):
+            time.sleep(0.05)
+            return Mock()
+        sessions = []
+        with patch.object(parsecontent2, 'blackboard', None), \
+                patch('parsecontent2.BlackboardSession', side_effect=slow_session) as mock_session:
+            threads = [threading.Thread(target=lambda: sessions.append(parsecontent2.get_blackboard_session()))
+                       for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(5)
+        self.assertEqual(mock_session.call_count, 1)
+        self.assertEqual(len(set(map(id, sessions))), 1)
+
+    def test_login_page_detection(self):
+        """
+        Test that redirects to the login page, 401/403 and an inline login form all count as expired.
+        """
+        page = Mock(status_code=200, url='https://lms.test/learn/course_content/x', history=[], content=b'<div></div>')
+        self.assertFalse(scrapesession.is_login_page(page))
+        redirected = Mock(status_code=200, url='https://lms.test/webapps/login/', history=[], content=b'')
+        self.assertTrue(scrapesession.is_login_page(redirected))
+        form = Mock(status_code=200, url=page.url, history=[], content=b'<input name="user_id">')
+        self.assertTrue(scrapesession.is_login_page(form))
+        self.assertTrue(scrapesession.is_login_page(Mock(status_code=403, url=page.url, history=[], content=b'')))
+
+class TestBenchmark(unittest.TestCase):
+    """
+    Tests for the offline benchmark's stub servers and result comparison.
+    """
+    def test_percentiles_and_regression_check(self):
+        """
+        Test nearest-rank percentiles and that slower runs are flagged against the baseline.
+        """
+        samples = list(range(1, 101))
+        self.assertEqual((percentile(samples, 0.5), percentile(samples, 0.99)), (50, 99))
+        baseline = {'rest_sync': {'throughput': 100.0, 'p99_ms': 10.0}}
+        lines, regressed = compare({'rest_sync': {'throughput': 80.0, 'p99_ms': 10.0}}, baseline)
+        self.assertTrue(regressed)
+        self.assertIn('REGRESSION', lines[0])
+        _, regressed = compare({'rest_sync': {'throughput': 105.0, 'p99_ms': 10.5}}, baseline)
+        self.assertFalse(regressed)
+
+    def test_stubs_replay_recorded_responses_at_scale(self):
+        """
+        Test that the stubs page through scaled Blackboard content and answer Google batch requests.
+
+        - Verifies Blackboard pagination follows nextPage up to the requested item count.
+        - Verifies a real Calendar service object can list and batch-create against the Google stub.
+        """
+        scale = benchstubs.Scale(courses=1, items=130, events=12)
+        blackboard = benchstubs.start_stub(benchstubs.BlackboardHandler, benchstubs.BlackboardData(scale))
+        google = benchstubs.start_stub(benchstubs.GoogleHandler, benchstubs.GoogleData(scale))
+        self.addCleanup(blackboard.shutdown)
+        self.addCleanup(google.shutdown)
+
+        base = f"http://127.0.0.1:{blackboard.server_address[1]}"
+        url, items = f"{base}{benchstubs.API_PREFIX}/courses/_1_1/contents", []
+        while url:
+            page = httpclient.get(url).json()
+            items.extend(page['results'])
+            url = base + page['paging']['nextPage'] if 'paging' in page else None
+        self.assertEqual(len(items), 130)
+
+        service = calendar_service(f"http://127.0.0.1:{google.server_address[1]}")
+        self.assertEqual(len(list(iter_events(service, page_size=5))), 12)
+        results = create_events(service, [{'name': 'Essay', 'date': '2024-12-01'}, {'name': 'Quiz', 'date': '2024-12-02'}])
+        self.assertEqual([result['result']['summary'] for result in results], ['Essay', 'Quiz'])
+
+if __name__ == '__main__':
+    unittest.main()
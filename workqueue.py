@@ -0,0 +1,380 @@
+###DURABLE QUEUE OF PER-COURSE SYNC TASKS IN MONGODB. TASKS ARE LEASED, CHECKPOINT THEIR PROGRESS AND PARK ITEMS THAT KEEP FAILING IN A DEAD-LETTER COLLECTION. RUN "python workqueue.py" ON ANY NUMBER OF HOSTS TO HELP DRAIN IT###
+import argparse
+import logging
+import os
+import socket
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from datetime import datetime, timedelta, timezone
+from pymongo import ASCENDING, DeleteOne, IndexModel, ReturnDocument, UpdateOne
+from contentstore import ContentWriter
+import metrics
+
+# Collections holding the tasks and the items/tasks that kept failing
+TASKS_COLLECTION = "sync_tasks"
+DEAD_LETTERS_COLLECTION = "sync_dead_letters"
+# Seconds a worker owns a task without checkpointing before another worker may take it over
+LEASE_SECONDS = 300
+# Runs of a task (crashed runs included) before it is moved to the dead letters
+MAX_ATTEMPTS = 5
+# Seconds before a failed task is retried, doubled after every further failure
+RETRY_DELAY = 30
+# Retries of a parked item before it is left for someone to look at
+MAX_ITEM_ATTEMPTS = 5
+# Seconds an idle worker waits before asking for a task again (only with --follow)
+IDLE_SECONDS = 5.0
+
+TASKS = metrics.counter("edusync_sync_tasks_total", "Sync tasks finished by workers, by kind and outcome.",
+                        ("kind", "outcome"))
+DEAD_LETTERS = metrics.counter("edusync_dead_letters_total", "Items and tasks parked in the dead letters.", ("kind",))
+
+INDEXES = [
+    IndexModel([("status", ASCENDING), ("availableAt", ASCENDING)]),
+    IndexModel([("status", ASCENDING), ("leaseExpires", ASCENDING)]),
+]
+
+def _now():
+    # Naive UTC, the way pymongo returns datetimes, so values read back compare with fresh ones
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+class LeaseLost(Exception):
+    """
+    The task's lease expired and another worker took it over; the current run must stop.
+    """
+
+class Task:
+    """
+    One leased unit of sync work, e.g. one course of the REST sync.
+    """
+
+    def __init__(self, queue, document, lease_token):
+        self.queue = queue
+        self.id = document["_id"]
+        self.kind = document["kind"]
+        self.key = document["key"]
+        self.attempts = document.get("attempts", 0)
+        # Progress saved by an earlier run that did not finish; empty for a fresh task
+        self.checkpoint = document.get("checkpoint") or {}
+        self.lease_token = lease_token
+
+    def save(self, **progress):
+        """
+        Record progress and renew the lease. A crashed run is resumed from the last save.
+
+        Raises:
+            LeaseLost: The lease expired and the task now belongs to another worker.
+        """
+        self.checkpoint = {**self.checkpoint, **progress}
+        self.queue.checkpoint(self, self.checkpoint)
+
+class WorkQueue:
+    """
+    Sync tasks keyed by (kind, key) in a MongoDB collection, shared by every worker process.
+
+    A task is pending, leased, done or dead. Workers lease pending tasks (or leased
+    ones whose lease expired because their worker died) with one atomic
+    find_one_and_update, so each task runs on one worker at a time. Failed tasks are
+    retried with a growing delay and moved to the dead letters after MAX_ATTEMPTS runs.
+    """
+
+    def __init__(self, db, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS,
+                 max_item_attempts=MAX_ITEM_ATTEMPTS, retry_delay=RETRY_DELAY):
+        """
+        Args:
+            db (pymongo.database.Database): Database holding the queue collections.
+            lease_seconds (float): Seconds a lease lasts without a checkpoint.
+            max_attempts (int): Runs of a task before it is dead-lettered.
+            max_item_attempts (int): Retries of a parked item before it is left alone.
+            retry_delay (float): Seconds before the first retry of a failed task.
+        """
+        self.tasks = db[TASKS_COLLECTION]
+        self.dead = db[DEAD_LETTERS_COLLECTION]
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.max_item_attempts = max_item_attempts
+        self.retry_delay = retry_delay
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.tasks.create_indexes(INDEXES)
+        self.dead.create_index([("kind", ASCENDING), ("key", ASCENDING)])
+
+    def enqueue(self, kind, keys):
+        """
+        Queue one task per key for a new cycle.
+
+        Tasks that are still pending or leased from an earlier cycle are left as they
+        are, so an interrupted cycle resumes from its checkpoints instead of starting over.
+        Finished and dead tasks start again from scratch.
+
+        Args:
+            kind (str): Task kind, e.g. "rest" or "scrape".
+            keys (list): One key per task, e.g. course IDs.
+        """
+        now = _now()
+        operations = []
+        for key in keys:
+            task_id = f"{kind}:{key}"
+            operations.append(UpdateOne({"_id": task_id, "status": {"$in": ["done", "dead"]}}, {"$set": {
+                "status": "pending", "attempts": 0, "checkpoint": {}, "availableAt": now, "error": None}}))
+            operations.append(UpdateOne({"_id": task_id}, {"$setOnInsert": {
+                "kind": kind, "key": key, "status": "pending", "attempts": 0, "checkpoint": {},
+                "availableAt": now, "created": now}}, upsert=True))
+        if operations:
+            self.tasks.bulk_write(operations, ordered=True)
+
+    def lease(self, kinds=None, keys=None):
+        """
+        Take the next runnable task.
+
+        Args:
+            kinds (list, optional): Only take tasks of these kinds.
+            keys (list, optional): Only take tasks with these keys; an empty list matches no task.
+
+        Returns:
+            Task: The leased task, or None when nothing is runnable right now.
+        """
+        now = _now()
+        query = {"$or": [{"status": "pending", "availableAt": {"$lte": now}},
+                         {"status": "leased", "leaseExpires": {"$lt": now}}]}
+        if kinds:
+            query["kind"] = {"$in": list(kinds)}
+        if keys is not None:
+            query["key"] = {"$in": list(keys)}
+        token = uuid.uuid4().hex
+        document = self.tasks.find_one_and_update(
+            query,
+            {"$set": {"status": "leased", "leaseToken": token, "leaseOwner": self.worker_id,
+                      "leaseExpires": now + timedelta(seconds=self.lease_seconds)},
+             "$inc": {"attempts": 1}},
+            sort=[("availableAt", ASCENDING)], return_document=ReturnDocument.AFTER)
+        return Task(self, document, token) if document else None
+
+    def _update_leased(self, task, update):
+        result = self.tasks.update_one({"_id": task.id, "status": "leased", "leaseToken": task.lease_token}, update)
+        if result.matched_count == 0:
+            raise LeaseLost(f"Lease on {task.id} was taken over by another worker")
+
+    def checkpoint(self, task, progress):
+        """
+        Store a task's progress and renew its lease.
+
+        Raises:
+            LeaseLost: The task is no longer leased by this run.
+        """
+        self._update_leased(task, {"$set": {
+            "checkpoint": progress, "leaseExpires": _now() + timedelta(seconds=self.lease_seconds)}})
+
+    def complete(self, task, result=None):
+        """
+        Mark a task as done for this cycle.
+        """
+        self._update_leased(task, {"$set": {"status": "done", "finished": _now(), "result": result, "error": None},
+                                   "$unset": {"leaseToken": "", "leaseExpires": ""}})
+        TASKS.inc(kind=task.kind, outcome="done")
+
+    def fail(self, task, error):
+        """
+        Put a failed task back for a later retry, or dead-letter it after max_attempts runs.
+
+        The checkpoint is kept, so the retry continues where the failed run stopped.
+
+        Returns:
+            bool: Whether the task was dead-lettered.
+        """
+        if task.attempts >= self.max_attempts:
+            self._update_leased(task, {"$set": {"status": "dead", "error": str(error)},
+                                       "$unset": {"leaseToken": "", "leaseExpires": ""}})
+            self.dead.update_one({"_id": f"task:{task.id}"}, {
+                "$set": {"kind": task.kind, "key": task.key, "error": str(error), "lastFailed": _now(),
+                         "attempts": task.attempts},
+                "$setOnInsert": {"firstFailed": _now()}}, upsert=True)
+            DEAD_LETTERS.inc(kind=task.kind)
+            TASKS.inc(kind=task.kind, outcome="dead")
+            return True
+        delay = self.retry_delay * 2 ** (task.attempts - 1)
+        self._update_leased(task, {"$set": {"status": "pending", "error": str(error),
+                                            "availableAt": _now() + timedelta(seconds=delay)},
+                                   "$unset": {"leaseToken": "", "leaseExpires": ""}})
+        TASKS.inc(kind=task.kind, outcome="failed")
+        return False
+
+    def dead_letter_items(self, kind, documents, error, key_field="courseId"):
+        """
+        Park documents that could not be stored so a later run retries them.
+
+        Args:
+            kind (str): Kind of the task the documents came from.
+            documents (list): Documents with a contentId; a document parked again has its attempts raised.
+            error (str): Why they failed.
+            key_field (str): Field of the document naming the task key.
+        """
+        now = _now()
+        operations = [UpdateOne({"_id": f"{kind}:{document['contentId']}"}, {
+            "$set": {"kind": kind, "key": document.get(key_field), "document": document, "error": str(error),
+                     "lastFailed": now},
+            "$inc": {"attempts": 1},
+            "$setOnInsert": {"firstFailed": now}}, upsert=True) for document in documents]
+        if operations:
+            self.dead.bulk_write(operations, ordered=False)
+            DEAD_LETTERS.inc(len(operations), kind=kind)
+
+    def dead_letter_item(self, task, item, error):
+        """
+        Park a raw item that could not even be turned into a document. It is kept for
+        inspection and not retried, since it would fail the same way again.
+        """
+        item_id = item.get("id") if isinstance(item, dict) else None
+        self.dead.update_one({"_id": f"{task.kind}:raw:{item_id or uuid.uuid4().hex}"}, {
+            "$set": {"kind": task.kind, "key": task.key, "item": item, "error": str(error), "lastFailed": _now()},
+            "$inc": {"attempts": 1}}, upsert=True)
+        DEAD_LETTERS.inc(kind=task.kind)
+
+    def retryable_items(self, kind, key):
+        """
+        Returns:
+            list: Parked documents of one task that have not used up their retries.
+        """
+        return list(self.dead.find({"kind": kind, "key": key, "document": {"$exists": True},
+                                    "attempts": {"$lt": self.max_item_attempts}}))
+
+    def resolve(self, letters):
+        """
+        Drop dead letters whose retry succeeded. Letters that failed again in the
+        meantime have a higher attempts count and are kept.
+        """
+        operations = [DeleteOne({"_id": letter["_id"], "attempts": letter["attempts"]}) for letter in letters]
+        if operations:
+            self.dead.bulk_write(operations, ordered=False)
+
+    def counts(self):
+        """
+        Returns:
+            dict: Number of tasks per status.
+        """
+        return {row["_id"]: row["count"] for row in self.tasks.aggregate(
+            [{"$group": {"_id": "$status", "count": {"$sum": 1}}}])}
+
+def task_writer(queue, kind):
+    """
+    Open the ContentWriter of a sync cycle, parking the documents it cannot store in the queue's dead letters.
+
+    Args:
+        queue (WorkQueue): Queue the tasks come from; content is written to the same database.
+        kind (str): Task kind the parked documents belong to, e.g. "rest" or "scrape".
+
+    Returns:
+        contentstore.ContentWriter: Writer to use as a context manager.
+    """
+    db = queue.tasks.database
+    return ContentWriter(db['course_content'], changes_collection=db['content_changes'],
+                         on_failure=lambda documents, error: queue.dead_letter_items(kind, documents, error))
+
+def retry_dead_letters(task, writer):
+    """
+    Write a task's parked documents again and drop the ones that went through.
+
+    Args:
+        task (Task): The running task.
+        writer (contentstore.ContentWriter): Writer whose failures are parked in task.queue.
+
+    Returns:
+        int: Number of parked documents retried.
+    """
+    letters = task.queue.retryable_items(task.kind, task.key)
+    for letter in letters:
+        writer.add(letter["document"])
+    if letters:
+        writer.flush()
+        task.queue.resolve(letters)
+    return len(letters)
+
+def _work(queue, handlers, kinds, keys, stop, follow, idle_seconds):
+    stats = {"tasks": 0, "failed": 0, "dead": 0, "resumed": 0}
+    while not stop.is_set():
+        task = queue.lease(kinds, keys)
+        if task is None:
+            if not follow:
+                break
+            stop.wait(idle_seconds)
+            continue
+        stats["tasks"] += 1
+        stats["resumed"] += bool(task.checkpoint)
+        try:
+            result = handlers[task.kind](task) or {}
+            queue.complete(task, result)
+        except LeaseLost as e:
+            # Another worker owns the task now; leave it alone
+            metrics.log_event("task_lease_lost", level=logging.WARNING, task=task.id, error=str(e))
+            continue
+        except Exception as e:
+            metrics.log_event("task_failed", level=logging.ERROR, task=task.id, attempt=task.attempts, error=str(e))
+            stats["failed"] += 1
+            try:
+                stats["dead"] += queue.fail(task, e)
+            except LeaseLost:
+                pass
+            continue
+        for field, value in result.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                stats[field] = stats.get(field, 0) + value
+    return stats
+
+def drain(queue, handlers, threads=1, kinds=None, keys=None, stop=None, follow=False, idle_seconds=IDLE_SECONDS):
+    """
+    Run queued tasks on worker threads until none is runnable (or until stopped, with follow).
+
+    Args:
+        queue (WorkQueue): Queue to take tasks from.
+        handlers (dict): Task kind -> callable(task) returning a dict of counts; raising marks the task failed.
+        threads (int): Tasks run at the same time in this process.
+        kinds (list, optional): Only run tasks of these kinds. Defaults to the kinds in `handlers`.
+        keys (list, optional): Only run tasks with these keys; None runs tasks of any key.
+        stop (threading.Event, optional): Set to stop after the running tasks.
+        follow (bool): Keep waiting for new tasks instead of returning once the queue is empty.
+        idle_seconds (float): Wait between polls of an empty queue with follow.
+
+    Returns:
+        dict: Tasks run, failed, dead-lettered and resumed from a checkpoint, plus the summed handler counts.
+    """
+    kinds = kinds or list(handlers)
+    stop = stop or threading.Event()
+    totals = {}
+    with ThreadPoolExecutor(max_workers=max(1, threads)) as executor:
+        futures = [executor.submit(_work, queue, handlers, kinds, keys, stop, follow, idle_seconds)
+                   for _ in range(max(1, threads))]
+        for future in futures:
+            for field, value in future.result().items():
+                totals[field] = totals.get(field, 0) + value
+    return totals
+
+def main():
+    parser = argparse.ArgumentParser(description="Work on the queued Blackboard sync tasks.")
+    parser.add_argument("--kind", action="append", choices=["rest", "scrape"],
+                        help="only run tasks of this kind (repeatable; default: both)")
+    parser.add_argument("--threads", type=int, default=4, help="tasks run at the same time")
+    parser.add_argument("--follow", action="store_true", help="keep waiting for new tasks instead of exiting")
+    parser.add_argument("--status", action="store_true", help="print the number of tasks per status and exit")
+    args = parser.parse_args()
+
+    from contentstore import get_db
+    queue = WorkQueue(get_db())
+    if args.status:
+        print(queue.counts())
+        return
+    kinds = args.kind or ["rest", "scrape"]
+    handlers = {}
+    with ExitStack() as stack:
+        # Each parser writes through its own ContentWriter, whose failed documents are parked in the queue
+        if "rest" in kinds:
+            import parsecontent1
+            rest_writer = stack.enter_context(task_writer(queue, parsecontent1.TASK_KIND))
+            handlers[parsecontent1.TASK_KIND] = lambda task: parsecontent1.sync_course_task(task, rest_writer)
+        if "scrape" in kinds:
+            import parsecontent2
+            scrape_writer = stack.enter_context(task_writer(queue, parsecontent2.TASK_KIND))
+            handlers[parsecontent2.TASK_KIND] = lambda task: parsecontent2.scrape_course_task(task, scrape_writer)
+        print(drain(queue, handlers, args.threads, follow=args.follow))
+
+if __name__ == "__main__":
+    main()